@@ -0,0 +1,13 @@
+"""
+ChitUI Core Services
+
+Upload and transfer helpers shared by main.py and the plugins.
+"""
+
+from .file_header import HEADER_CAPTURE_SIZE, parse_print_file_header, read_print_file_header
+from .upload_ingest import IngestFile, make_ingest_request_class, save_upload
+
+__all__ = [
+    'HEADER_CAPTURE_SIZE', 'parse_print_file_header', 'read_print_file_header',
+    'IngestFile', 'make_ingest_request_class', 'save_upload',
+]
@@ -0,0 +1,99 @@
+"""
+Adaptive Part Sizing for Chunked Printer Uploads
+
+Every part posted to the printer pays a fixed cost (request round trip and
+the printer writing the part to its storage), so small parts waste time on
+fast links while very large parts make every retry expensive and can exceed
+what a printer's firmware accepts. AdaptiveChunkSizer measures each part
+and doubles the part size while that still improves throughput, halves it
+when parts get slow or fail, and reports the best size it found. The
+TransferStrategyCache (transfer_strategy.py) keeps that size per printer
+model and firmware so the next upload starts from it.
+"""
+
+
+from loguru import logger
+
+
+PART_SIZE = 1048576              # Default part size (1MB)
+MIN_PART_SIZE = 256 * 1024       # Never send parts smaller than this
+MAX_PART_SIZE = 8 * 1048576      # ...or larger than this
+TARGET_PART_TIME = 5.0           # Seconds; keeps parts far below the 30s request timeout
+SAMPLES_PER_SIZE = 2             # Parts measured before deciding to grow
+GAIN_THRESHOLD = 0.05            # Growing must improve throughput by at least 5%
+EWMA_ALPHA = 0.5
+
+
+def clamp_part_size(size, min_size=MIN_PART_SIZE, max_size=MAX_PART_SIZE):
+    """Clamp a part size into the safe range"""
+    return max(min_size, min(max_size, int(size)))
+
+
+class AdaptiveChunkSizer:
+    """Chooses the size of the next upload part from measured throughput"""
+
+    def __init__(self, initial=PART_SIZE, min_size=MIN_PART_SIZE, max_size=MAX_PART_SIZE,
+                 target_time=TARGET_PART_TIME):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_time = target_time
+        self.size = clamp_part_size(initial, min_size, max_size)
+        self._throughput = {}  # part size -> smoothed bytes/second
+        self._parts = 0        # parts measured at the current size
+        self._settled = False
+        self.slowest = 0.0     # Longest time a part took (seconds)
+
+    def _resize(self, size, settle=False):
+        size = clamp_part_size(size, self.min_size, self.max_size)
+        if size != self.size:
+            logger.debug(f"Upload part size {self.size // 1024} KB -> {size // 1024} KB")
+        self.size = size
+        self._parts = 0
+        self._settled = self._settled or settle
+
+    def record(self, nbytes, elapsed):
+        """Feed the measurement of one acknowledged part"""
+        self.slowest = max(self.slowest, elapsed)
+        if elapsed <= 0 or nbytes < self.size // 2:
+            # The short final part says little about the current size
+            return
+
+        throughput = nbytes / elapsed
+        previous = self._throughput.get(self.size)
+        if previous is None:
+            self._throughput[self.size] = throughput
+        else:
+            self._throughput[self.size] = previous * (1 - EWMA_ALPHA) + throughput * EWMA_ALPHA
+        self._parts += 1
+
+        if elapsed > self.target_time:
+            # Link slowed down: keep individual requests short
+            self._resize(self.size // 2, settle=True)
+            return
+
+        if self._settled or self._parts < SAMPLES_PER_SIZE:
+            return
+
+        smaller = self._throughput.get(self.size // 2)
+        if smaller is not None and self._throughput[self.size] < smaller * (1 + GAIN_THRESHOLD):
+            # Larger parts stopped paying off
+            self._resize(self.size // 2, settle=True)
+        elif self.size * 2 <= self.max_size and elapsed * 2 <= self.target_time:
+            self._resize(self.size * 2)
+        else:
+            self._settled = True
+
+    def can_shrink(self):
+        return self.size > self.min_size
+
+    def failed(self):
+        """A part failed: stay below the failing size for the rest of the transfer"""
+        self.max_size = max(self.min_size, self.size // 2)
+        self._resize(self.max_size, settle=True)
+
+    @property
+    def best_size(self):
+        """Part size with the highest measured throughput"""
+        if not self._throughput:
+            return self.size
+        return max(self._throughput, key=self._throughput.get)
@@ -0,0 +1,489 @@
+"""
+FAT32 Image Files
+
+Reads and changes the FAT32 file system inside the virtual USB drive's
+backing file (/piusb.bin) without mounting it: files are added and removed
+by writing the directory entries, the allocation tables and the file data
+straight into the image. Long file names (VFAT) are read and written, so
+names like 'Benchy 0.05mm.goo' survive.
+
+Nothing else may use the image while a FatImage has it open - neither a
+loop mount on the Pi nor the printer through an inserted USB LUN.
+format_image creates an empty image (like 'mkfs.vfat -F 32').
+"""
+
+import os
+import re
+import struct
+import time
+from array import array
+from collections import namedtuple
+
+from loguru import logger
+
+
+FREE = 0
+END_OF_CHAIN = 0x0FFFFFFF
+CLUSTER_MASK = 0x0FFFFFFF
+ATTR_READ_ONLY, ATTR_HIDDEN, ATTR_SYSTEM, ATTR_VOLUME_ID, ATTR_DIRECTORY, ATTR_ARCHIVE = 1, 2, 4, 8, 16, 32
+ATTR_LONG_NAME = 0x0F
+DELETED = 0xE5
+ENTRY = struct.Struct('<11sBBBHHHHHHHI')
+ENTRY_SIZE = 32
+COPY_SIZE = 1048576     # Bytes copied into the image at a time
+SHORT_NAME_CHARS = re.compile(r'[^A-Z0-9!#$%&\'()@^_`{}~\-\x80-\xff]')
+
+
+class FatImageError(Exception):
+    """The image is not a FAT32 file system or an operation is not possible"""
+
+
+FatEntry = namedtuple('FatEntry', ['name', 'is_dir', 'size', 'mtime', 'cluster', 'short_name', 'slots'])
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(max(timestamp, 315532800))  # FAT dates start in 1980
+    return ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday, (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+
+
+def _from_dos_datetime(date, dos_time):
+    try:
+        return time.mktime((1980 + (date >> 9), (date >> 5) & 0xF, date & 0x1F,
+                            dos_time >> 11, (dos_time >> 5) & 0x3F, (dos_time & 0x1F) * 2, 0, 0, -1))
+    except (OverflowError, ValueError):
+        return 0.0
+
+
+def _short_name_checksum(short_name):
+    checksum = 0
+    for byte in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+def _short_name_parts(name):
+    """8.3 base and extension for a name (uppercased, invalid characters replaced)"""
+    stem, dot, ext = name.lstrip('.').rpartition('.')
+    if not dot:
+        stem, ext = ext, ''
+    clean = lambda part: SHORT_NAME_CHARS.sub('_', part.upper().replace(' ', '').replace('.', ''))
+    return clean(stem), clean(ext)
+
+
+def _format_short_name(base, ext):
+    return base.ljust(8).encode('ascii', 'replace') + ext.ljust(3).encode('ascii', 'replace')
+
+
+def _short_name_text(raw):
+    base, ext = raw[:8].decode('ascii', 'replace').rstrip(), raw[8:].decode('ascii', 'replace').rstrip()
+    return f"{base}.{ext}" if ext else base
+
+
+def format_image(path, size, label='PI_USB'):
+    """Create an empty FAT32 image file of size bytes"""
+    sector_size, reserved, fats = 512, 32, 2
+    sectors = size // sector_size
+    # Cluster sizes of the FAT32 specification's table
+    for limit, sectors_per_cluster in ((532480, 1), (16777216, 8), (33554432, 16), (67108864, 32), (None, 64)):
+        if limit is None or sectors <= limit:
+            break
+    fat_sectors = -(-(sectors - reserved) // ((256 * sectors_per_cluster + fats) // 2))
+    clusters = (sectors - reserved - fats * fat_sectors) // sectors_per_cluster
+    if clusters < 65525:
+        raise FatImageError(f"{size} bytes is too small for FAT32")
+
+    boot = bytearray(sector_size)
+    boot[0:3] = b'\xEB\x58\x90'
+    boot[3:11] = b'MSWIN4.1'
+    struct.pack_into('<HBHBHHBHHHII', boot, 11, sector_size, sectors_per_cluster, reserved, fats, 0, 0, 0xF8, 0,
+                     32, 64, 0, sectors)
+    struct.pack_into('<IHHIHH', boot, 36, fat_sectors, 0, 0, 2, 1, 6)
+    struct.pack_into('<BBBI11s8s', boot, 64, 0x80, 0, 0x29, int(time.time()) & 0xFFFFFFFF,
+                     label.upper()[:11].ljust(11).encode('ascii', 'replace'), b'FAT32   ')
+    boot[510:512] = b'\x55\xAA'
+
+    fsinfo = bytearray(sector_size)
+    struct.pack_into('<I', fsinfo, 0, 0x41615252)
+    struct.pack_into('<III', fsinfo, 484, 0x61417272, clusters - 1, 3)
+    struct.pack_into('<I', fsinfo, 508, 0xAA550000)
+
+    fat = bytearray(sector_size)
+    struct.pack_into('<III', fat, 0, 0x0FFFFFF8, END_OF_CHAIN, END_OF_CHAIN)
+
+    cluster_size = sectors_per_cluster * sector_size
+    root = bytearray(cluster_size)
+    ENTRY.pack_into(root, 0, label.upper()[:11].ljust(11).encode('ascii', 'replace'), ATTR_VOLUME_ID,
+                    0, 0, 0, 0, 0, 0, *reversed(_dos_datetime(time.time())), 0, 0)
+
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        for start in (0, 6 * sector_size):  # Boot sector and its backup
+            f.seek(start)
+            f.write(boot)
+            f.write(fsinfo)
+        for copy in range(fats):
+            f.seek((reserved + copy * fat_sectors) * sector_size)
+            f.write(fat)
+        f.seek((reserved + fats * fat_sectors) * sector_size)
+        f.write(root)
+
+
+class FatImage:
+    """A FAT32 file system in an image file, changed in place"""
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._fd = os.open(path, os.O_RDONLY if readonly else os.O_RDWR)
+        try:
+            self._read_boot_sector()
+            fat = os.pread(self._fd, self.fat_sectors * self.sector_size, self.fat_start)
+            self._fat = array('I', fat[:(self.clusters + 2) * 4])
+        except Exception:
+            os.close(self._fd)
+            raise
+        self._dirty = None      # (first, last) FAT index changed since the last flush
+        self._next_free = 2
+        self._free = self._fat[2:].count(FREE)
+
+    def _read_boot_sector(self):
+        boot = os.pread(self._fd, 512, 0)
+        if len(boot) < 512 or boot[510:512] != b'\x55\xAA':
+            raise FatImageError(f"{self.path} has no FAT boot sector")
+        (self.sector_size, self.sectors_per_cluster, reserved, self.fat_count, root_entries, total16, _media,
+         fat16_sectors, _track, _heads, _hidden, total32) = struct.unpack_from('<HBHBHHBHHHII', boot, 11)
+        self.fat_sectors, _flags, _version, self.root_cluster, self.fsinfo_sector = \
+            struct.unpack_from('<IHHIH', boot, 36)
+        if fat16_sectors or root_entries or not self.fat_sectors or self.sector_size not in (512, 1024, 2048, 4096):
+            raise FatImageError(f"{self.path} is not a FAT32 file system")
+        total = total16 or total32
+        self.fat_start = reserved * self.sector_size
+        self.data_start = (reserved + self.fat_count * self.fat_sectors) * self.sector_size
+        self.cluster_size = self.sectors_per_cluster * self.sector_size
+        self.clusters = (total * self.sector_size - self.data_start) // self.cluster_size
+        if self.clusters < 65525:
+            raise FatImageError(f"{self.path} is not a FAT32 file system ({self.clusters} clusters)")
+
+    def close(self):
+        if self._fd is None:
+            return
+        try:
+            self.flush()
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def flush(self):
+        """Write the changed allocation table range and free count to disk"""
+        if self.readonly:
+            return
+        if self._dirty:
+            first, last = self._dirty
+            # Whole sectors, so the table's reserved high bits are written back as read
+            per_sector = self.sector_size // 4
+            first, last = first - first % per_sector, min(last - last % per_sector + per_sector, len(self._fat))
+            data = self._fat[first:last].tobytes()
+            for copy in range(self.fat_count):
+                os.pwrite(self._fd, data, self.fat_start + copy * self.fat_sectors * self.sector_size + first * 4)
+            self._dirty = None
+        if self.fsinfo_sector:
+            os.pwrite(self._fd, struct.pack('<II', self._free, self._next_free),
+                      self.fsinfo_sector * self.sector_size + 488)
+        os.fsync(self._fd)
+
+    # ===== Clusters =====
+
+    def _get(self, cluster):
+        return self._fat[cluster] & CLUSTER_MASK
+
+    def _set(self, cluster, value):
+        self._fat[cluster] = (self._fat[cluster] & ~CLUSTER_MASK & 0xFFFFFFFF) | value
+        first, last = self._dirty or (cluster, cluster)
+        self._dirty = (min(first, cluster), max(last, cluster))
+
+    def _chain(self, cluster):
+        chain = []
+        while 2 <= cluster < self.clusters + 2:
+            chain.append(cluster)
+            if len(chain) > self.clusters:
+                raise FatImageError(f"Cluster chain loop at {cluster}")
+            cluster = self._get(cluster)
+        return chain
+
+    def _allocate(self, count):
+        """Allocate count clusters (first fit after the last allocation) as one chain"""
+        if count > self._free:
+            raise FatImageError(f"Not enough space in {self.path}: need {count * self.cluster_size} bytes, "
+                                f"{self._free * self.cluster_size} free")
+        chain = []
+        cluster = self._next_free
+        end = self.clusters + 2
+        scanned = 0
+        while len(chain) < count:
+            if cluster >= end:
+                cluster = 2
+            scanned += 1
+            if scanned > self.clusters:
+                raise FatImageError(f"Allocation table of {self.path} has fewer free clusters than counted")
+            if self._fat[cluster] & CLUSTER_MASK == FREE:
+                chain.append(cluster)
+            cluster += 1
+        for current, following in zip(chain, chain[1:] + [END_OF_CHAIN]):
+            self._set(current, following)
+        self._free -= count
+        self._next_free = cluster
+        return chain
+
+    def _release(self, cluster):
+        for current in self._chain(cluster):
+            self._set(current, FREE)
+            self._free += 1
+
+    def _offset(self, cluster):
+        return self.data_start + (cluster - 2) * self.cluster_size
+
+    def _runs(self, chain):
+        """Consecutive clusters of a chain as (first cluster, count)"""
+        runs = []
+        for cluster in chain:
+            if runs and runs[-1][0] + runs[-1][1] == cluster:
+                runs[-1][1] += 1
+            else:
+                runs.append([cluster, 1])
+        return runs
+
+    # ===== Directories =====
+
+    def _read_dir(self, cluster):
+        chain = self._chain(cluster)
+        data = b''.join(os.pread(self._fd, count * self.cluster_size, self._offset(first))
+                        for first, count in self._runs(chain))
+        return chain, data
+
+    def _entries(self, cluster):
+        """Entries of a directory (without '.', '..' and the volume label)"""
+        entries = []
+        _chain, data = self._read_dir(cluster)
+        long_parts, long_slots, long_checksum = {}, [], None
+        for slot in range(len(data) // ENTRY_SIZE):
+            raw = data[slot * ENTRY_SIZE:(slot + 1) * ENTRY_SIZE]
+            if raw[0] == 0:
+                break
+            if raw[0] == DELETED:
+                long_parts, long_slots = {}, []
+                continue
+            if raw[11] == ATTR_LONG_NAME:
+                if raw[0] & 0x40:
+                    long_parts, long_slots, long_checksum = {}, [], raw[13]
+                long_parts[raw[0] & 0x1F] = raw[1:11] + raw[14:26] + raw[28:32]
+                long_slots.append(slot)
+                continue
+            (short_name, attr, _nt, _tenth, _ctime, _cdate, _adate, cluster_high, wtime, wdate,
+             cluster_low, size) = ENTRY.unpack(raw)
+            name = None
+            if long_parts and long_checksum == _short_name_checksum(short_name):
+                text = b''.join(long_parts[order] for order in sorted(long_parts)).decode('utf-16-le', 'replace')
+                name = text.split('\x00')[0]
+            slots = (long_slots if name else []) + [slot]
+            long_parts, long_slots = {}, []
+            if attr & ATTR_VOLUME_ID or short_name[:1] == b'.':
+                continue
+            if short_name[0] == 0x05:
+                short_name = b'\xE5' + short_name[1:]
+            entries.append(FatEntry(name or _short_name_text(short_name), bool(attr & ATTR_DIRECTORY),
+                                    size, _from_dos_datetime(wdate, wtime), (cluster_high << 16) | cluster_low,
+                                    short_name, slots))
+        return entries
+
+    def _find(self, cluster, name):
+        folded = name.lower()
+        for entry in self._entries(cluster):
+            if entry.name.lower() == folded or _short_name_text(entry.short_name).lower() == folded:
+                return entry
+        return None
+
+    def _parts(self, path):
+        return [part for part in path.replace('\\', '/').split('/') if part and part != '.']
+
+    def _dir_cluster(self, parts, create=False):
+        cluster = self.root_cluster
+        for part in parts:
+            entry = self._find(cluster, part)
+            if entry is None and create:
+                cluster = self._mkdir(cluster, part)
+            elif entry is None or not entry.is_dir:
+                raise FileNotFoundError(f"No directory '{part}' in {self.path}")
+            else:
+                cluster = entry.cluster or self.root_cluster
+        return cluster
+
+    def _write_slots(self, dir_cluster, slot, data):
+        """Write directory entries starting at slot (the directory must be long enough)
+
+        data shorter than an entry only overwrites the start of that entry.
+        """
+        chain = self._chain(dir_cluster)
+        per_cluster = self.cluster_size // ENTRY_SIZE
+        for index in range(0, len(data), ENTRY_SIZE):
+            cluster, within = divmod(slot + index // ENTRY_SIZE, per_cluster)
+            os.pwrite(self._fd, data[index:index + ENTRY_SIZE], self._offset(chain[cluster]) + within * ENTRY_SIZE)
+
+    def _free_slots(self, dir_cluster, count):
+        """First run of count unused entries, growing the directory if needed"""
+        chain, data = self._read_dir(dir_cluster)
+        run = 0
+        total = len(data) // ENTRY_SIZE
+        for slot in range(total):
+            first_byte = data[slot * ENTRY_SIZE]
+            if first_byte == 0:
+                # Everything after the end marker is unused
+                if run + total - slot >= count:
+                    return slot - run
+                break
+            run = run + 1 if first_byte == DELETED else 0
+            if run == count:
+                return slot - run + 1
+        else:
+            slot = total
+        start = slot - run
+        needed = -(-(start + count - total) * ENTRY_SIZE // self.cluster_size)
+        added = self._allocate(needed)
+        self._set(chain[-1], added[0])
+        zero = bytes(self.cluster_size)
+        for cluster in added:
+            os.pwrite(self._fd, zero, self._offset(cluster))
+        return start
+
+    def _unique_short_name(self, dir_cluster, name):
+        """(short name, needs long name) for a new entry"""
+        base, ext = _short_name_parts(name)
+        short = _format_short_name(base[:8], ext[:3])
+        if len(base) <= 8 and len(ext) <= 3 and base and f"{base}.{ext}".rstrip('.') == name:
+            return short, False
+        taken = {entry.short_name for entry in self._entries(dir_cluster)}
+        for number in range(1, 1000000):
+            tail = f"~{number}"
+            short = _format_short_name((base or '_')[:8 - len(tail)] + tail, ext[:3])
+            if short not in taken:
+                return short, True
+        raise FatImageError(f"No free short name for '{name}'")
+
+    def _add_entry(self, dir_cluster, name, attr, cluster, size, mtime):
+        short, needs_long = self._unique_short_name(dir_cluster, name)
+        entries = b''
+        if needs_long:
+            encoded = name.encode('utf-16-le') + b'\x00\x00'
+            encoded += b'\xFF' * (-len(encoded) % 26)
+            pieces = [encoded[i:i + 26] for i in range(0, len(encoded), 26)]
+            if len(pieces) > 20:
+                raise FatImageError(f"Name too long: '{name}'")
+            checksum = _short_name_checksum(short)
+            for order in range(len(pieces), 0, -1):
+                piece = pieces[order - 1]
+                entries += (bytes([order | (0x40 if order == len(pieces) else 0)]) + piece[:10] +
+                            bytes([ATTR_LONG_NAME, 0, checksum]) + piece[10:22] + b'\x00\x00' + piece[22:26])
+        date, dos_time = _dos_datetime(mtime)
+        entries += ENTRY.pack(b'\x05' + short[1:] if short[0] == DELETED else short, attr, 0, 0, dos_time, date,
+                              date, cluster >> 16, dos_time, date, cluster & 0xFFFF, size)
+        slot = self._free_slots(dir_cluster, len(entries) // ENTRY_SIZE)
+        self._write_slots(dir_cluster, slot, entries)
+
+    def _mkdir(self, parent_cluster, name):
+        cluster = self._allocate(1)[0]
+        now = time.time()
+        date, dos_time = _dos_datetime(now)
+        dot = lambda short, target: ENTRY.pack(short, ATTR_DIRECTORY, 0, 0, dos_time, date, date, target >> 16,
+                                               dos_time, date, target & 0xFFFF, 0)
+        parent = 0 if parent_cluster == self.root_cluster else parent_cluster
+        data = (dot(b'.'.ljust(11), cluster) + dot(b'..'.ljust(11), parent)).ljust(self.cluster_size, b'\x00')
+        os.pwrite(self._fd, data, self._offset(cluster))
+        self._add_entry(parent_cluster, name, ATTR_DIRECTORY, cluster, 0, now)
+        return cluster
+
+    # ===== Public operations =====
+
+    def listdir(self, path='/'):
+        """Entries (FatEntry) of a directory"""
+        return self._entries(self._dir_cluster(self._parts(path)))
+
+    def stat(self, path):
+        """FatEntry of a file or directory, or None if it does not exist"""
+        parts = self._parts(path)
+        if not parts:
+            return None
+        try:
+            return self._find(self._dir_cluster(parts[:-1]), parts[-1])
+        except FileNotFoundError:
+            return None
+
+    def makedirs(self, path):
+        self._dir_cluster(self._parts(path), create=True)
+
+    def add_file(self, path, source, mtime=None):
+        """Copy the file source into the image at path (replacing it)
+
+        Missing parent directories are created.
+        """
+        parts = self._parts(path)
+        if not parts:
+            raise FatImageError("No file name given")
+        dir_cluster = self._dir_cluster(parts[:-1], create=True)
+        existing = self._find(dir_cluster, parts[-1])
+        if existing is not None:
+            if existing.is_dir:
+                raise IsADirectoryError(path)
+            self._remove_entry(dir_cluster, existing)
+
+        size = os.path.getsize(source)
+        chain = self._allocate(-(-size // self.cluster_size)) if size else []
+        try:
+            with open(source, 'rb') as f:
+                for first, count in self._runs(chain):
+                    offset, remaining = self._offset(first), count * self.cluster_size
+                    while remaining > 0:
+                        block = f.read(min(COPY_SIZE, remaining))
+                        if not block:
+                            break
+                        os.pwrite(self._fd, block, offset)
+                        offset += len(block)
+                        remaining -= len(block)
+            self._add_entry(dir_cluster, parts[-1], ATTR_ARCHIVE, chain[0] if chain else 0, size,
+                            os.path.getmtime(source) if mtime is None else mtime)
+        except Exception:
+            if chain:
+                self._release(chain[0])
+            raise
+        logger.debug(f"Added {path} ({size} bytes) to {self.path}")
+
+    def _remove_entry(self, dir_cluster, entry):
+        if entry.is_dir and entry.cluster:
+            for child in self._entries(entry.cluster):
+                self._remove_entry(entry.cluster, child)
+        if entry.cluster:
+            self._release(entry.cluster)
+        for slot in entry.slots:
+            self._write_slots(dir_cluster, slot, bytes([DELETED]))
+
+    def remove(self, path):
+        """Remove a file or a directory with everything in it"""
+        parts = self._parts(path)
+        if not parts:
+            raise FatImageError("Cannot remove the root directory")
+        dir_cluster = self._dir_cluster(parts[:-1])
+        entry = self._find(dir_cluster, parts[-1])
+        if entry is None:
+            raise FileNotFoundError(path)
+        self._remove_entry(dir_cluster, entry)
+        logger.debug(f"Removed {path} from {self.path}")
+
+    def usage(self):
+        """(total, used, free) bytes, like shutil.disk_usage"""
+        total = self.clusters * self.cluster_size
+        free = self._free * self.cluster_size
+        return total, total - free, free
@@ -0,0 +1,474 @@
+"""
+Local Print File Catalog
+
+An index of the print files in ChitUI's own folders (the USB gadget folder
+and data/uploads), kept in a small SQLite database: size, modification
+time, MD5, the parsed .goo/.ctb header (machine, resolution, layers,
+exposure, print time) and the embedded preview as PNG. Listing, sorting
+and searching those files is a database query instead of a printer round
+trip or re-reading every file.
+
+The folders are watched with inotify, so a file is indexed once when it is
+written, moved in or deleted. Only changed files (size or mtime) are read
+again, and uploads are not hashed twice: the upload routes announce the
+MD5 they computed while receiving a file (expect()) before it appears.
+Without inotify, or when the kernel dropped events, the folders are
+rescanned.
+
+Each file also carries when it was last uploaded (its content changed),
+last printed and whether it is pinned; GadgetEviction uses these to pick
+the files to remove when the USB gadget runs out of space.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import json
+import os
+import select
+import sqlite3
+import struct
+import threading
+import time
+
+from loguru import logger
+
+from core.file_header import read_print_file_header, read_print_file_preview
+
+
+PRINT_FILE_EXTENSIONS = ('.ctb', '.goo', '.prz', '.cbddlp')
+RESCAN_INTERVAL = 3600.0       # Seconds between full rescans (safety net for missed events)
+FALLBACK_INTERVAL = 30.0       # Seconds between rescans without inotify
+HASH_BLOCK = 1048576
+EXPECT_TIMEOUT = 60.0          # Seconds an announced MD5 is kept for a file that is about to appear
+
+# inotify(7)
+IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO = 0x4, 0x8, 0x40, 0x80
+IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF = 0x100, 0x200, 0x400, 0x800
+IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+IN_NONBLOCK, IN_CLOEXEC = os.O_NONBLOCK, 0x80000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ATTRIB)
+EVENT = struct.Struct('iIII')
+
+# Columns a listing can be sorted by
+SORT_COLUMNS = {
+    'name': 'path COLLATE NOCASE', 'size': 'size', 'mtime': 'mtime', 'layers': 'layer_count',
+    'print_time': 'print_time', 'exposure': 'exposure_time', 'machine': 'machine_name COLLATE NOCASE',
+    'uploaded': 'uploaded', 'printed': 'printed',
+}
+HEADER_COLUMNS = ('format', 'machine_name', 'layer_count', 'layer_height', 'exposure_time',
+                  'bottom_exposure_time', 'bottom_layers', 'resolution_x', 'resolution_y', 'print_time')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    folder TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    md5 TEXT,
+    format TEXT,
+    machine_name TEXT,
+    layer_count INTEGER,
+    layer_height REAL,
+    exposure_time REAL,
+    bottom_exposure_time REAL,
+    bottom_layers INTEGER,
+    resolution_x INTEGER,
+    resolution_y INTEGER,
+    print_time INTEGER,
+    header TEXT,
+    indexed REAL NOT NULL,
+    uploaded REAL,
+    printed REAL,
+    pinned INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (folder, path)
+);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    folder TEXT NOT NULL,
+    path TEXT NOT NULL,
+    png BLOB NOT NULL,
+    PRIMARY KEY (folder, path)
+);
+CREATE INDEX IF NOT EXISTS files_md5 ON files (md5);
+"""
+# Columns added after the first schema: (name, definition)
+ADDED_COLUMNS = (('uploaded', 'REAL'), ('printed', 'REAL'), ('pinned', 'INTEGER NOT NULL DEFAULT 0'))
+
+
+def is_print_file(name):
+    return name.lower().endswith(PRINT_FILE_EXTENSIONS) and not name.startswith('.')
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class _Inotify:
+    """Minimal inotify binding (ctypes)"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"{os.strerror(ctypes.get_errno())}: {path}")
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self):
+        """Pending events as (wd, mask, name)"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset + EVENT.size <= len(data):
+                wd, mask, _cookie, length = EVENT.unpack_from(data, offset)
+                name = data[offset + EVENT.size:offset + EVENT.size + length].split(b'\x00', 1)[0]
+                events.append((wd, mask, os.fsdecode(name)))
+                offset += EVENT.size + length
+
+
+class FileCatalog:
+    """SQLite index of the print files in a set of folders"""
+
+    def __init__(self, db_path, folders, on_change=None):
+        """
+        Args:
+            db_path: SQLite database file
+            folders: Folder key -> path (e.g. {'usb': '/mnt/usb_share', 'uploads': 'data/uploads'})
+            on_change: Optional callback(folder, path, entry or None) after a file was
+                indexed or removed
+        """
+        self.folders = dict(folders)
+        self.on_change = on_change
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        existing = {row['name'] for row in self._db.execute('PRAGMA table_info(files)')}
+        for column, definition in ADDED_COLUMNS:
+            if column not in existing:
+                self._db.execute(f'ALTER TABLE files ADD COLUMN {column} {definition}')
+        self._expected = {}     # Absolute path -> (md5, size, deadline), see expect()
+        self._inotify = None
+        self._watches = {}      # wd -> (folder key, absolute directory)
+        self._rescan = set()    # Folder keys to rescan (and re-watch)
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = None
+
+    # ===== Indexing =====
+
+    def _row(self, folder, path):
+        return self._db.execute('SELECT * FROM files WHERE folder = ? AND path = ?', (folder, path)).fetchone()
+
+    def expect(self, full_path, md5, size):
+        """Announce the MD5 of a file about to be written or moved to full_path
+
+        The index_file() that follows (usually from inotify) uses it instead
+        of reading the file again, if the size matches.
+        """
+        if not md5:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key in [key for key, (_md5, _size, deadline) in self._expected.items() if deadline < now]:
+                del self._expected[key]
+            self._expected[os.path.abspath(full_path)] = (md5, size, now + EXPECT_TIMEOUT)
+
+    def index_file(self, folder, path, md5=None):
+        """(Re)index one file if it changed; removes it from the catalog if it is gone
+
+        Args:
+            folder: Folder key
+            path: Path relative to the folder
+            md5: The file's MD5 if the caller knows it (skips hashing)
+        """
+        full = os.path.join(self.folders[folder], path)
+        with self._lock:
+            expected = self._expected.pop(os.path.abspath(full), None)
+        try:
+            st = os.stat(full)
+        except FileNotFoundError:
+            self.forget(folder, path)
+            return None
+        with self._lock:
+            row = self._row(folder, path)
+        if row and row['size'] == st.st_size and row['mtime'] == st.st_mtime:
+            return self._entry(row)
+
+        if md5 is None and expected and expected[1] == st.st_size and expected[2] >= time.monotonic():
+            md5 = expected[0]
+        if md5 is None:
+            try:
+                md5 = file_md5(full)
+            except OSError as e:
+                logger.warning(f"Could not index {full}: {e}")
+                return None
+        header = read_print_file_header(full) or {}
+        png = read_print_file_preview(full, header)
+        stored_header = {key: value for key, value in header.items() if not key.startswith('preview')}
+        # New content counts as an upload; printed and pinned are kept
+        columns = ('size', 'mtime', 'md5') + HEADER_COLUMNS + ('header', 'indexed', 'uploaded')
+        values = ([st.st_size, st.st_mtime, md5] + [header.get(column) for column in HEADER_COLUMNS]
+                  + [json.dumps(stored_header), time.time(), st.st_mtime])
+        with self._lock, self._db:
+            self._db.execute(f"INSERT INTO files (folder, path, {', '.join(columns)}) "
+                             f"VALUES ({', '.join('?' * (len(values) + 2))}) "
+                             f"ON CONFLICT (folder, path) DO UPDATE SET "
+                             f"{', '.join(f'{column} = excluded.{column}' for column in columns)}",
+                             [folder, path] + values)
+            if png:
+                self._db.execute('INSERT OR REPLACE INTO thumbnails (folder, path, png) VALUES (?, ?, ?)',
+                                 (folder, path, sqlite3.Binary(png)))
+            else:
+                self._db.execute('DELETE FROM thumbnails WHERE folder = ? AND path = ?', (folder, path))
+            entry = self._entry(self._row(folder, path))
+        logger.debug(f"Catalogued {folder}:{path} ({st.st_size} bytes)")
+        self._notify(folder, path, entry)
+        return entry
+
+    def forget(self, folder, path):
+        """Remove a file, or everything below a directory, from the catalog"""
+        prefix = path.rstrip('/') + '/'
+        with self._lock, self._db:
+            removed = [row['path'] for row in self._db.execute(
+                'SELECT path FROM files WHERE folder = ? AND (path = ? OR substr(path, 1, ?) = ?)',
+                (folder, path, len(prefix), prefix))]
+            for table in ('files', 'thumbnails'):
+                self._db.execute(f'DELETE FROM {table} WHERE folder = ? AND (path = ? OR substr(path, 1, ?) = ?)',
+                                 (folder, path, len(prefix), prefix))
+        for removed_path in removed:
+            self._notify(folder, removed_path, None)
+
+    def scan(self, folder=None):
+        """Bring the catalog in line with the folders (only changed files are read)"""
+        for key in ([folder] if folder else list(self.folders)):
+            root = self.folders[key]
+            found = set()
+            for directory, dirs, files in os.walk(root):
+                dirs[:] = [name for name in dirs if not name.startswith('.')]
+                for name in files:
+                    if is_print_file(name):
+                        path = os.path.relpath(os.path.join(directory, name), root)
+                        found.add(path)
+                        self.index_file(key, path)
+            with self._lock:
+                known = {row['path'] for row in self._db.execute('SELECT path FROM files WHERE folder = ?', (key,))}
+            for path in known - found:
+                self.forget(key, path)
+
+    def _notify(self, folder, path, entry):
+        if self.on_change:
+            try:
+                self.on_change(folder, path, entry)
+            except Exception as e:
+                logger.error(f"File catalog listener failed: {e}")
+
+    # ===== Queries =====
+
+    @staticmethod
+    def _entry(row):
+        if row is None:
+            return None
+        entry = {key: row[key] for key in row.keys() if key != 'header'}
+        entry['name'] = os.path.basename(row['path'])
+        entry['header'] = json.loads(row['header']) if row['header'] else {}
+        return entry
+
+    def list(self, folder=None, search=None, sort='name', descending=False, limit=None, offset=0):
+        """Catalogued files
+
+        Args:
+            folder: Only this folder key
+            search: Case-insensitive text in the path or machine name
+            sort: One of SORT_COLUMNS
+            descending: Reverse order
+            limit, offset: Page of the result
+
+        Returns:
+            tuple: (entries, total number of matches)
+        """
+        where, params = [], []
+        if folder:
+            where.append('folder = ?')
+            params.append(folder)
+        if search:
+            where.append("(path LIKE ? ESCAPE '\\' OR machine_name LIKE ? ESCAPE '\\')")
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            params += [pattern, pattern]
+        clause = f"WHERE {' AND '.join(where)}" if where else ''
+        order = f"{SORT_COLUMNS.get(sort, SORT_COLUMNS['name'])} {'DESC' if descending else 'ASC'}"
+        page = f"LIMIT {int(limit)} OFFSET {int(offset)}" if limit else ''
+        with self._lock:
+            total = self._db.execute(f'SELECT COUNT(*) FROM files {clause}', params).fetchone()[0]
+            rows = self._db.execute(
+                f'SELECT files.*, EXISTS (SELECT 1 FROM thumbnails t WHERE t.folder = files.folder '
+                f'AND t.path = files.path) AS has_thumbnail FROM files {clause} ORDER BY {order} {page}',
+                params).fetchall()
+        return [self._entry(row) for row in rows], total
+
+    def get(self, folder, path):
+        with self._lock:
+            return self._entry(self._row(folder, path))
+
+    def find_md5(self, md5):
+        """Catalogued files with this MD5"""
+        with self._lock:
+            return [self._entry(row) for row in self._db.execute('SELECT * FROM files WHERE md5 = ?', (md5,))]
+
+    def thumbnail(self, folder, path):
+        """Preview of a file as PNG bytes, or None"""
+        with self._lock:
+            row = self._db.execute('SELECT png FROM thumbnails WHERE folder = ? AND path = ?',
+                                   (folder, path)).fetchone()
+        return bytes(row['png']) if row else None
+
+    # ===== Usage =====
+
+    def mark_printed(self, folder, path, when=None):
+        """Record that a file was printed (now, or at when)"""
+        with self._lock, self._db:
+            found = self._db.execute('UPDATE files SET printed = ? WHERE folder = ? AND path = ?',
+                                     (when or time.time(), folder, path)).rowcount
+        return bool(found)
+
+    def pin(self, folder, path, pinned=True):
+        """Keep a file from being evicted (or allow it again)
+
+        Returns:
+            bool: Whether the file is in the catalog
+        """
+        with self._lock, self._db:
+            found = self._db.execute('UPDATE files SET pinned = ? WHERE folder = ? AND path = ?',
+                                     (1 if pinned else 0, folder, path)).rowcount
+        if found:
+            self._notify(folder, path, self.get(folder, path))
+        return bool(found)
+
+    def least_recently_used(self, folder):
+        """Unpinned files of a folder, least recently printed or uploaded first"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT * FROM files WHERE folder = ? AND pinned = 0 '
+                'ORDER BY MAX(COALESCE(printed, 0), COALESCE(uploaded, mtime)) ASC, path ASC', (folder,)).fetchall()
+        return [self._entry(row) for row in rows]
+
+    # ===== Watching =====
+
+    def start(self):
+        """Index the folders and keep watching them in a background thread"""
+        if self._thread is not None:
+            return
+        try:
+            self._inotify = _Inotify()
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify not available ({e}); rescanning print file folders every {FALLBACK_INTERVAL:.0f}s")
+        self._rescan = set(self.folders)
+        self._thread = threading.Thread(target=self._run, name='file-catalog', daemon=True)
+        self._thread.start()
+
+    def rescan(self, folder=None):
+        """Schedule a rescan (e.g. after a folder was mounted over, which inotify does not see)"""
+        self._rescan.update([folder] if folder else self.folders)
+        os.write(self._wake_w, b'\x00')
+
+    def _watch_tree(self, folder):
+        """(Re)watch a folder and its subdirectories"""
+        for wd, (key, _directory) in list(self._watches.items()):
+            if key == folder:
+                self._inotify.rm_watch(wd)
+                del self._watches[wd]
+        for directory, dirs, _files in os.walk(self.folders[folder]):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            self._add_watch(folder, directory)
+
+    def _add_watch(self, folder, directory):
+        try:
+            self._watches[self._inotify.add_watch(directory)] = (folder, directory)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning(f"Cannot watch {directory}: {e}")
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._wake_r, select.POLLIN)
+        if self._inotify:
+            poller.register(self._inotify.fd, select.POLLIN)
+        interval = RESCAN_INTERVAL if self._inotify else FALLBACK_INTERVAL
+        next_scan = time.monotonic() + interval
+        while True:
+            try:
+                folders, self._rescan = self._rescan, set()
+                for folder in folders:
+                    if not os.path.isdir(self.folders[folder]):
+                        continue
+                    if self._inotify:
+                        self._watch_tree(folder)
+                    self.scan(folder)
+                if time.monotonic() >= next_scan:
+                    self._rescan = set(self.folders)
+                    next_scan = time.monotonic() + interval
+                    continue
+
+                for fd, _event in poller.poll(max(0.0, next_scan - time.monotonic()) * 1000):
+                    if fd == self._wake_r:
+                        os.read(self._wake_r, 4096)
+                if self._inotify:
+                    self._handle_events(self._inotify.read())
+            except Exception as e:
+                logger.error(f"File catalog update failed: {e}")
+                time.sleep(1)
+
+    def _handle_events(self, events):
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed; rescanning print file folders")
+                self._rescan = set(self.folders)
+                return
+            watch = self._watches.get(wd)
+            if watch is None:
+                continue
+            folder, directory = watch
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+            if not name or name.startswith('.'):
+                continue
+            full = os.path.join(directory, name)
+            path = os.path.relpath(full, self.folders[folder])
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    for sub, dirs, files in os.walk(full):
+                        dirs[:] = [d for d in dirs if not d.startswith('.')]
+                        self._add_watch(folder, sub)
+                        for file_name in files:
+                            if is_print_file(file_name):
+                                self.index_file(folder, os.path.relpath(os.path.join(sub, file_name),
+                                                                        self.folders[folder]))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.forget(folder, path)
+            elif is_print_file(name):
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.forget(folder, path)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_ATTRIB):
+                    self.index_file(folder, path)
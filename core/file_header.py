@@ -0,0 +1,272 @@
+"""
+Print File Header Parsing for ChitUI
+
+Reads the metadata block at the start of .goo (Elegoo) and .ctb (Chitubox)
+print files: machine name, resolution, layer count, exposure settings and
+estimated print time. Only the first HEADER_CAPTURE_SIZE bytes are needed,
+so the header can be parsed while the upload is still streaming in.
+"""
+
+import struct
+import zlib
+from loguru import logger
+
+
+# Enough to cover the GOO header including both preview images (~195 KB)
+HEADER_CAPTURE_SIZE = 256 * 1024
+
+# ===== GOO format (big-endian) =====
+GOO_MAGIC = b'\x07\x00\x00\x00DLP\x00'
+GOO_SMALL_PREVIEW = (116, 116)
+GOO_BIG_PREVIEW = (290, 290)
+
+# version, magic, software info/version, file time, printer name/type, profile, aa/grey/blur
+GOO_INFO_STRUCT = struct.Struct('>4s8s32s24s24s32s32s32sHHH')
+
+# Parameters following the two preview images (each followed by a 2-byte delimiter)
+GOO_PARAMS_STRUCT = struct.Struct(
+    '>IHH??'     # layer_count, resolution x/y, mirror x/y
+    'ffff'       # platform x/y/z, layer thickness
+    'f?f'        # exposure time, exposure delay mode, turn off time
+    '6f'         # lift/retract wait times
+    'fI'         # bottom exposure time, bottom layers
+    '16f'        # lift/retract distances and speeds
+    'HH?I'       # bottom/normal light pwm, advance mode, printing time
+    'fff8s?H'    # volume, weight, price, price unit, grey scale, transition layers
+)
+GOO_PARAMS_OFFSET = (GOO_INFO_STRUCT.size
+                     + GOO_SMALL_PREVIEW[0] * GOO_SMALL_PREVIEW[1] * 2 + 2
+                     + GOO_BIG_PREVIEW[0] * GOO_BIG_PREVIEW[1] * 2 + 2)
+
+# ===== CTB format (little-endian) =====
+CTB_MAGICS = {
+    0x12FD0019: 'cbddlp',
+    0x12FD0086: 'ctb',
+}
+CTB_ENCRYPTED_MAGIC = 0x12FD0107
+
+CTB_HEADER_STRUCT = struct.Struct(
+    '<II'        # magic, version
+    'fffII'      # bed x/y/z, 2 unknown
+    'fffff'      # total height, layer height, exposure, bottom exposure, light off delay
+    'III'        # bottom layers, resolution x/y
+    'IIII'       # large preview offset, layers offset, layer count, small preview offset
+    'III'        # print time, projection, print params offset
+    'II'         # print params size, anti-aliasing
+    'HHI'        # light pwm, bottom light pwm, encryption key
+    'II'         # slicer info offset, slicer info size
+)
+# Machine name address/size live 28 bytes into the slicer info block (v3+)
+CTB_MACHINE_NAME_FIELD = 28
+# resolution x/y, image offset, image length (RLE encoded RGB15)
+CTB_PREVIEW_STRUCT = struct.Struct('<IIII')
+CTB_PREVIEW_MAX_PIXELS = 1024 * 1024
+
+
+def _cstr(raw):
+    """Decode a fixed-size, NUL padded string field"""
+    return raw.split(b'\x00', 1)[0].decode('utf-8', errors='replace').strip()
+
+
+def parse_goo_header(data):
+    """Parse the header of an Elegoo .goo file.
+
+    Returns:
+        dict with the parsed fields, or None if data is not a GOO header
+    """
+    if len(data) < GOO_INFO_STRUCT.size or data[4:12] != GOO_MAGIC:
+        return None
+
+    info = GOO_INFO_STRUCT.unpack_from(data, 0)
+    header = {
+        'format': 'goo',
+        'version': _cstr(info[0]),
+        'software': _cstr(info[2]),
+        'software_version': _cstr(info[3]),
+        'machine_name': _cstr(info[5]),
+        'machine_type': _cstr(info[6]),
+        'profile_name': _cstr(info[7]),
+        'preview_small': {'offset': GOO_INFO_STRUCT.size,
+                          'width': GOO_SMALL_PREVIEW[0], 'height': GOO_SMALL_PREVIEW[1]},
+        'preview_big': {'offset': GOO_INFO_STRUCT.size + GOO_SMALL_PREVIEW[0] * GOO_SMALL_PREVIEW[1] * 2 + 2,
+                        'width': GOO_BIG_PREVIEW[0], 'height': GOO_BIG_PREVIEW[1]},
+    }
+
+    if len(data) >= GOO_PARAMS_OFFSET + GOO_PARAMS_STRUCT.size:
+        params = GOO_PARAMS_STRUCT.unpack_from(data, GOO_PARAMS_OFFSET)
+        header.update({
+            'layer_count': params[0],
+            'resolution_x': params[1],
+            'resolution_y': params[2],
+            'layer_height': round(params[8], 4),
+            'exposure_time': round(params[9], 3),
+            'bottom_exposure_time': round(params[18], 3),
+            'bottom_layers': params[19],
+            'print_time': params[39],
+        })
+
+    return header
+
+
+def parse_ctb_header(data):
+    """Parse the header of a Chitubox .ctb/.cbddlp file.
+
+    Returns:
+        dict with the parsed fields, or None if data is not a CTB header
+    """
+    if len(data) < 4:
+        return None
+
+    magic = struct.unpack_from('<I', data, 0)[0]
+    if magic == CTB_ENCRYPTED_MAGIC:
+        # Settings of encrypted CTB v4+ files are AES encrypted - nothing to read
+        return {'format': 'ctb', 'encrypted': True}
+    if magic not in CTB_MAGICS or len(data) < CTB_HEADER_STRUCT.size:
+        return None
+
+    fields = CTB_HEADER_STRUCT.unpack_from(data, 0)
+    header = {
+        'format': CTB_MAGICS[magic],
+        'version': fields[1],
+        'encrypted': False,
+        'layer_height': round(fields[8], 4),
+        'exposure_time': round(fields[9], 3),
+        'bottom_exposure_time': round(fields[10], 3),
+        'bottom_layers': fields[12],
+        'resolution_x': fields[13],
+        'resolution_y': fields[14],
+        'layer_count': fields[17],
+        'print_time': fields[19],
+        'preview_big': {'header_offset': fields[15]},
+        'preview_small': {'header_offset': fields[18]},
+    }
+
+    # Machine name is referenced from the slicer info block (version 3+)
+    slicer_offset = fields[27]
+    name_field = slicer_offset + CTB_MACHINE_NAME_FIELD
+    if fields[1] >= 3 and slicer_offset and len(data) >= name_field + 8:
+        name_offset, name_size = struct.unpack_from('<II', data, name_field)
+        if name_size and len(data) >= name_offset + name_size:
+            header['machine_name'] = _cstr(bytes(data[name_offset:name_offset + name_size]))
+
+    return header
+
+
+def parse_print_file_header(data, filename=''):
+    """Parse the header bytes of a print file.
+
+    The format is detected from the file content; the filename extension
+    is only used to pick which parser to try first.
+
+    Args:
+        data: Leading bytes of the file (up to HEADER_CAPTURE_SIZE)
+        filename: Original file name
+
+    Returns:
+        dict with the parsed metadata, or None if the format is not recognised
+    """
+    parsers = [parse_goo_header, parse_ctb_header]
+    if filename.lower().endswith(('.ctb', '.cbddlp')):
+        parsers.reverse()
+
+    for parser in parsers:
+        try:
+            header = parser(data)
+        except struct.error as e:
+            logger.debug(f"Header parse error ({parser.__name__}): {e}")
+            continue
+        if header:
+            return header
+    return None
+
+
+def read_print_file_header(filepath):
+    """Read and parse the header of a print file on disk"""
+    try:
+        with open(filepath, 'rb') as f:
+            data = f.read(HEADER_CAPTURE_SIZE)
+    except OSError as e:
+        logger.debug(f"Could not read header of {filepath}: {e}")
+        return None
+    return parse_print_file_header(data, filepath)
+
+
+def _rgb565_to_rgb(data):
+    """Big-endian RGB565 pixels (GOO previews) to RGB888"""
+    rgb = bytearray(len(data) // 2 * 3)
+    for i in range(len(data) // 2):
+        pixel = (data[2 * i] << 8) | data[2 * i + 1]
+        rgb[3 * i] = (pixel >> 11) * 255 // 31
+        rgb[3 * i + 1] = ((pixel >> 5) & 0x3F) * 255 // 63
+        rgb[3 * i + 2] = (pixel & 0x1F) * 255 // 31
+    return rgb
+
+
+def _ctb_rle_to_rgb(data, pixels):
+    """RLE encoded RGB15 pixels (CTB previews) to RGB888
+
+    Each 16-bit word is a color; if bit 0x20 is set, the next word holds
+    the number of additional repetitions (12 bits).
+    """
+    rgb = bytearray()
+    n = 0
+    while n + 1 < len(data) and len(rgb) < pixels * 3:
+        dot = data[n] | (data[n + 1] << 8)
+        n += 2
+        repeat = 1
+        if dot & 0x20 and n + 1 < len(data):
+            repeat += data[n] | ((data[n + 1] & 0x0F) << 8)
+            n += 2
+        rgb += bytes((((dot >> 11) & 0x1F) << 3, ((dot >> 6) & 0x1F) << 3, (dot & 0x1F) << 3)) * repeat
+    return rgb[:pixels * 3].ljust(pixels * 3, b'\x00')
+
+
+def encode_png(width, height, rgb):
+    """Encode RGB888 pixels as a PNG image"""
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    stride = width * 3
+    raw = b''.join(b'\x00' + bytes(rgb[y * stride:(y + 1) * stride]) for y in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+
+def read_print_file_preview(filepath, header, size='big'):
+    """Preview image embedded in a print file, as PNG
+
+    Args:
+        filepath: Print file on disk
+        header: Its parsed header (parse_print_file_header)
+        size: 'big' or 'small'
+
+    Returns:
+        bytes: PNG image, or None if the file has no readable preview
+    """
+    preview = (header or {}).get(f'preview_{size}')
+    if not preview:
+        return None
+    try:
+        with open(filepath, 'rb') as f:
+            if header['format'] == 'goo':
+                width, height = preview['width'], preview['height']
+                f.seek(preview['offset'])
+                data = f.read(width * height * 2)
+                if len(data) < width * height * 2:
+                    return None
+                return encode_png(width, height, _rgb565_to_rgb(data))
+
+            if not preview['header_offset']:
+                return None
+            f.seek(preview['header_offset'])
+            fields = f.read(CTB_PREVIEW_STRUCT.size)
+            if len(fields) < CTB_PREVIEW_STRUCT.size:
+                return None
+            width, height, offset, length = CTB_PREVIEW_STRUCT.unpack(fields)
+            if not width or not height or width * height > CTB_PREVIEW_MAX_PIXELS:
+                return None
+            f.seek(offset)
+            return encode_png(width, height, _ctb_rle_to_rgb(f.read(length), width * height))
+    except (OSError, KeyError, struct.error) as e:
+        logger.debug(f"Could not read preview of {filepath}: {e}")
+        return None
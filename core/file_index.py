@@ -0,0 +1,178 @@
+"""
+Content Index of Files on the Printers
+
+Operators often upload a file the printer already has. FileIndex remembers
+the MD5 of every file ChitUI sent to a printer and where it went (printer
+and path), kept in a small JSON file. The printers' own file listings
+(SDCP command 258) carry names and sizes but no checksums, so they are used
+to keep the index honest: a file that is missing from a fresh listing, or
+listed with a different size, is dropped. Before an upload is skipped, the
+directory is listed again (unless it was listed moments ago) and the file
+has to still be there. Those listings are ChitUI's own and are not passed
+on to the web interface.
+"""
+
+import json
+import os
+import posixpath
+import threading
+import time
+
+from loguru import logger
+
+
+# Seconds to wait for the printer's listing before transferring anyway
+LISTING_TIMEOUT = 3.0
+# A listing this recent (also one the web interface asked for) is not requested again
+LISTING_MAX_AGE = 5.0
+
+
+def printer_path(destination, filename):
+    """Path of an uploaded file on the printer ('/local/x.goo', '/usb/x.goo')"""
+    return f"/{'usb' if destination == 'usb' else 'local'}/{filename}"
+
+
+class FileIndex:
+    """Thread-safe MD5 -> (printer, path) index of files on the printers"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._files = self._load()   # printer id -> path -> {'md5', 'size', 'updated'}
+        self._listings = {}          # SDCP RequestID -> (printer id, directory, threading.Event or None)
+        self._listed = {}            # (printer id, directory) -> monotonic time of its last listing
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading file index {self.path}: {e}")
+            return {}
+
+    def _write(self):
+        """Persist the index (caller holds the lock)"""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_file = self.path + '.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(self._files, f, indent=2)
+            os.replace(temp_file, self.path)
+        except Exception as e:
+            logger.error(f"Error saving file index: {e}")
+
+    def record(self, printer_id, path, md5, size):
+        """A file with this content now exists at path on the printer"""
+        with self._lock:
+            self._files.setdefault(printer_id, {})[path] = {'md5': md5, 'size': size, 'updated': time.time()}
+            self._write()
+
+    def forget(self, printer_id, path):
+        """The file at path was deleted"""
+        with self._lock:
+            if self._files.get(printer_id, {}).pop(path, None) is not None:
+                self._write()
+
+    def locations(self, md5):
+        """All (printer id, path) pairs known to hold this content"""
+        with self._lock:
+            return [(printer_id, path) for printer_id, files in self._files.items()
+                    for path, entry in files.items() if entry['md5'] == md5]
+
+    def has(self, printer_id, path, md5, size=None):
+        """True if the index says path on the printer holds exactly this content"""
+        with self._lock:
+            entry = self._files.get(printer_id, {}).get(path)
+        return bool(entry) and entry['md5'] == md5 and (size is None or entry['size'] == size)
+
+    def expect_listing(self, printer_id, request_id, directory):
+        """Note which directory an outgoing SDCP 258 request lists"""
+        with self._lock:
+            self._listings[request_id] = (printer_id, directory.rstrip('/') or '/', None)
+
+    def observe_listing(self, printer_id, request_id, entries):
+        """Drop index entries that a printer's file listing contradicts
+
+        Args:
+            printer_id: Printer that sent the listing
+            request_id: RequestID of the SDCP 258 response
+            entries: Its FileList ({'name', 'usedSize', 'type'} dicts)
+
+        Returns:
+            bool: True if confirm() asked for this listing, so it is not
+                meant for the web interface
+        """
+        with self._lock:
+            _, directory, event = self._listings.pop(request_id, (None, None, None))
+            if directory is None:
+                # Not requested through ChitUI's server; infer it from the entries
+                directories = {posixpath.dirname(entry.get('name', '')) for entry in entries}
+                if len(directories) != 1:
+                    return False
+                directory = directories.pop()
+
+            listed = {entry.get('name'): entry for entry in entries if entry.get('type') != 0}
+            files = self._files.get(printer_id, {})
+            stale = [path for path, entry in files.items()
+                     if posixpath.dirname(path) == directory and
+                     (path not in listed or listed[path].get('usedSize', entry['size']) != entry['size'])]
+            for path in stale:
+                logger.debug(f"File index: {path} on {printer_id} is gone or changed")
+                del files[path]
+            if stale:
+                self._write()
+            self._listed[(printer_id, directory)] = time.monotonic()
+
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    def confirm(self, checks, request_listing, timeout=LISTING_TIMEOUT):
+        """Check with the printers that files still hold this content
+
+        A directory listed less than LISTING_MAX_AGE seconds ago is not
+        listed again. The other directories are requested from all printers
+        at once and share one timeout.
+
+        Args:
+            checks: (printer id, path, md5, size) tuples
+            request_listing: Callable(printer_id, directory, request_id)
+                sending SDCP 258 with that RequestID; returns False if the
+                request could not be sent
+
+        Returns:
+            list: The checks the index has and a fresh listing still shows
+        """
+        candidates = [check for check in checks if self.has(*check)]
+        directories = {(printer_id, posixpath.dirname(path)) for printer_id, path, _, _ in candidates}
+
+        pending = {}        # (printer id, directory) -> (request id, event)
+        unconfirmed = set()
+        for printer_id, directory in directories:
+            with self._lock:
+                listed = self._listed.get((printer_id, directory))
+                if listed is not None and time.monotonic() - listed < LISTING_MAX_AGE:
+                    continue
+                request_id = os.urandom(8).hex()
+                event = threading.Event()
+                self._listings[request_id] = (printer_id, directory, event)
+            if request_listing(printer_id, directory, request_id):
+                pending[(printer_id, directory)] = (request_id, event)
+            else:
+                unconfirmed.add((printer_id, directory))
+                with self._lock:
+                    self._listings.pop(request_id, None)
+
+        deadline = time.monotonic() + timeout
+        for (printer_id, directory), (request_id, event) in pending.items():
+            if not event.wait(max(0, deadline - time.monotonic())):
+                logger.debug(f"File index: no listing of {directory} from {printer_id}, cannot confirm files in it")
+                unconfirmed.add((printer_id, directory))
+                with self._lock:
+                    self._listings.pop(request_id, None)
+
+        return [check for check in candidates
+                if (check[0], posixpath.dirname(check[1])) not in unconfirmed and self.has(*check)]
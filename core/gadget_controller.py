@@ -0,0 +1,458 @@
+"""
+In-process USB Gadget Control
+
+scripts/reload_usb_gadget.sh makes the printer notice changes on the Pi's
+virtual USB drive by unloading and reloading the gadget kernel modules,
+with a fixed 'sleep 1' after every step, through 'sudo bash'. GadgetController
+does the same work from inside ChitUI, with steps that wait for the kernel
+to report completion instead of sleeping:
+
+- sync      flush ChitUI's writes and the drive's filesystem to the image
+- umount    unmount the Pi's mount of the image (native umount2)
+- eject     force the medium out of the mass storage LUN (forced_eject)
+- insert    put the image back into the LUN (the host sees a media change)
+- unbind    detach the configfs gadget from the USB device controller
+- bind      attach it again and wait until the host has configured it
+- unload    remove the gadget modules (modprobe -r)
+- load      load them again with the image (modprobe)
+- mount     mount the image on the Pi again
+
+Three sequences of these steps are tried from the least to the most
+disruptive (SEQUENCES). The first one that completes is remembered for the
+host and used from then on. Every step is timed.
+
+In direct mode the Pi does not mount the image at all: the mount point is a
+plain folder, and the 'write' step copies its new and changed files (and
+removes deleted ones) straight into the image with FatImage while the
+printer has no access to it. No mount or umount is needed then.
+
+With a spare image (direct mode only) the drive is double-buffered: the
+'write' step brings the image the printer does not see up to date while the
+printer keeps reading the other one, untouched, and the 'swap' step
+presents it with a single forced_eject and change of the LUN's backing
+file. The printer's view switches in one short step, and the image a print
+is reading from is never written to.
+
+All sysfs, configfs and procfs locations are constructor arguments, so the
+controller can run against a fake tree in a temporary directory.
+"""
+
+import ctypes
+import glob
+import os
+import select
+import shutil
+import subprocess
+import threading
+import time
+
+from loguru import logger
+
+from core.fat_image import FatImage, FatImageError
+from core.mount_state import MountState, MOUNTINFO
+from core.gadget_sync import GadgetWrites
+
+
+CONFIGFS_GADGETS = '/sys/kernel/config/usb_gadget'
+UDC_CLASS = '/sys/class/udc'
+MODULES = '/sys/module'
+# LUNs of the legacy g_mass_storage module (configfs LUNs are found under the gadgets)
+LEGACY_LUN_GLOBS = ('/sys/devices/platform/soc/*.usb/gadget*/lun*', '/sys/devices/platform/*.usb/gadget*/lun*')
+
+# Module options of scripts/reload_usb_gadget.sh
+MASS_STORAGE_OPTIONS = ['stall=0', 'ro=0', 'removable=1', 'idVendor=0x0951', 'idProduct=0x1666',
+                        'iManufacturer=Kingston', 'iProduct=DataTraveler', 'iSerialNumber=74A53CDF']
+
+# Step sequences, least disruptive first ('write' only does something in direct mode)
+SEQUENCES = {
+    'swap': ('write', 'swap'),
+    'eject': ('sync', 'eject', 'write', 'insert'),
+    'rebind': ('sync', 'umount', 'unbind', 'write', 'bind', 'insert', 'mount'),
+    'modules': ('sync', 'umount', 'unbind', 'unload', 'write', 'load', 'bind', 'insert', 'mount'),
+}
+SEQUENCE_ORDER = ('swap', 'eject', 'rebind', 'modules')  # 'swap' needs a spare image
+
+STEP_TIMEOUT = 5.0         # Seconds a step waits for the kernel to confirm it
+CONFIGURE_TIMEOUT = 10.0   # Seconds the host gets to enumerate the gadget again
+MNT_DETACH = 2
+
+
+def wait_until(predicate, timeout, watch=None):
+    """Wait until predicate() is true
+
+    Args:
+        predicate: Condition to wait for
+        timeout: Seconds to wait at most
+        watch: Optional sysfs attribute; the kernel wakes pollers of these
+            on change, so the wait ends right away.
+            Other files (or none) are re-checked with a growing interval.
+
+    Returns:
+        bool: Whether the condition was met
+    """
+    deadline = time.monotonic() + timeout
+    poller = fd = None
+    if watch:
+        try:
+            fd = os.open(watch, os.O_RDONLY)
+            poller = select.poll()
+            poller.register(fd, select.POLLPRI | select.POLLERR)
+        except OSError:
+            fd = None
+    interval = 0.01
+    try:
+        while True:
+            if predicate():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if fd is not None:
+                # Reading the attribute arms the next change notification
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.read(fd, 4096)
+                poller.poll(min(interval, remaining) * 1000)
+            else:
+                time.sleep(min(interval, remaining))
+            interval = min(interval * 2, 0.2)
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _write(path, value):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+class GadgetController:
+    """Reloads the USB mass storage gadget without the shell script"""
+
+    def __init__(self, image, mount_point, configfs=CONFIGFS_GADGETS, udc_class=UDC_CLASS, modules=MODULES,
+                 mountinfo=MOUNTINFO, legacy_lun_globs=LEGACY_LUN_GLOBS, sequence=None, on_sequence=None,
+                 run=None, direct=False, spare_image=None, mounts=None, writes=None):
+        """
+        Args:
+            image: Backing image of the drive (e.g. /piusb.bin)
+            mount_point: Where the Pi mounts the image (e.g. /mnt/usb_share)
+            configfs, udc_class, modules, mountinfo, legacy_lun_globs:
+                Kernel interfaces (overridable for tests)
+            sequence: Sequence known to work on this host (see SEQUENCES)
+            on_sequence: Optional callback(name) when a different sequence
+                turned out to be the minimal working one
+            run: Command runner for modprobe and mount (default: subprocess,
+                through 'sudo -n' when not running as root)
+            direct: mount_point is a plain folder whose content is written
+                into the image on reload, instead of a mount of the image
+            spare_image: Second image for double buffering in direct mode
+                (created as a copy of image when missing)
+            mounts: MountState to look up the mount point in (default: one
+                reading mountinfo)
+            writes: GadgetWrites recording the files written into mount_point
+                (default: an empty one; the sync step then flushes the volume only)
+        """
+        self.image = image
+        self.mount_point = mount_point
+        self.configfs = configfs
+        self.udc_class = udc_class
+        self.modules = modules
+        self.mounts = mounts or MountState(mountinfo)
+        self.writes = writes or GadgetWrites(mount_point)
+        self.legacy_lun_globs = legacy_lun_globs
+        self.sequence = sequence if sequence in SEQUENCES else None
+        self.on_sequence = on_sequence
+        self._run_command = run or self._subprocess
+        self.direct = direct
+        self.spare_image = spare_image if direct else None
+        self._active = image   # Image the printer sees
+        self._target = image   # Image the write step writes into
+        # Paths (relative to mount_point) to remove from each image in direct mode
+        self._removed = {path: set() for path in (image, self.spare_image) if path}
+        self._lock = threading.Lock()
+        self._udc = None       # UDC the configfs gadget was bound to before unbind
+        self._media = {}       # LUN -> backing file before eject
+        self.last_run = []     # [{'sequence', 'step', 'ok', 'seconds'}] of the last reload
+
+    # ===== Discovery =====
+
+    def _gadgets(self):
+        """configfs gadget directories that have a UDC attribute"""
+        return sorted(path for path in glob.glob(os.path.join(self.configfs, '*'))
+                      if os.path.isfile(os.path.join(path, 'UDC')))
+
+    def _luns(self):
+        """Mass storage LUN directories (configfs functions and the legacy module)"""
+        patterns = [os.path.join(self.configfs, '*', 'functions', 'mass_storage.*', 'lun.*')]
+        patterns.extend(self.legacy_lun_globs)
+        return sorted({path for pattern in patterns for path in glob.glob(pattern)
+                       if os.path.isfile(os.path.join(path, 'file'))})
+
+    def available(self):
+        """True if this process can control the gadget itself (root or writable sysfs)"""
+        files = [os.path.join(lun, 'file') for lun in self._luns()]
+        files += [os.path.join(gadget, 'UDC') for gadget in self._gadgets()]
+        return bool(files) and all(os.access(path, os.W_OK) for path in files)
+
+    def _mounted(self):
+        return self.mounts.is_mounted(self.mount_point)
+
+    def _udc_state(self, udc):
+        return _read(os.path.join(self.udc_class, udc, 'state'))
+
+    @staticmethod
+    def _subprocess(args):
+        if os.geteuid() != 0:
+            args = ['sudo', '-n'] + args
+        result = subprocess.run(args, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            logger.debug(f"{' '.join(args)}: {result.stderr.strip()}")
+        return result.returncode == 0
+
+    # ===== Steps =====
+
+    def _step_sync(self):
+        # In direct mode the write step fsyncs the image itself
+        self.writes.flush(volume=not self.direct)
+        return True
+
+    def _step_umount(self):
+        if self.direct or not self._mounted():
+            return True
+        libc = ctypes.CDLL(None, use_errno=True)
+        target = self.mount_point.encode()
+        if libc.umount2(target, 0) != 0:
+            logger.warning(f"Unmounting {self.mount_point} failed ({os.strerror(ctypes.get_errno())}), detaching")
+            if libc.umount2(target, MNT_DETACH) != 0:
+                return False
+        return self.mounts.wait(self.mount_point, mounted=False, timeout=STEP_TIMEOUT)
+
+    def _step_mount(self):
+        if self.direct or self._mounted():
+            return True
+        os.makedirs(self.mount_point, exist_ok=True)
+        if not (self._run_command(['mount', self.mount_point]) or
+                self._run_command(['mount', '-t', 'vfat', '-o', 'loop,rw,umask=000,uid=1000,gid=1000',
+                                   self.image, self.mount_point])):
+            return False
+        return self.mounts.wait(self.mount_point, mounted=True, timeout=STEP_TIMEOUT)
+
+    def _step_eject(self):
+        luns = [lun for lun in self._luns() if os.path.exists(os.path.join(lun, 'forced_eject'))]
+        if not luns:
+            logger.debug("No mass storage LUN with forced_eject")
+            return False
+        for lun in luns:
+            current = _read(os.path.join(lun, 'file'))
+            if current:
+                self._media[lun] = current
+            _write(os.path.join(lun, 'forced_eject'), '1')
+        return all(wait_until(lambda lun=lun: not _read(os.path.join(lun, 'file')), STEP_TIMEOUT,
+                              os.path.join(lun, 'file')) for lun in luns)
+
+    def _step_insert(self):
+        luns = self._luns()
+        if not luns:
+            return False
+        for lun in luns:
+            path = os.path.join(lun, 'file')
+            if not _read(path):
+                _write(path, self._media.get(lun, self._active))
+        self._media.clear()
+        return all(wait_until(lambda lun=lun: bool(_read(os.path.join(lun, 'file'))), STEP_TIMEOUT)
+                   for lun in luns)
+
+    def remove(self, path):
+        """Remove a file or folder (relative to mount_point) from the image on the next reload (direct mode)"""
+        with self._lock:
+            for removed in self._removed.values():
+                removed.add(path.strip('/'))
+
+    def _step_write(self):
+        if not self.direct:
+            return True
+        target = self._target
+        if self._mounted():
+            logger.error(f"{target} is mounted at {self.mount_point}; not writing into it directly")
+            return False
+        if not os.path.exists(target):
+            logger.info(f"Creating {target} as a copy of {self._active}")
+            shutil.copyfile(self._active, target)
+        with self._lock:
+            removed = set(self._removed[target])
+        added = 0
+        try:
+            with FatImage(target) as fat:
+                for path in sorted(removed):
+                    try:
+                        fat.remove(path)
+                    except FileNotFoundError:
+                        pass
+                for folder, dirs, files in os.walk(self.mount_point):
+                    dirs[:] = [name for name in dirs if not name.startswith('.')]
+                    relative = os.path.relpath(folder, self.mount_point)
+                    relative = '' if relative == '.' else relative
+                    try:
+                        in_image = {entry.name.lower(): entry for entry in fat.listdir(relative)}
+                    except FileNotFoundError:
+                        in_image = {}
+                    for name in files:
+                        if name.startswith('.'):
+                            continue
+                        source = os.path.join(folder, name)
+                        st = os.stat(source)
+                        entry = in_image.get(name.lower())
+                        # FAT keeps modification times in 2 second steps
+                        if entry and entry.size == st.st_size and abs(entry.mtime - st.st_mtime) <= 2:
+                            continue
+                        fat.add_file(os.path.join(relative, name), source)
+                        added += 1
+        except FatImageError as e:
+            logger.error(f"Writing into {target} failed: {e}")
+            return False
+        with self._lock:
+            self._removed[target] -= removed
+        logger.info(f"Wrote {added} file(s) into {target}, removed {len(removed)}")
+        return True
+
+    def _step_swap(self):
+        luns = [lun for lun in self._luns() if os.path.exists(os.path.join(lun, 'forced_eject'))]
+        if not luns:
+            logger.debug("No mass storage LUN with forced_eject")
+            return False
+        for lun in luns:
+            _write(os.path.join(lun, 'forced_eject'), '1')
+        if not all(wait_until(lambda lun=lun: not _read(os.path.join(lun, 'file')), STEP_TIMEOUT,
+                              os.path.join(lun, 'file')) for lun in luns):
+            return False
+        for lun in luns:
+            _write(os.path.join(lun, 'file'), self._target)
+        if not all(wait_until(lambda lun=lun: _read(os.path.join(lun, 'file')) == self._target, STEP_TIMEOUT)
+                   for lun in luns):
+            return False
+        self._active = self._target
+        return True
+
+    def _step_unbind(self):
+        gadgets = self._gadgets()
+        if not gadgets:
+            # Legacy g_mass_storage binds itself; unloading the module detaches it
+            return True
+        for gadget in gadgets:
+            udc = _read(os.path.join(gadget, 'UDC'))
+            if udc:
+                self._udc = udc
+                _write(os.path.join(gadget, 'UDC'), '\n')
+        if not all(wait_until(lambda gadget=gadget: not _read(os.path.join(gadget, 'UDC')), STEP_TIMEOUT)
+                   for gadget in gadgets):
+            return False
+        # The host has to see the disconnect, or bind finds the old 'configured' state
+        return not self._udc or wait_until(lambda: self._udc_state(self._udc) != 'configured', STEP_TIMEOUT,
+                                           os.path.join(self.udc_class, self._udc, 'state'))
+
+    def _step_bind(self):
+        gadgets = self._gadgets()
+        udcs = sorted(os.listdir(self.udc_class)) if os.path.isdir(self.udc_class) else []
+        udc = self._udc or (udcs[0] if udcs else None)
+        if not udc:
+            return False
+        for gadget in gadgets:
+            if not _read(os.path.join(gadget, 'UDC')):
+                _write(os.path.join(gadget, 'UDC'), udc)
+        self._udc = None
+        # Replaces the script's 'give printer time to detect reconnect' sleep
+        state_file = os.path.join(self.udc_class, udc, 'state')
+        if not wait_until(lambda: self._udc_state(udc) == 'configured', CONFIGURE_TIMEOUT, state_file):
+            logger.warning(f"Host did not configure the gadget on {udc} (state: {self._udc_state(udc)})")
+        return True
+
+    def _step_unload(self):
+        for module in ('g_mass_storage', 'dwc2'):
+            if os.path.isdir(os.path.join(self.modules, module)):
+                self._run_command(['modprobe', '-r', module])
+        return wait_until(lambda: not os.path.isdir(os.path.join(self.modules, 'g_mass_storage')), STEP_TIMEOUT)
+
+    def _step_load(self):
+        if not os.path.exists(self._active):
+            logger.error(f"Gadget image {self._active} not found")
+            return False
+        self._run_command(['modprobe', 'dwc2'])
+        if not self._run_command(['modprobe', 'g_mass_storage', f'file={self._active}'] + MASS_STORAGE_OPTIONS):
+            return False
+        return wait_until(lambda: os.path.isdir(os.path.join(self.modules, 'g_mass_storage')), STEP_TIMEOUT)
+
+    # ===== Sequences =====
+
+    @property
+    def active_image(self):
+        """Image the printer sees"""
+        return self._in_use()
+
+    def _in_use(self):
+        """Image a LUN presents to the printer (one of image and spare_image)"""
+        for lun in self._luns():
+            current = _read(os.path.join(lun, 'file'))
+            if current and current in (self.image, self.spare_image):
+                return current
+        return self._active
+
+    def _run_sequence(self, name):
+        # A swap writes into the image the printer does not see, the others into the one it sees
+        if name == 'swap':
+            self._target = self.spare_image if self._active == self.image else self.image
+        else:
+            self._target = self._active
+        for step in SEQUENCES[name]:
+            start = time.monotonic()
+            try:
+                ok = getattr(self, f'_step_{step}')()
+            except OSError as e:
+                logger.warning(f"Gadget step '{step}' failed: {e}")
+                ok = False
+            self.last_run.append({'sequence': name, 'step': step, 'ok': ok,
+                                  'seconds': round(time.monotonic() - start, 3)})
+            if not ok:
+                return False
+        return True
+
+    def reload(self):
+        """Make the host see the current content of the drive
+
+        Starts with the sequence known to work (or the least disruptive
+        one) and escalates until one succeeds.
+
+        Returns:
+            bool: True if a sequence succeeded
+        """
+        self.last_run = []
+        self._active = self._in_use()
+        order = SEQUENCE_ORDER if self.spare_image else SEQUENCE_ORDER[1:]
+        # With a spare image, a host where 'eject' works can swap instead
+        start = order.index(self.sequence) if self.sequence in order and self.sequence != 'eject' else 0
+        for name in order[start:]:
+            if self._run_sequence(name):
+                took = sum(step['seconds'] for step in self.last_run if step['sequence'] == name)
+                logger.info(f"✓ USB gadget reloaded with '{name}' in {took:.2f}s: " +
+                            ', '.join(f"{step['step']} {step['seconds']:.2f}s"
+                                      for step in self.last_run if step['sequence'] == name))
+                if name != self.sequence:
+                    self.sequence = name
+                    if self.on_sequence:
+                        self.on_sequence(name)
+                return True
+            logger.warning(f"USB gadget reload with '{name}' did not work on this host")
+
+        # Leave the drive attached and mounted even if nothing worked
+        for step in ('bind', 'insert', 'mount'):
+            try:
+                getattr(self, f'_step_{step}')()
+            except OSError as e:
+                logger.warning(f"Gadget step '{step}' failed: {e}")
+        return False
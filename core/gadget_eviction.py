@@ -0,0 +1,115 @@
+"""
+USB Gadget Space Eviction
+
+When /piusb.bin was full, an upload failed halfway through writing into
+it. Before an upload is accepted, GadgetEviction checks its size (the
+Content-Length) against the drive without touching anything; an upload
+that cannot fit even after removing every candidate is refused. Files
+are only removed once the upload has been received and validated, right
+before it is written into the drive: the least recently used print files
+go first - ordered by the later of their last print and last upload in
+the file catalog - until it fits. Pinned files and files a printer is
+currently printing are never removed.
+
+Callers hold the USB gadget queue from make_room() until the file is in
+the drive, so no other upload can take the space in between.
+
+Sizes come from the catalog (file sizes, not allocated clusters); MARGIN
+covers the difference.
+"""
+
+import threading
+
+from loguru import logger
+
+
+MARGIN = 4 * 1048576   # Bytes kept free on top of an upload (cluster slack, directory entries)
+
+
+class GadgetEviction:
+    """Frees space on the USB gadget for uploads"""
+
+    def __init__(self, catalog, free_space, remove, folder='usb', protected=None, margin=MARGIN):
+        """
+        Args:
+            catalog: FileCatalog indexing the gadget folder
+            free_space: Callable returning the drive's free bytes (None if unknown)
+            remove: Callable(path relative to the gadget folder) deleting a file
+            folder: The gadget folder's key in the catalog
+            protected: Optional callable returning paths that must not be removed
+                (e.g. files being printed)
+            margin: Bytes kept free on top of the upload
+        """
+        self.catalog = catalog
+        self.free_space = free_space
+        self.remove = remove
+        self.folder = folder
+        self.protected = protected or (lambda: set())
+        self.margin = margin
+        self._lock = threading.Lock()
+
+    def _plan(self, size):
+        free = self.free_space()
+        if free is None:
+            return {"size": size, "free": None, "shortfall": 0, "fits": True, "evict": [], "freed": 0}
+        shortfall = size + self.margin - free
+        evict, freed = [], 0
+        if shortfall > 0:
+            protected = set(self.protected())
+            for entry in self.catalog.least_recently_used(self.folder):
+                if freed >= shortfall:
+                    break
+                if entry['path'] in protected:
+                    continue
+                evict.append({"path": entry['path'], "size": entry['size'], "printed": entry['printed'],
+                              "uploaded": entry['uploaded']})
+                freed += entry['size']
+        return {"size": size, "free": free, "shortfall": max(0, shortfall),
+                "fits": freed >= shortfall, "evict": evict, "freed": freed}
+
+    def plan(self, size):
+        """Dry run: what make_room(size) would remove
+
+        Returns:
+            dict: size, free, shortfall, fits, evict (files in removal order)
+                and freed (their total size)
+        """
+        with self._lock:
+            return self._plan(size)
+
+    def make_room(self, size, evict=True):
+        """Free space for an upload of size bytes
+
+        Call with the USB gadget queue held, right before the file is
+        written into the drive.
+
+        Args:
+            size: Upload size in bytes
+            evict: Remove files if needed; False only checks whether it fits
+
+        Returns:
+            dict: The plan, with 'evicted' listing the removed files (and
+                'evictable' when evict was False but removing files would make
+                room). Nothing is removed when the upload cannot fit.
+        """
+        with self._lock:
+            plan = self._plan(size)
+            plan['evicted'] = []
+            if plan['evict'] and not evict:
+                # Only checking: report whether removing the planned files would make room
+                plan['evictable'], plan['fits'] = plan['fits'], False
+            if not plan['fits']:
+                return plan
+            evicted = plan['evicted']
+            for entry in plan['evict']:
+                try:
+                    self.remove(entry['path'])
+                    evicted.append(entry['path'])
+                except OSError as e:
+                    logger.error(f"Could not evict {entry['path']} from the USB gadget: {e}")
+            if evicted:
+                logger.info(f"Evicted {len(evicted)} file(s) from the USB gadget for a {size} byte upload: "
+                            f"{', '.join(evicted)}")
+            if len(evicted) < len(plan['evict']):
+                plan['fits'] = False
+            return plan
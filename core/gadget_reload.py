@@ -0,0 +1,147 @@
+"""
+Debounced USB Gadget Reloads
+
+The printer only notices changes to the Pi's virtual USB drive after the
+gadget was disconnected and reconnected, which takes several seconds
+(scripts/reload_usb_gadget.sh). Uploads and deletes used to run that reload
+synchronously, one per change. ReloadScheduler batches the changes made
+within a short quiet window into a single reload, which runs in a
+background thread, so the request that caused a change returns right away
+with the time the reload is expected.
+
+The reload holds the USB gadget transfer queue while it runs, so it never
+unmounts the drive under an upload that is still writing to it; changes
+made while it waits for the queue join the same reload.
+"""
+
+import threading
+import time
+from contextlib import nullcontext
+
+from loguru import logger
+
+
+RELOAD_DELAY = 2.0        # Seconds without further changes before reloading
+RELOAD_MAX_DELAY = 10.0   # Longest a change waits while more keep coming
+
+
+class ReloadScheduler:
+    """Coalesces reload requests into one background reload"""
+
+    def __init__(self, reload, slot=None, delay=RELOAD_DELAY, max_delay=RELOAD_MAX_DELAY, on_change=None):
+        """
+        Args:
+            reload: Callable performing the reload; returns True on success
+            slot: Optional callable returning a context manager held while
+                reloading (e.g. the USB gadget transfer queue)
+            delay: Quiet window after the last change
+            max_delay: Maximum wait after the first change of a batch
+            on_change: Optional callback(status) called when a reload is
+                scheduled, starts and finishes (status['event'])
+        """
+        self._reload = reload
+        self._slot = slot or nullcontext
+        self.delay = delay
+        self.max_delay = max_delay
+        self.on_change = on_change
+        self._cond = threading.Condition()
+        self._pending = []     # Reasons of changes not reloaded yet
+        self._first = None     # Monotonic time of the first pending change
+        self._due = None       # Monotonic time the pending reload is due
+        self._reloading = []   # Reasons covered by the reload in progress
+        self._last = None      # Outcome of the last reload
+        self._thread = None
+
+    def request(self, reason='', delay=None):
+        """Schedule a reload for a change; never blocks
+
+        Args:
+            reason: What changed (for logs and status)
+            delay: Quiet window for this request (0 reloads as soon as
+                possible, e.g. a manual refresh)
+
+        Returns:
+            dict: Status including 'due_in', the seconds until the reload
+                is expected to start
+        """
+        now = time.monotonic()
+        with self._cond:
+            if not self._pending:
+                self._first = now
+            self._pending.append(reason)
+            due = now + (self.delay if delay is None else delay)
+            self._due = min(due, self._first + self.max_delay)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='usb-gadget-reload', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            status = self._status(now, 'scheduled')
+        logger.info(f"USB gadget reload for '{reason}' scheduled in {status['due_in']:.1f}s "
+                    f"({len(status['pending'])} change(s) pending)")
+        self._publish(status)
+        return status
+
+    def status(self):
+        """Pending changes, expected reload time and the last outcome"""
+        with self._cond:
+            return self._status(time.monotonic())
+
+    def _status(self, now, event=None):
+        """Status dict (caller holds the condition)"""
+        if self._reloading:
+            state = 'reloading'
+        elif self._pending:
+            state = 'scheduled'
+        else:
+            state = 'idle'
+        return {
+            'state': state,
+            'event': event,
+            'pending': list(self._pending),
+            'reloading': list(self._reloading),
+            'due_in': round(max(0.0, self._due - now), 1) if self._due is not None else None,
+            'last': dict(self._last) if self._last else None,
+        }
+
+    def _publish(self, status):
+        if self.on_change:
+            try:
+                self.on_change(status)
+            except Exception as e:
+                logger.error(f"Publishing USB gadget reload status failed: {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._pending:
+                        self._thread = None
+                        return
+                    wait = self._due - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+
+            # Wait for uploads writing into the gadget; their changes join this reload
+            with self._slot():
+                with self._cond:
+                    batch, self._pending = self._pending, []
+                    self._first = self._due = None
+                    self._reloading = batch
+                    status = self._status(time.monotonic(), 'started')
+                self._publish(status)
+
+                logger.info(f"Reloading USB gadget for {len(batch)} change(s): {', '.join(filter(None, batch))}")
+                start = time.monotonic()
+                try:
+                    ok = bool(self._reload())
+                except Exception as e:
+                    logger.error(f"USB gadget reload failed: {e}")
+                    ok = False
+
+            with self._cond:
+                self._reloading = []
+                self._last = {'ok': ok, 'changes': batch, 'duration': round(time.monotonic() - start, 1),
+                              'finished': time.time()}
+                status = self._status(time.monotonic(), 'finished')
+            self._publish(status)
@@ -0,0 +1,95 @@
+"""
+Targeted USB Gadget Flush
+
+Before the printer is told about new files, what ChitUI wrote into the
+USB gadget has to be on the image. That used to be os.sync(), which
+flushes every file system on the Pi - logs, settings, anything another
+process is writing - and can take seconds under unrelated disk load.
+GadgetWrites remembers which files were written into (or removed from)
+the gadget folder and flushes only those, their directories and the FAT
+volume itself (syncfs).
+"""
+
+import ctypes
+import os
+import threading
+import time
+
+from loguru import logger
+
+
+def syncfs(fd):
+    """Flush the file system fd lives on (falls back to fsync(fd) without syncfs)"""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.syncfs(fd) == 0:
+            return 'syncfs'
+        logger.debug(f"syncfs failed: {os.strerror(ctypes.get_errno())}")
+    except (OSError, AttributeError):
+        pass
+    os.fsync(fd)
+    return 'fsync'
+
+
+class GadgetWrites:
+    """Files written into the USB gadget folder since the last flush"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._files = set()
+        self._dirs = set()
+        self.last_flush = None   # {'files', 'dirs', 'method', 'seconds'} of the last flush
+
+    def written(self, path):
+        """Record a file written (or replaced) in the gadget folder"""
+        with self._lock:
+            self._files.add(os.path.abspath(path))
+            self._dirs.add(os.path.dirname(os.path.abspath(path)))
+
+    def removed(self, path):
+        """Record a file or directory removed from the gadget folder"""
+        with self._lock:
+            self._files.discard(os.path.abspath(path))
+            self._dirs.add(os.path.dirname(os.path.abspath(path)))
+
+    def flush(self, volume=True):
+        """fsync the recorded files and their directories, then the volume
+
+        Args:
+            volume: Also flush the folder's file system (the FAT volume when the
+                image is mounted there); not needed when it is a plain folder
+
+        Returns:
+            dict: What was flushed and how long it took
+        """
+        with self._lock:
+            files, self._files = self._files, set()
+            dirs, self._dirs = self._dirs, set()
+        start = time.monotonic()
+        method = None
+        for path in sorted(files) + sorted(dirs):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Cannot flush {path}: {e}")
+                continue
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                logger.warning(f"fsync of {path} failed: {e}")
+            finally:
+                os.close(fd)
+        if volume and os.path.isdir(self.folder):
+            fd = os.open(self.folder, os.O_RDONLY)
+            try:
+                method = syncfs(fd)
+            finally:
+                os.close(fd)
+        self.last_flush = {'files': len(files), 'dirs': len(dirs), 'method': method,
+                           'seconds': round(time.monotonic() - start, 4)}
+        logger.debug(f"Flushed USB gadget: {len(files)} file(s), {len(dirs)} dir(s), "
+                     f"volume {method or 'skipped'} in {self.last_flush['seconds'] * 1000:.1f} ms")
+        return dict(self.last_flush)
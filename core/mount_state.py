@@ -0,0 +1,151 @@
+"""
+Mount State
+
+Answers 'is /mnt/usb_share mounted, and read-only?' from
+/proc/self/mountinfo instead of running 'mountpoint' and parsing the output
+of 'mount'. Once watch() started its thread, the mount table is kept in
+memory and only re-read when the kernel reports a change (it flags the
+file with POLLPRI/POLLERR on every mount, umount and remount), so queries
+cost nothing and listeners hear about remounts - e.g. vfat switching to
+read-only after an error - as they happen.
+
+Without the watcher (or for a mountinfo file in a test tree) every query
+reads the file again.
+"""
+
+import os
+import re
+import select
+import threading
+import time
+from collections import namedtuple
+
+from loguru import logger
+
+
+MOUNTINFO = '/proc/self/mountinfo'
+RESCAN_INTERVAL = 60.0   # Seconds between re-reads if a change notification is missed
+
+Mount = namedtuple('Mount', ['mount_point', 'source', 'fstype', 'options', 'read_only'])
+
+
+def _unescape(field):
+    """Mount points escape space, tab, newline and backslash as octal (\\040)"""
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def parse_mountinfo(text):
+    """Mount table from the text of /proc/<pid>/mountinfo
+
+    Returns:
+        dict: mount point -> Mount (the last mount wins where mounts are stacked)
+    """
+    mounts = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if '-' not in fields[6:]:
+            continue
+        separator = fields.index('-', 6)
+        if len(fields) < separator + 3:
+            continue
+        mount_point = _unescape(fields[4])
+        options = set(fields[5].split(','))
+        super_options = set(fields[separator + 3].split(',')) if len(fields) > separator + 3 else set()
+        mounts[mount_point] = Mount(mount_point, _unescape(fields[separator + 2]), fields[separator + 1],
+                                    options | super_options, 'ro' in options or 'ro' in super_options)
+    return mounts
+
+
+class MountState:
+    """The current mount table, optionally kept up to date by a watcher thread"""
+
+    def __init__(self, path=MOUNTINFO):
+        self.path = path
+        self._cond = threading.Condition()
+        self._mounts = {}
+        self._listeners = []
+        self._thread = None
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return parse_mountinfo(f.read())
+        except OSError as e:
+            logger.warning(f"Reading {self.path} failed: {e}")
+            return {}
+
+    def mounts(self):
+        """mount point -> Mount"""
+        if self._thread is None:
+            return self._read()
+        with self._cond:
+            return dict(self._mounts)
+
+    def get(self, mount_point):
+        """Mount at mount_point, or None if nothing is mounted there"""
+        return self.mounts().get(os.path.realpath(mount_point))
+
+    def is_mounted(self, mount_point):
+        return self.get(mount_point) is not None
+
+    def add_listener(self, callback):
+        """Call callback(mount_point, old Mount or None, new Mount or None) for each change the watcher sees"""
+        self._listeners.append(callback)
+
+    def wait(self, mount_point, mounted=True, timeout=5.0):
+        """Wait until mount_point is (or is no longer) mounted
+
+        Returns:
+            bool: Whether it happened within timeout
+        """
+        mount_point = os.path.realpath(mount_point)
+        if self._thread is not None:
+            with self._cond:
+                return self._cond.wait_for(lambda: (mount_point in self._mounts) == mounted, timeout)
+        deadline = time.monotonic() + timeout
+        interval = 0.01
+        while (mount_point in self._read()) != mounted:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+            interval = min(interval * 2, 0.2)
+        return True
+
+    def watch(self):
+        """Start keeping the table in memory, updated on kernel change notifications"""
+        if self._thread is not None:
+            return
+        with self._cond:
+            self._mounts = self._read()
+        self._thread = threading.Thread(target=self._watch, name='mount-state', daemon=True)
+        self._thread.start()
+
+    def _watch(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError as e:
+            logger.error(f"Cannot watch {self.path}: {e}")
+            return
+        poller = select.poll()
+        poller.register(fd, select.POLLPRI | select.POLLERR)
+        while True:
+            poller.poll(RESCAN_INTERVAL * 1000)
+            # Reading the file to the end re-arms the notification
+            os.lseek(fd, 0, os.SEEK_SET)
+            chunks = []
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            mounts = parse_mountinfo(b''.join(chunks).decode('utf-8', 'replace'))
+            with self._cond:
+                old, self._mounts = self._mounts, mounts
+                self._cond.notify_all()
+            for mount_point in set(old) | set(mounts):
+                if old.get(mount_point) != mounts.get(mount_point):
+                    for listener in self._listeners:
+                        try:
+                            listener(mount_point, old.get(mount_point), mounts.get(mount_point))
+                        except Exception as e:
+                            logger.error(f"Mount state listener failed: {e}")
@@ -0,0 +1,173 @@
+"""
+Streaming multipart/form-data Body
+
+requests builds a multipart body in memory, so posting a whole print file
+(USB-destination uploads send it in one request) needs as much RAM as the
+file is large. MultipartFileStream produces the same body on the fly: the
+form fields and the part header are small byte strings, the file content is
+read from disk block by block while the request is being sent. Memory use
+stays constant regardless of the file size.
+
+MultipartBuffer does the same for content that is already in memory (a part
+sliced from a memory-mapped file): it yields the header, a memoryview of the
+content and the trailer, which urllib3 hands to socket.sendall() one by one,
+so the part is never copied into a new bytes object.
+
+Usage:
+    with MultipartFileStream(fields, 'File', filename, filepath) as body:
+        requests.post(url, data=body, headers={'Content-Type': body.content_type})
+"""
+
+import os
+import uuid
+
+
+BLOCK_SIZE = 256 * 1024
+
+
+def _quote(value):
+    """Escape a header parameter value (filenames may not contain raw quotes)"""
+    return str(value).replace('\\', '\\\\').replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+
+def _multipart_envelope(boundary, fields, file_field, filename, content_type):
+    """Encoded form fields plus file part header, and the closing boundary"""
+    head = []
+    for name, value in fields.items():
+        head.append(f'--{boundary}\r\n'
+                    f'Content-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+                    f'{value}\r\n')
+    head.append(f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="{_quote(file_field)}"; filename="{_quote(filename)}"\r\n'
+                + (f'Content-Type: {content_type}\r\n' if content_type else '') + '\r\n')
+    return ''.join(head).encode('utf-8'), f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+
+class MultipartFileStream:
+    """File-like multipart/form-data body with one file part read from disk"""
+
+    def __init__(self, fields, file_field, filename, filepath,
+                 content_type='application/octet-stream', on_progress=None):
+        """
+        Args:
+            fields: Form fields sent before the file (dict)
+            file_field: Name of the file part
+            filename: Filename announced in the file part
+            filepath: Local file whose content is streamed
+            content_type: Content-Type of the file part
+            on_progress: Optional callback(file_bytes_sent, file_size)
+        """
+        self.boundary = uuid.uuid4().hex
+        self.on_progress = on_progress
+
+        self._head, self._tail = _multipart_envelope(self.boundary, fields, file_field, filename, content_type)
+
+        self._file = open(filepath, 'rb')
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        self._length = len(self._head) + self._file_size + len(self._tail)
+        self._pos = 0
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._length
+        self._pos = max(0, min(offset, self._length))
+        return self._pos
+
+    def read(self, size=-1):
+        remaining = self._length - self._pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+
+        head_end = len(self._head)
+        file_end = head_end + self._file_size
+        chunks = []
+        while size > 0:
+            if self._pos < head_end:
+                chunk = self._head[self._pos:self._pos + size]
+            elif self._pos < file_end:
+                self._file.seek(self._pos - head_end)
+                chunk = self._file.read(min(size, file_end - self._pos))
+                if not chunk:
+                    raise IOError(f"{self._file.name} shrank while it was being sent")
+            else:
+                start = self._pos - file_end
+                chunk = self._tail[start:start + size]
+            chunks.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+
+        if self.on_progress and chunks:
+            self.on_progress(min(max(self._pos - head_end, 0), self._file_size), self._file_size)
+        return b''.join(chunks)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(BLOCK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MultipartBuffer:
+    """Iterable multipart/form-data body with one file part from a buffer
+
+    The buffer (bytes, mmap or memoryview) is not copied: iterating yields
+    a memoryview of it between the encoded header and trailer. close()
+    releases that view, so a memory map it came from can be closed.
+    """
+
+    def __init__(self, fields, file_field, filename, buffer, content_type='application/octet-stream'):
+        """
+        Args:
+            fields: Form fields sent before the file (dict)
+            file_field: Name of the file part
+            filename: Filename announced in the file part
+            buffer: File content (any object supporting the buffer protocol)
+            content_type: Content-Type of the file part (None: no header,
+                like requests' files= with a (name, data) tuple)
+        """
+        self.boundary = uuid.uuid4().hex
+        self._head, self._tail = _multipart_envelope(self.boundary, fields, file_field, filename, content_type)
+        self._view = memoryview(buffer)
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self._head) + self._view.nbytes + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        yield self._view
+        yield self._tail
+
+    def close(self):
+        self._view.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,104 @@
+"""
+Print File Compatibility Check
+
+A printer refuses a file sliced for another machine or resolution
+(SDCP_PRINT_CTRL_ACK_INVLAID_RESOLUTION, ..._UNKNOW_MODEL), but only when
+the print is started - after the whole file has been transferred.
+check_print_file compares the parsed header of an upload (see file_header)
+with the attributes the printer reported over SDCP (sdcp/attributes), so a
+wrong-printer upload is refused before anything is sent to the printer.
+
+Only clear mismatches are reported: encrypted CTB files, headers without a
+field and printers that did not report an attribute are let through. A file
+type or resolution mismatch is a refusal; a machine name that differs is
+only a warning (check_machine_name) the user can override, since slicer
+profiles and printers do not always name a machine the same way.
+"""
+
+import re
+
+
+# Printer models ChitUI fills in when it does not know the real one (saved and manual printers)
+PLACEHOLDER_MODELS = ('', 'unknown', 'manual')
+# Brand names slicer profiles put in front of the machine name ('ELEGOO Saturn 4 Ultra')
+BRAND_PREFIXES = ('elegoo',)
+
+
+class IncompatiblePrintFile(ValueError):
+    """The print file does not fit the target printer
+
+    can_force is True when the user may send it anyway (only a warning).
+    """
+
+    def __init__(self, message, can_force=False):
+        super().__init__(message)
+        self.can_force = can_force
+
+
+def parse_resolution(value):
+    """SDCP 'Resolution' attribute ('7680x4320') as (x, y), or None"""
+    match = re.match(r'^\s*(\d+)\s*[xX*]\s*(\d+)\s*$', str(value or ''))
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def normalize_machine_name(name):
+    """Machine name for comparison: lower case alphanumerics without the brand"""
+    name = re.sub(r'[^a-z0-9]', '', (name or '').lower())
+    for prefix in BRAND_PREFIXES:
+        if name.startswith(prefix) and name != prefix:
+            name = name[len(prefix):]
+    return name
+
+
+def check_print_file(header, attributes):
+    """Check a print file header against a printer
+
+    Args:
+        header: Parsed header (parse_print_file_header), may be None
+        attributes: The printer's last SDCP Attributes (may be empty)
+
+    Returns:
+        str: Why the printer would refuse the file, or None if it fits
+            (or nothing can be said)
+    """
+    if not header or header.get('encrypted'):
+        return None
+    attributes = attributes or {}
+    problems = []
+
+    supported = [str(t).lower() for t in attributes.get('SupportFileType') or []]
+    file_types = {header.get('format'), 'ctb' if header.get('format') == 'cbddlp' else None} - {None}
+    if supported and file_types and not file_types & set(supported):
+        problems.append(f"printer does not accept .{header['format']} files "
+                        f"(supported: {', '.join(map(str, attributes['SupportFileType']))})")
+
+    resolution = parse_resolution(attributes.get('Resolution'))
+    file_resolution = (header.get('resolution_x'), header.get('resolution_y'))
+    if resolution and all(file_resolution) and file_resolution not in (resolution, resolution[::-1]):
+        problems.append(f"file is sliced for {file_resolution[0]}x{file_resolution[1]}, "
+                        f"printer resolution is {resolution[0]}x{resolution[1]}")
+
+    return '; '.join(problems) or None
+
+
+def check_machine_name(header, attributes, model=None):
+    """Warn about a print file sliced for a differently named machine
+
+    Args:
+        header: Parsed header (parse_print_file_header), may be None
+        attributes: The printer's last SDCP Attributes (may be empty)
+        model: Model name known from discovery, used when the attributes
+            carry no MachineName; placeholders ('Unknown', 'Manual') are ignored
+
+    Returns:
+        str: The mismatch, or None if the names agree or one is unknown
+    """
+    if not header or header.get('encrypted'):
+        return None
+    printer_name = (attributes or {}).get('MachineName')
+    if not printer_name and normalize_machine_name(model) not in PLACEHOLDER_MODELS:
+        printer_name = model
+    file_name, expected = normalize_machine_name(header.get('machine_name')), normalize_machine_name(printer_name)
+    if file_name and expected and file_name != expected:
+        return f"file is sliced for '{header['machine_name']}', printer is '{printer_name}'"
+    return None
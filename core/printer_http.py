@@ -0,0 +1,173 @@
+"""
+Pooled HTTP Sessions for Printer Transfers
+
+Chunked uploads post hundreds of 1MB parts to the same printer. A plain
+requests.post() opens a new TCP connection for each of them; instead every
+printer gets one keep-alive requests.Session whose connections use larger
+socket buffers and TCP_NODELAY. All of them share one optional bandwidth
+cap, so parallel transfers to several printers cannot saturate the Pi's
+network link. The cap is applied while a request body is sent, block by
+block, so a whole file posted in one request is paced too.
+"""
+
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from loguru import logger
+from urllib3.connection import HTTPConnection
+
+
+# Socket send/receive buffer for printer connections (bytes)
+PRINTER_SOCKET_BUFFER = 1024 * 1024
+
+# Connections kept open per printer
+PRINTER_POOL_SIZE = 2
+
+# Bytes sent between two checks of the bandwidth cap
+THROTTLE_BLOCK = 64 * 1024
+
+
+class TunedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections are tuned for bulk uploads"""
+
+    socket_options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        (socket.SOL_SOCKET, socket.SO_SNDBUF, PRINTER_SOCKET_BUFFER),
+        (socket.SOL_SOCKET, socket.SO_RCVBUF, PRINTER_SOCKET_BUFFER),
+    ]
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class BandwidthLimiter:
+    """Token bucket shared by all printer transfers (0 = unlimited)"""
+
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self._available = 0.0
+        self._last = time.monotonic()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = max(0, rate)
+            self._available = 0.0
+            self._last = time.monotonic()
+
+    def consume(self, nbytes):
+        """Account for nbytes about to be sent; sleep as long as the cap requires"""
+        with self._lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            # Allow at most one second of burst
+            self._available = min(self.rate, self._available + (now - self._last) * self.rate)
+            self._last = now
+            self._available -= nbytes
+            delay = -self._available / self.rate if self._available < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+bandwidth_limiter = BandwidthLimiter()
+
+
+class ThrottledBody:
+    """Request body that waits for the bandwidth cap before each block is sent
+
+    Wraps bytes, a memoryview or an iterable body with a length
+    (MultipartFileStream, MultipartBuffer); the length keeps the request
+    from being sent chunked, and blocks are memoryview slices, not copies.
+    """
+
+    def __init__(self, body, limiter, block_size=THROTTLE_BLOCK):
+        self.body = body
+        self.limiter = limiter
+        self.block_size = block_size
+
+    def __len__(self):
+        return len(self.body)
+
+    def __iter__(self):
+        chunks = [self.body] if isinstance(self.body, (bytes, bytearray, memoryview)) else self.body
+        for chunk in chunks:
+            view = memoryview(chunk)
+            for start in range(0, view.nbytes, self.block_size):
+                block = view[start:start + self.block_size]
+                self.limiter.consume(block.nbytes)
+                yield block
+
+
+def set_bandwidth_limit(bytes_per_second):
+    """Cap the combined upload rate to all printers (0 disables the cap)"""
+    bandwidth_limiter.set_rate(bytes_per_second)
+    if bytes_per_second:
+        logger.info(f"Printer upload bandwidth capped at {bytes_per_second / 1048576:.1f} MB/s")
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def printer_session(printer_ip):
+    """Return the shared keep-alive session for a printer"""
+    with _sessions_lock:
+        session = _sessions.get(printer_ip)
+        if session is None:
+            session = requests.Session()
+            adapter = TunedHTTPAdapter(pool_connections=1, pool_maxsize=PRINTER_POOL_SIZE, max_retries=0)
+            session.mount('http://', adapter)
+            session.headers['Connection'] = 'keep-alive'
+            _sessions[printer_ip] = session
+            logger.debug(f"Created pooled HTTP session for printer {printer_ip}")
+        return session
+
+
+def session_for_url(url):
+    """Return the shared session for the printer a URL points at"""
+    return printer_session(urlparse(url).hostname)
+
+
+def close_printer_session(printer_ip):
+    """Close and forget the session of a printer (e.g. when it is removed)"""
+    with _sessions_lock:
+        session = _sessions.pop(printer_ip, None)
+    if session is not None:
+        session.close()
+
+
+def timed_post(url, stats=None, **kwargs):
+    """POST through the printer's pooled session and record timing.
+
+    Args:
+        url: Printer URL
+        stats: Optional dict that receives 'elapsed' (seconds), 'bytes'
+            (request body size) and 'throughput' (bytes/second)
+        **kwargs: Passed to requests.Session.post
+
+    Returns:
+        requests.Response
+    """
+    session = session_for_url(url)
+    body = kwargs.get('data')
+    # Streaming bodies (MultipartFileStream) report their length without being read
+    sent = len(body) if hasattr(body, '__len__') and not isinstance(body, (dict, str)) else 0
+    if sent and bandwidth_limiter.rate:
+        kwargs['data'] = ThrottledBody(body, bandwidth_limiter)
+    start = time.monotonic()
+    response = session.post(url, **kwargs)
+    elapsed = time.monotonic() - start
+
+    if stats is not None:
+        stats['elapsed'] = elapsed
+        stats['bytes'] = sent
+        stats['throughput'] = sent / elapsed if elapsed > 0 else 0
+    logger.debug(f"POST {urlparse(url).path}: {sent} bytes in {elapsed * 1000:.0f} ms "
+                 f"({sent / elapsed / 1048576 if elapsed > 0 else 0:.2f} MB/s)")
+    return response
@@ -0,0 +1,326 @@
+"""
+Printer Upload Helpers for ChitUI
+
+Chunked uploads to the printer's HTTP endpoint (port 3030,
+/uploadFile/upload). Every part is a multipart POST carrying the file MD5,
+a transfer Uuid, the total size and the byte Offset of the part.
+"""
+
+import json
+import mmap
+import os
+import re
+import threading
+import time
+import uuid
+
+import requests
+from loguru import logger
+
+from .chunk_tuning import PART_SIZE
+from .multipart_stream import MultipartBuffer
+from .printer_http import timed_post
+from .transfer_journal import transfer_key
+
+
+# Attempts per part before a transfer is given up, and the backoff between
+# them (doubled after every failed attempt, capped at RETRY_BACKOFF_MAX)
+PART_RETRIES = 5
+PART_TIMEOUT = 30  # Seconds per part request (learned per printer, see transfer_strategy)
+RETRY_BACKOFF = 1.0
+RETRY_BACKOFF_MAX = 15.0
+
+# Minimum interval between journal writes while a transfer is running
+JOURNAL_INTERVAL = 2.0
+
+MD5_PATTERN = re.compile(r'^[0-9a-fA-F]{32}$')
+
+
+def printer_upload_url(printer_ip):
+    """Return the printer's upload endpoint"""
+    return 'http://{ip}:3030/uploadFile/upload'.format(ip=printer_ip)
+
+
+def new_upload_post_data(md5, total_size):
+    """Form fields shared by every part of one transfer"""
+    return {
+        'S-File-MD5': md5,
+        'Check': 1,
+        'Offset': 0,
+        'Uuid': uuid.uuid4(),
+        'TotalSize': total_size,
+    }
+
+
+def upload_file_part(url, post_data, file_name, file_part, offset, stats=None, timeout=PART_TIMEOUT):
+    """Upload a single chunk to the printer
+
+    The chunk goes through the printer's pooled keep-alive session. It may
+    be bytes or a memoryview (e.g. a slice of a memory-mapped file); either
+    way it is sent without being copied into the request body. If stats is
+    a dict it receives the timing of the request (see timed_post).
+    """
+    post_data['Offset'] = offset
+
+    try:
+        with MultipartBuffer(post_data, 'File', file_name, file_part, content_type=None) as body:
+            response = timed_post(url, stats=stats, data=body, headers={'Content-Type': body.content_type},
+                                  timeout=timeout)
+
+        # Log response details for debugging
+        logger.debug(f"Upload response status: {response.status_code}")
+        logger.debug(f"Upload response headers: {response.headers}")
+
+        # Try to parse JSON response
+        try:
+            status = json.loads(response.text)
+        except json.JSONDecodeError:
+            logger.error("Failed to parse JSON response from printer")
+            logger.error(f"Response status code: {response.status_code}")
+            logger.error(f"Response body: {response.text[:500]}")  # First 500 chars
+            return False
+
+        if status.get('success'):
+            return True
+        else:
+            logger.error(f"Upload part failed: {status}")
+            return False
+    except requests.exceptions.RequestException as req_err:
+        logger.error(f"Upload request error: {req_err}")
+        return False
+    except Exception as e:
+        logger.error(f"Upload part error: {e}")
+        return False
+
+
+def upload_part_with_retry(url, post_data, file_name, file_part, offset, retries=PART_RETRIES, stats=None,
+                           timeout=PART_TIMEOUT):
+    """Upload one chunk, retrying with exponential backoff.
+
+    The printer keeps the parts it already acknowledged for a Uuid, so a
+    failed part can simply be sent again at the same Offset.
+    """
+    delay = RETRY_BACKOFF
+    for attempt in range(1, retries + 1):
+        if upload_file_part(url, post_data, file_name, file_part, offset, stats=stats, timeout=timeout):
+            return True
+        if attempt < retries:
+            logger.warning(f"Part at offset {offset} failed (attempt {attempt}/{retries}), "
+                           f"retrying in {delay:.0f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_BACKOFF_MAX)
+    return False
+
+
+def read_part(stream, size):
+    """Read exactly size bytes from stream (fewer only at end of stream)"""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+def relay_upload(stream, printer_ip, filename, md5, total_size, on_progress=None, part_size=PART_SIZE,
+                 check_header=None):
+    """Forward an incoming byte stream to the printer as it arrives.
+
+    Nothing is written to local storage: each part is posted to the printer
+    as soon as it has been read from the client, so the transfer runs at the
+    speed of the slower of the two links.
+
+    Args:
+        stream: Readable stream with the raw file content (e.g. request.stream)
+        printer_ip: IP address of the printer
+        filename: Name the file gets on the printer
+        md5: MD5 hex digest of the complete file, computed by the client
+        total_size: Size of the file in bytes
+        on_progress: Optional callback(bytes_sent, total_size)
+        part_size: Size of each forwarded part
+        check_header: Optional callable(first part) run before anything is
+            sent to the printer; it may raise to refuse the file
+
+    Returns:
+        bool: True if the printer acknowledged every part
+    """
+    url = printer_upload_url(printer_ip)
+    post_data = new_upload_post_data(md5, total_size)
+    offset = 0
+
+    logger.info(f"Relaying '{filename}' ({total_size} bytes) to {printer_ip}")
+    while offset < total_size:
+        part = read_part(stream, min(part_size, total_size - offset))
+        if not part:
+            logger.error(f"Client stream ended at {offset}/{total_size} bytes")
+            return False
+        if offset == 0 and check_header:
+            check_header(part)
+
+        if not upload_part_with_retry(url, post_data, filename, part, offset):
+            logger.error(f"Printer rejected part at offset {offset}")
+            return False
+
+        offset += len(part)
+        if on_progress:
+            on_progress(offset, total_size)
+
+    logger.info(f"✓ Relay of '{filename}' complete")
+    return True
+
+
+def upload_file_chunked(printer_ip, filepath, md5, on_progress=None, journal=None,
+                        filename=None, part_size=PART_SIZE, sizer=None, data=None, part_timeout=PART_TIMEOUT):
+    """Upload a local file to the printer in parts, resuming where possible.
+
+    Every part is retried with backoff. When a journal is given, the transfer
+    Uuid and the last acknowledged Offset are recorded in it, so a transfer
+    of the same file to the same printer that failed (or was cut short by a
+    restart) continues from that offset instead of starting over. If the
+    printer no longer accepts the old Uuid, the transfer restarts from zero.
+
+    Args:
+        printer_ip: IP address of the printer
+        filepath: Local file to send
+        md5: MD5 hex digest of the file
+        on_progress: Optional callback(bytes_sent, total_size)
+        journal: Optional TransferJournal for resumable state
+        filename: Name the file gets on the printer (default: basename)
+        part_size: Size of each part (ignored when a sizer is given)
+        sizer: Optional AdaptiveChunkSizer
+        data: Optional buffer with the file content (e.g. a shared mmap);
+            otherwise the file is memory-mapped here. Parts are memoryview
+            slices of it, so no part is copied before it reaches the socket
+        part_timeout: Request timeout for each part (seconds)
+
+    Returns:
+        bool: True if the printer acknowledged every part
+    """
+    filename = filename or os.path.basename(filepath)
+    total_size = os.path.getsize(filepath)
+    url = printer_upload_url(printer_ip)
+    key = transfer_key(printer_ip, md5)
+
+    state = journal.get(key) if journal else None
+    if state and state.get('total_size') == total_size and state.get('filename') == filename:
+        offset = min(state.get('offset', 0), total_size)
+        post_data = new_upload_post_data(md5, total_size)
+        post_data['Uuid'] = state['uuid']
+        resumed = offset > 0
+        if resumed:
+            logger.info(f"Resuming upload of '{filename}' to {printer_ip} at {offset}/{total_size} bytes")
+    else:
+        offset = 0
+        post_data = new_upload_post_data(md5, total_size)
+        resumed = False
+
+    state = {
+        'key': key,
+        'printer_ip': printer_ip,
+        'filepath': os.path.abspath(filepath),
+        'filename': filename,
+        'md5': md5,
+        'uuid': str(post_data['Uuid']),
+        'total_size': total_size,
+        'offset': offset,
+    }
+    if journal:
+        journal.save(state)
+    last_saved = time.monotonic()
+
+    with open(filepath, 'rb') as f:
+        # Parts are slices of one mapping of the file (or of the shared one),
+        # handed to the HTTP layer as memoryviews without being copied
+        mapped = data
+        if mapped is None and total_size:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with memoryview(mapped if mapped is not None else b'') as view:
+                while offset < total_size:
+                    size = min(sizer.size if sizer else part_size, total_size - offset)
+                    with view[offset:offset + size] as part:
+                        # While the sizer can still go smaller, give up on a size quickly
+                        retries = 2 if sizer and sizer.can_shrink() else PART_RETRIES
+                        stats = {}
+                        if not upload_part_with_retry(url, post_data, filename, part, offset, retries=retries,
+                                                      stats=stats, timeout=part_timeout):
+                            if resumed:
+                                # The printer may have dropped the old transfer; start over once
+                                logger.warning(f"Printer did not accept resumed transfer of '{filename}', restarting")
+                                resumed = False
+                                offset = 0
+                                post_data = new_upload_post_data(md5, total_size)
+                                state.update(uuid=str(post_data['Uuid']), offset=0)
+                                if journal:
+                                    journal.save(state)
+                                continue
+                            if sizer and sizer.can_shrink():
+                                sizer.failed()
+                                logger.warning(f"Retrying offset {offset} with {sizer.size // 1024} KB parts")
+                                continue
+                            logger.error(f"Upload of '{filename}' stopped at {offset}/{total_size} bytes")
+                            if journal:
+                                journal.save(state)
+                            return False
+
+                        resumed = False
+                        if sizer:
+                            sizer.record(len(part), stats.get('elapsed', 0))
+                        offset += len(part)
+                        state['offset'] = offset
+                        if journal and time.monotonic() - last_saved >= JOURNAL_INTERVAL:
+                            journal.save(state)
+                            last_saved = time.monotonic()
+                        if on_progress:
+                            on_progress(offset, total_size)
+        finally:
+            if data is None and mapped is not None:
+                mapped.close()
+
+    if journal:
+        journal.remove(key)
+    return True
+
+
+def upload_file_to_many(filepath, targets, send):
+    """Send one local file to several printers concurrently.
+
+    The file is memory-mapped once and every transfer slices its parts from
+    that mapping, so all printers are fed from the same pages in the page
+    cache instead of each transfer reading the file on its own.
+
+    Args:
+        filepath: Local file to send
+        targets: Printer identifiers
+        send: Callable send(target, data) -> bool that runs one transfer;
+            data is the shared mmap (None for an empty file)
+
+    Returns:
+        dict: target -> True if that printer received the whole file
+    """
+    results = {}
+
+    def run(target, data):
+        try:
+            results[target] = bool(send(target, data))
+        except Exception as e:
+            logger.error(f"Transfer to {target} failed: {e}")
+            results[target] = False
+
+    with open(filepath, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        try:
+            threads = [threading.Thread(target=run, args=(target, data), daemon=True) for target in targets]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if data is not None:
+                data.close()
+
+    return results
@@ -0,0 +1,174 @@
+"""
+Upload Progress Bus
+
+One place where transfers report their progress and from where it is
+pushed to the browsers. Each update is published (socket.io
+'upload_progress' in ChitUI) only when something a client would display
+changed: the percentage, the per-printer breakdown, or the byte count after
+at least PUBLISH_INTERVAL seconds. Events carry the bytes done, a smoothed
+transfer rate and the estimated time left.
+
+The bus is the single publisher for both ways browsers follow an upload:
+the emit callback feeds socket.io, and subscribe() feeds the /progress
+server-sent events stream. A subscriber blocks on the bus's condition until
+the next change instead of polling, and its stream ends at 100%, when the
+upload is discarded, after IDLE_TIMEOUT seconds without a change and in any
+case after STREAM_LIFETIME seconds, so it cannot hold a server thread
+forever.
+"""
+
+import threading
+import time
+
+from loguru import logger
+
+
+PUBLISH_INTERVAL = 1.0   # Seconds between events that only update bytes/rate
+RATE_ALPHA = 0.3         # Smoothing of the bytes/second estimate
+EXPIRY = 600.0           # Seconds after its last update an upload is forgotten
+KEEPALIVE = 15.0         # Seconds a subscriber waits before yielding a keep-alive
+IDLE_TIMEOUT = 60.0      # Seconds without a change after which a subscription ends
+STREAM_LIFETIME = 900.0  # Seconds a subscription lasts at most
+
+
+class ProgressBus:
+    """Thread-safe progress state per upload, published on change"""
+
+    def __init__(self, emit=None):
+        """
+        Args:
+            emit: Optional callback(event dict) that publishes an update
+                (e.g. socketio.emit('upload_progress', ...))
+        """
+        self.emit = emit
+        self._cond = threading.Condition()
+        self._uploads = {}  # upload_id -> state (keys starting with '_' are internal)
+
+    @staticmethod
+    def _event(state):
+        return {key: value for key, value in state.items() if not key.startswith('_')}
+
+    def _expire(self, now):
+        """Forget uploads nobody reported on for a while (caller holds self._cond)"""
+        for upload_id in [uid for uid, state in self._uploads.items() if now - state['_updated'] > EXPIRY]:
+            del self._uploads[upload_id]
+
+    def update(self, upload_id, progress=None, done=None, total=None, **extra):
+        """Report progress of an upload
+
+        Args:
+            upload_id: Upload being reported on
+            progress: Percentage to show (default: derived from done/total)
+            done: Bytes transferred so far
+            total: Total bytes of the transfer
+            **extra: Additional fields published with the event (e.g. printers)
+        """
+        now = time.monotonic()
+        with self._cond:
+            state = self._uploads.get(upload_id)
+            if state is None:
+                state = self._uploads[upload_id] = {
+                    'upload_id': upload_id, 'progress': None, 'bytes_done': None, 'bytes_total': None,
+                    'bytes_per_second': None, 'eta': None, 'version': 0,
+                    '_sample': None, '_published': 0.0, '_updated': now,
+                }
+                self._expire(now)
+            state['_updated'] = now
+
+            if done is not None:
+                self._measure(state, done, total, now)
+            if progress is None:
+                progress = (round(done * 100 / total) if total else 100) if done is not None else state['progress']
+            if progress is not None and progress >= 100:
+                state['eta'] = 0
+
+            changed = progress != state['progress'] or any(state.get(key) != value for key, value in extra.items())
+            if not changed and (done is None or now - state['_published'] < PUBLISH_INTERVAL):
+                return
+            state.update(extra, progress=progress)
+            state['version'] += 1
+            state['_published'] = now
+            event = self._event(state)
+            self._cond.notify_all()
+
+        if self.emit:
+            try:
+                self.emit(event)
+            except Exception as e:
+                logger.error(f"Publishing upload progress failed: {e}")
+
+    def _measure(self, state, done, total, now):
+        """Update bytes, smoothed rate and ETA (caller holds self._cond)"""
+        sample = state['_sample']
+        if sample is None or done < sample[1]:
+            # First sample, or the transfer restarted from an earlier offset
+            state['_sample'] = (now, done)
+            state['bytes_per_second'] = None
+        elif now > sample[0] and done > sample[1]:
+            rate = (done - sample[1]) / (now - sample[0])
+            previous = state['bytes_per_second']
+            state['bytes_per_second'] = round(rate if previous is None else
+                                              previous * (1 - RATE_ALPHA) + rate * RATE_ALPHA)
+            state['_sample'] = (now, done)
+
+        state['bytes_done'] = done
+        state['bytes_total'] = total
+        rate = state['bytes_per_second']
+        state['eta'] = round((total - done) / rate, 1) if total and rate else None
+
+    def get(self, upload_id):
+        """Latest event of an upload, or None"""
+        with self._cond:
+            state = self._uploads.get(upload_id)
+            return self._event(state) if state else None
+
+    def progress(self, upload_id, default=0):
+        """Latest percentage of an upload"""
+        event = self.get(upload_id)
+        return event['progress'] if event and event['progress'] is not None else default
+
+    def discard(self, upload_id):
+        with self._cond:
+            self._uploads.pop(upload_id, None)
+            self._cond.notify_all()
+
+    def wait(self, upload_id, after_version=0, timeout=None):
+        """Block until the upload has an event newer than after_version
+
+        Returns:
+            dict: The event, or None on timeout or when the upload was discarded
+        """
+        with self._cond:
+            state = self._uploads.get(upload_id)
+            if state is not None and state['version'] > after_version:
+                return self._event(state)
+            self._cond.wait_for(lambda: (self._uploads.get(upload_id) or {}).get('version', 0) > after_version
+                                or (state is not None and upload_id not in self._uploads), timeout)
+            state = self._uploads.get(upload_id)
+            return self._event(state) if state and state['version'] > after_version else None
+
+    def subscribe(self, upload_id, keepalive=KEEPALIVE, idle_timeout=IDLE_TIMEOUT, lifetime=STREAM_LIFETIME):
+        """Events of an upload as they are published, for a streaming response
+
+        Yields:
+            dict: Each new event; None after keepalive seconds without one
+        """
+        version = 0
+        start = last_change = time.monotonic()
+        while True:
+            now = time.monotonic()
+            remaining = min(idle_timeout - (now - last_change), lifetime - (now - start))
+            if remaining <= 0:
+                return
+            tracked = upload_id in self._uploads
+            event = self.wait(upload_id, version, timeout=min(keepalive, remaining))
+            if event is None:
+                if tracked and upload_id not in self._uploads:
+                    return   # Discarded (failed or cancelled)
+                yield None
+                continue
+            version = event['version']
+            last_change = time.monotonic()
+            yield event
+            if event['progress'] is not None and event['progress'] >= 100:
+                return
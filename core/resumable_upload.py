@@ -0,0 +1,213 @@
+"""
+Resumable Browser Uploads (tus-style)
+
+A single multipart POST has to start over when the browser's connection
+drops. Resumable uploads are created first (POST with the total size), then
+sent in one or more PATCH requests that each append at the current offset;
+a HEAD request returns the offset the server has, so an interrupted upload
+continues from there. Partial files live in a '.resumable' folder inside
+the upload folder together with a small JSON state file each, so they
+survive a restart until they expire.
+
+Follows the core protocol of tus 1.0 (https://tus.io/protocols/resumable-upload).
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from flask import Response
+from loguru import logger
+
+
+TUS_VERSION = '1.0.0'
+CHUNK_SIZE = 1048576          # Bytes read from the request stream at a time
+EXPIRY = 24 * 3600            # Seconds an unfinished upload is kept
+
+
+class UploadOffsetMismatch(ValueError):
+    """PATCH did not start at the offset the server has"""
+
+
+class UploadBusy(RuntimeError):
+    """Another request is already appending to this upload"""
+
+
+def parse_upload_metadata(header):
+    """Decode a tus Upload-Metadata header ('key base64value,key2 ...')
+
+    Raises:
+        ValueError: A value is not valid base64 or not UTF-8
+    """
+    metadata = {}
+    for pair in (header or '').split(','):
+        key, _, value = pair.strip().partition(' ')
+        if key:
+            try:
+                metadata[key] = base64.b64decode(value, validate=True).decode('utf-8') if value else ''
+            except (binascii.Error, UnicodeDecodeError) as e:
+                raise ValueError(f"Invalid Upload-Metadata value for '{key}': {e}") from e
+    return metadata
+
+
+def tus_response(body='', status=204, **headers):
+    """Flask response with the tus headers (Upload_Offset=... sets Upload-Offset)"""
+    response = Response(body, status=status, mimetype='application/json' if body else None)
+    response.headers['Tus-Resumable'] = TUS_VERSION
+    response.headers['Cache-Control'] = 'no-store'
+    for name, value in headers.items():
+        response.headers[name.replace('_', '-')] = str(value)
+    return response
+
+
+class ResumableUploads:
+    """Partial uploads in a folder, appended to at their current offset"""
+
+    def __init__(self, upload_folder, expiry=EXPIRY):
+        self.folder = os.path.join(upload_folder, '.resumable')
+        self.expiry = expiry
+        self._lock = threading.Lock()
+        self._busy = set()      # IDs with a PATCH in progress
+        self._hashers = {}      # ID -> (offset, running MD5) while appends are contiguous
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, upload_id, suffix):
+        return os.path.join(self.folder, f"{upload_id}{suffix}")
+
+    def _save_state(self, state):
+        temp_file = self._path(state['id'], '.json.tmp')
+        with open(temp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_file, self._path(state['id'], '.json'))
+
+    def create(self, size, metadata):
+        """Start an upload of size bytes; returns its state"""
+        self.expire()
+        state = {'id': uuid.uuid4().hex, 'size': size, 'offset': 0,
+                 'metadata': metadata, 'created': time.time(), 'updated': time.time()}
+        open(self._path(state['id'], '.part'), 'wb').close()
+        self._save_state(state)
+        with self._lock:
+            self._hashers[state['id']] = (0, hashlib.md5())
+        logger.info(f"Resumable upload {state['id']} created for '{metadata.get('filename')}' ({size} bytes)")
+        return state
+
+    def get(self, upload_id):
+        """State of an upload, or None if it does not exist"""
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(self._path(upload_id, '.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def append(self, upload_id, offset, stream):
+        """Append the request body to an upload.
+
+        Everything read before an error (e.g. the client disconnecting) is
+        kept and counted, so the next PATCH continues after it.
+
+        Returns:
+            dict: The updated state
+        """
+        with self._lock:
+            if upload_id in self._busy:
+                raise UploadBusy(upload_id)
+            self._busy.add(upload_id)
+        try:
+            state = self.get(upload_id)
+            if state is None:
+                raise KeyError(upload_id)
+            if offset != state['offset']:
+                raise UploadOffsetMismatch(f"offset {offset} != {state['offset']}")
+
+            with self._lock:
+                hashed, hasher = self._hashers.get(upload_id, (None, None))
+            if hashed != offset:
+                hasher = None
+
+            try:
+                with open(self._path(upload_id, '.part'), 'r+b') as f:
+                    f.truncate(offset)
+                    f.seek(offset)
+                    while state['offset'] < state['size']:
+                        chunk = stream.read(min(CHUNK_SIZE, state['size'] - state['offset']))
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        if hasher:
+                            hasher.update(chunk)
+                        state['offset'] += len(chunk)
+            finally:
+                state['updated'] = time.time()
+                self._save_state(state)
+                with self._lock:
+                    if hasher:
+                        self._hashers[upload_id] = (state['offset'], hasher)
+                    else:
+                        self._hashers.pop(upload_id, None)
+            return state
+        finally:
+            with self._lock:
+                self._busy.discard(upload_id)
+
+    def part_path(self, upload_id):
+        """Path of an upload's data received so far (e.g. to read its header before finish())"""
+        return self._path(upload_id, '.part')
+
+    def finish(self, upload_id, filepath, expect=None):
+        """Move a complete upload to filepath
+
+        Args:
+            expect: Optional callback(filepath, md5, size) run right before the
+                file appears at filepath (e.g. FileCatalog.expect)
+
+        Returns:
+            str: MD5 hex digest of the file
+        """
+        state = self.get(upload_id)
+        if state is None or state['offset'] != state['size']:
+            raise ValueError(f"Upload {upload_id} is not complete")
+
+        with self._lock:
+            hashed, hasher = self._hashers.pop(upload_id, (None, None))
+        part = self._path(upload_id, '.part')
+        if hashed != state['size']:
+            # Appends were not all seen by this process (e.g. after a restart)
+            hasher = hashlib.md5()
+            with open(part, 'rb') as f:
+                for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    hasher.update(block)
+
+        if expect:
+            expect(filepath, hasher.hexdigest(), state['size'])
+        shutil.move(part, filepath)
+        os.remove(self._path(upload_id, '.json'))
+        return hasher.hexdigest()
+
+    def remove(self, upload_id):
+        """Discard an upload"""
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        for suffix in ('.part', '.json'):
+            try:
+                os.remove(self._path(upload_id, suffix))
+            except OSError:
+                pass
+
+    def expire(self):
+        """Discard unfinished uploads that were not touched for a long time"""
+        now = time.time()
+        for name in os.listdir(self.folder):
+            if name.endswith('.json'):
+                state = self.get(name[:-5])
+                if state and now - state.get('updated', 0) > self.expiry:
+                    logger.info(f"Discarding expired resumable upload {state['id']}")
+                    self.remove(state['id'])
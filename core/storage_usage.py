@@ -0,0 +1,110 @@
+"""
+USB Gadget Storage Usage
+
+Every open ChitUI tab used to ask /usb-gadget/storage for the virtual USB
+drive's usage every 5 seconds, and each request ran statvfs and stat'ed
+the image again. StorageUsage computes it once, keeps the result and
+recomputes it only when something changed the drive (upload, delete, gadget
+reload, mount change). Clients get the new value pushed ('usb_gadget_storage'
+in ChitUI) - only when it actually differs - so the work does not grow with
+the number of open tabs.
+"""
+
+import os
+import shutil
+import threading
+import time
+
+from loguru import logger
+
+from core.fat_image import FatImage, FatImageError
+
+
+MAX_AGE = 60.0   # Seconds a cached value is served before get() recomputes it (missed changes)
+
+
+def gadget_storage_usage(folder, image, direct=False):
+    """Usage of the virtual USB drive as served by /usb-gadget/storage
+
+    Args:
+        folder: Mount point of the image (or the plain folder in direct mode)
+        image: Backing image file the printer sees
+        direct: Read usage from the image's file system instead of the folder
+    """
+    if direct:
+        if not os.path.exists(image):
+            return {"success": False, "available": False, "message": "USB gadget image not found"}
+        try:
+            with FatImage(image, readonly=True) as fat:
+                total, used, free = fat.usage()
+        except FatImageError as e:
+            return {"success": False, "available": False, "message": str(e)}
+    else:
+        if not os.path.exists(folder):
+            return {"success": False, "available": False, "message": "USB gadget mount point not found"}
+        stat = shutil.disk_usage(folder)
+        total, used, free = stat.total, stat.used, stat.free
+        # Use the image size if it's larger (more accurate)
+        if os.path.exists(image):
+            total = max(total, os.path.getsize(image))
+
+    return {
+        "success": True,
+        "available": True,
+        "total": total,
+        "used": used,
+        "free": free,
+        "percent": round((used / total * 100), 1) if total > 0 else 0,
+    }
+
+
+class StorageUsage:
+    """Cached storage usage, published when it changes"""
+
+    def __init__(self, compute, emit=None, max_age=MAX_AGE):
+        """
+        Args:
+            compute: Callable returning the usage dict (gadget_storage_usage)
+            emit: Optional callback(usage) publishing a changed value
+            max_age: Seconds a value is served before it is recomputed on get()
+        """
+        self._compute = compute
+        self.emit = emit
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._usage = None
+        self._computed = 0.0
+
+    def _recompute(self):
+        try:
+            usage = self._compute()
+        except Exception as e:
+            logger.error(f"Error getting USB gadget storage info: {e}")
+            usage = {"success": False, "available": False, "message": str(e)}
+        with self._lock:
+            changed, self._usage, self._computed = usage != self._usage, usage, time.monotonic()
+        return usage, changed
+
+    def get(self):
+        """Current usage (cached)"""
+        with self._lock:
+            if self._usage is not None and time.monotonic() - self._computed < self.max_age:
+                return dict(self._usage)
+        usage, changed = self._recompute()
+        if changed:
+            self._publish(usage)
+        return dict(usage)
+
+    def refresh(self):
+        """Recompute after the drive changed; publishes the value if it differs"""
+        usage, changed = self._recompute()
+        if changed:
+            self._publish(usage)
+        return dict(usage)
+
+    def _publish(self, usage):
+        if self.emit:
+            try:
+                self.emit(dict(usage))
+            except Exception as e:
+                logger.error(f"Publishing USB gadget storage failed: {e}")
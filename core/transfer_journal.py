@@ -0,0 +1,77 @@
+"""
+Transfer Journal for Resumable Printer Uploads
+
+Records the state of every chunked printer upload that is in flight
+(printer, file, MD5, transfer Uuid and the last acknowledged Offset) in a
+small JSON file, so an interrupted transfer can continue where it stopped -
+on the next attempt or after ChitUI restarts.
+"""
+
+import json
+import os
+import threading
+import time
+
+from loguru import logger
+
+
+def transfer_key(printer_ip, md5):
+    """Key identifying one file transfer to one printer"""
+    return f"{printer_ip}:{md5}"
+
+
+class TransferJournal:
+    """Thread-safe JSON journal of in-flight chunked transfers"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._transfers = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                transfers = json.load(f)
+            if transfers:
+                logger.info(f"Transfer journal: {len(transfers)} interrupted upload(s) can be resumed")
+            return transfers
+        except Exception as e:
+            logger.error(f"Error loading transfer journal {self.path}: {e}")
+            return {}
+
+    def _write(self):
+        """Persist the journal (caller holds the lock)"""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_file = self.path + '.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(self._transfers, f, indent=2)
+            os.replace(temp_file, self.path)
+        except Exception as e:
+            logger.error(f"Error saving transfer journal: {e}")
+
+    def get(self, key):
+        with self._lock:
+            state = self._transfers.get(key)
+            return dict(state) if state else None
+
+    def save(self, state):
+        """Store (or update) a transfer state; state['key'] identifies it"""
+        with self._lock:
+            state = dict(state)
+            state['updated'] = time.time()
+            self._transfers[state['key']] = state
+            self._write()
+
+    def remove(self, key):
+        with self._lock:
+            if self._transfers.pop(key, None) is not None:
+                self._write()
+
+    def pending(self):
+        """All unfinished transfers, oldest first"""
+        with self._lock:
+            return sorted((dict(s) for s in self._transfers.values()),
+                          key=lambda s: s.get('updated', 0))
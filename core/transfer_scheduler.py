@@ -0,0 +1,56 @@
+"""
+Per-Printer Transfer Queues
+
+Uploads used to share one global lock, so a second upload was refused even
+when it went to a different printer. TransferScheduler keeps one FIFO queue
+per destination instead: transfers to different printers run side by side,
+transfers to the same printer (or to the shared USB gadget) wait their turn.
+The overall bandwidth cap is applied separately in printer_http.
+"""
+
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from loguru import logger
+
+
+# Queue for everything that touches the Pi's USB gadget (one shared device)
+USB_GADGET_QUEUE = 'usb_gadget'
+
+# Queue for requests that do not say where they are going
+DEFAULT_QUEUE = 'default'
+
+
+class TransferScheduler:
+    """FIFO transfer slots, one queue per printer"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queues = {}  # queue key -> deque of waiting/active tickets
+
+    @contextmanager
+    def slot(self, key):
+        """Wait for our turn in the queue of key, then hold it for the block"""
+        key = key or DEFAULT_QUEUE
+        ticket = object()
+        with self._cond:
+            queue = self._queues.setdefault(key, deque())
+            queue.append(ticket)
+            if len(queue) > 1:
+                logger.info(f"Transfer queued for '{key}' behind {len(queue) - 1} other transfer(s)")
+            while queue[0] is not ticket:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                queue.popleft()
+                if not queue:
+                    del self._queues[key]
+                self._cond.notify_all()
+
+    def status(self):
+        """Number of active plus waiting transfers per queue"""
+        with self._cond:
+            return {key: len(queue) for key, queue in self._queues.items()}
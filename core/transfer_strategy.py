@@ -0,0 +1,98 @@
+"""
+Learned Transfer Strategy per Printer Model and Firmware
+
+Printers differ in which USB upload variant their firmware accepts, which
+part size gives the best throughput and how long a request may take. Each
+successful upload teaches ChitUI something about that: TransferStrategyCache
+keeps it per model and firmware version in the ChitUI settings so the next
+upload starts with the USB method that worked (instead of resending the
+whole file through methods that fail), the best part size and timeouts
+derived from the measured speed.
+"""
+
+import threading
+import time
+
+from loguru import logger
+
+from .chunk_tuning import PART_SIZE, clamp_part_size
+from .printer_upload import PART_TIMEOUT
+
+
+# Seconds for a complete USB-destination upload until a printer has been measured
+USB_TIMEOUT = 120
+
+# Learned timeouts: expected time times the margin plus a fixed allowance
+TIMEOUT_MARGIN = 3.0
+TIMEOUT_BASE = 10.0
+USB_TIMEOUT_RANGE = (30.0, 3600.0)
+PART_TIMEOUT_RANGE = (10.0, 60.0)
+
+
+def strategy_key(model, firmware):
+    """Settings key of a printer model and firmware version"""
+    return f"{model or 'Unknown'} / {firmware or 'Unknown'}"
+
+
+def _clamp(value, bounds):
+    return max(bounds[0], min(bounds[1], value))
+
+
+class TransferStrategyCache:
+    """What worked for each printer model and firmware, kept in the ChitUI settings"""
+
+    SETTINGS_KEY = 'transfer_strategies'
+    LEGACY_PART_SIZES_KEY = 'upload_part_sizes'  # Part sizes per model only
+
+    def __init__(self, load_settings, save_settings):
+        self._load_settings = load_settings
+        self._save_settings = save_settings
+        self._lock = threading.Lock()
+        settings = load_settings()
+        self._strategies = {key: dict(value) for key, value in settings.get(self.SETTINGS_KEY, {}).items()}
+        self._legacy_part_sizes = dict(settings.get(self.LEGACY_PART_SIZES_KEY, {}))
+
+    def get(self, model, firmware):
+        """Everything learned for model/firmware (empty dict if nothing yet)"""
+        with self._lock:
+            return dict(self._strategies.get(strategy_key(model, firmware), {}))
+
+    def part_size(self, model, firmware, default=PART_SIZE):
+        """Part size to start a chunked upload with"""
+        size = self.get(model, firmware).get('part_size')
+        if size is None:
+            size = self._legacy_part_sizes.get(model or 'Unknown', default)
+        return clamp_part_size(size)
+
+    def part_timeout(self, model, firmware):
+        """Request timeout for one part, from the slowest part seen so far"""
+        slowest = self.get(model, firmware).get('slowest_part')
+        if not slowest:
+            return PART_TIMEOUT
+        return _clamp(slowest * TIMEOUT_MARGIN + TIMEOUT_BASE, PART_TIMEOUT_RANGE)
+
+    def usb_timeout(self, model, firmware, size):
+        """Request timeout for a complete USB-destination upload of size bytes"""
+        throughput = self.get(model, firmware).get('usb_throughput')
+        if not throughput:
+            return USB_TIMEOUT
+        return _clamp(size / throughput * TIMEOUT_MARGIN + TIMEOUT_BASE, USB_TIMEOUT_RANGE)
+
+    def order_methods(self, model, firmware, methods):
+        """Put the USB upload method that worked last time first"""
+        preferred = self.get(model, firmware).get('usb_method')
+        return sorted(methods, key=lambda method: method['name'] != preferred)
+
+    def remember(self, model, firmware, **values):
+        """Store values learned from a successful upload"""
+        key = strategy_key(model, firmware)
+        with self._lock:
+            strategy = self._strategies.setdefault(key, {})
+            changed = {name: value for name, value in values.items() if strategy.get(name) != value}
+            if not changed:
+                return
+            strategy.update(changed, updated=time.time())
+            settings = self._load_settings()
+            settings.setdefault(self.SETTINGS_KEY, {})[key] = dict(strategy)
+            self._save_settings(settings)
+        logger.info(f"Transfer strategy for '{key}': {changed}")
@@ -0,0 +1,161 @@
+"""
+Single-pass Upload Ingest for ChitUI
+
+By default werkzeug spools every uploaded file to a temporary file, the
+upload route then copies it into the upload folder and the printer upload
+reads it a third time to compute the MD5. IngestFile replaces the spool
+file: multipart data is written straight into the destination folder while
+the MD5 is computed and the print file header is captured, so the upload
+is only touched once on disk.
+"""
+
+import hashlib
+import os
+import shutil
+import uuid
+
+from flask import Request
+from loguru import logger
+from werkzeug.utils import secure_filename
+
+from .file_header import HEADER_CAPTURE_SIZE, parse_print_file_header
+
+
+class IngestFile:
+    """Writable upload stream that lands in the destination folder.
+
+    The data is written to a hidden ``.part`` file next to its final
+    location. commit() renames it into place; if the request ends without
+    a commit (validation error, client abort) the part file is removed.
+    """
+
+    def __init__(self, folder, filename):
+        self.folder = folder
+        self.filename = filename
+        self.temp_path = os.path.join(
+            folder, f".{secure_filename(filename) or 'upload'}.{uuid.uuid4().hex[:8]}.part")
+        self.size = 0
+        self.committed = False
+        self._md5 = hashlib.md5()
+        self._header = bytearray()
+        self._file = open(self.temp_path, 'w+b')
+
+    # ===== File protocol used by werkzeug's multipart parser / FileStorage =====
+
+    def write(self, data):
+        if len(self._header) < HEADER_CAPTURE_SIZE:
+            self._header += data[:HEADER_CAPTURE_SIZE - len(self._header)]
+        self._md5.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        """Close the stream, discarding the data unless it was committed"""
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed and os.path.exists(self.temp_path):
+            try:
+                os.remove(self.temp_path)
+                logger.debug(f"Discarded uncommitted upload {self.temp_path}")
+            except OSError as e:
+                logger.warning(f"Could not remove partial upload {self.temp_path}: {e}")
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    # ===== Ingest results =====
+
+    @property
+    def md5(self):
+        """Hex MD5 of everything written so far"""
+        return self._md5.hexdigest()
+
+    @property
+    def header(self):
+        """Leading bytes of the file (up to HEADER_CAPTURE_SIZE)"""
+        return bytes(self._header)
+
+    def metadata(self):
+        """Parsed .goo/.ctb header of the upload, or None"""
+        return parse_print_file_header(self._header, self.filename)
+
+    def commit(self, filepath):
+        """Move the upload to its final path.
+
+        A rename when the destination is in the ingest folder's filesystem,
+        a copy otherwise (e.g. the form picked a different destination than
+        the one announced in the query string).
+        """
+        self._file.flush()
+        self._file.close()
+        if os.path.dirname(os.path.abspath(filepath)) == os.path.abspath(self.folder):
+            os.replace(self.temp_path, filepath)
+        else:
+            logger.info(f"Upload destination changed, moving to {filepath}")
+            shutil.move(self.temp_path, filepath)
+        self.committed = True
+        logger.debug(f"Committed upload {filepath} ({self.size} bytes, md5 {self.md5})")
+        return filepath
+
+
+def save_upload(file, filepath, expect=None):
+    """Store an uploaded FileStorage at filepath.
+
+    Args:
+        expect: Optional callback(filepath, md5, size) run right before an
+            ingested file appears at filepath (e.g. FileCatalog.expect)
+
+    Returns:
+        (md5, header_bytes) when the upload was ingested in a single pass,
+        (None, None) if it was spooled by werkzeug and had to be copied
+    """
+    if isinstance(file.stream, IngestFile):
+        if expect:
+            expect(filepath, file.stream.md5, file.stream.size)
+        file.stream.commit(filepath)
+        return file.stream.md5, file.stream.header
+
+    file.save(filepath)
+    return None, None
+
+
+def make_ingest_request_class(resolve_folder):
+    """Build a Flask Request class that streams print file uploads to disk.
+
+    Args:
+        resolve_folder: Callable (request, filename) -> folder or None.
+            Returning None keeps werkzeug's default spooling for that file.
+    """
+
+    class IngestRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type,
+                             filename=None, content_length=None):
+            folder = resolve_folder(self, filename) if filename else None
+            if folder:
+                try:
+                    return IngestFile(folder, filename)
+                except OSError as e:
+                    logger.warning(f"Cannot ingest upload into {folder}, spooling instead: {e}")
+            return super()._get_file_stream(total_content_length, content_type,
+                                            filename, content_length)
+
+    return IngestRequest
@@ -0,0 +1,131 @@
+"""
+Background Upload Jobs
+
+/upload used to hold the HTTP request open for the whole printer transfer
+or USB gadget reload. Now the request only ingests the file; the rest runs
+as a job on a background thread. Jobs move through queued -> running ->
+succeeded / failed, every change is pushed to a callback (socket.io in
+ChitUI) and the jobs are kept in a small JSON journal so finished results
+survive a restart.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+
+from loguru import logger
+
+
+FINISHED_STATES = ('succeeded', 'failed', 'interrupted')
+
+# Finished jobs kept in the journal
+JOB_HISTORY = 50
+
+
+class UploadJobs:
+    """Runs upload jobs in the background and journals their state"""
+
+    def __init__(self, path, on_change=None, history=JOB_HISTORY):
+        self.path = path
+        self.on_change = on_change
+        self.history = history
+        self._lock = threading.Lock()
+        self._jobs = self._load()
+
+    def _load(self):
+        jobs = OrderedDict()
+        if not os.path.exists(self.path):
+            return jobs
+        try:
+            with open(self.path, 'r') as f:
+                for job in json.load(f):
+                    if job.get('state') not in FINISHED_STATES:
+                        # The process stopped while this job was queued or running
+                        job['state'] = 'interrupted'
+                        job['finished'] = job.get('finished') or time.time()
+                    jobs[job['id']] = job
+        except Exception as e:
+            logger.error(f"Error loading upload job journal {self.path}: {e}")
+        return jobs
+
+    def _write(self):
+        """Persist the journal (caller holds the lock)"""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_file = self.path + '.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(list(self._jobs.values()), f, indent=2)
+            os.replace(temp_file, self.path)
+        except Exception as e:
+            logger.error(f"Error saving upload job journal: {e}")
+
+    def _prune(self):
+        """Drop the oldest finished jobs beyond the history size (caller holds the lock)"""
+        finished = [job_id for job_id, job in self._jobs.items() if job['state'] in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def _update(self, job_id, **changes):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(changes)
+            self._prune()
+            self._write()
+            snapshot = dict(job)
+        if self.on_change:
+            try:
+                self.on_change(snapshot)
+            except Exception as e:
+                logger.error(f"Upload job notification failed: {e}")
+        return snapshot
+
+    def submit(self, job_id, work, queue=None, **info):
+        """Start a job.
+
+        Args:
+            job_id: Job identifier (ChitUI uses the upload ID)
+            work: Callable returning (success, result dict)
+            queue: Optional context manager the job waits in before running
+                (e.g. TransferScheduler.slot for its printer)
+            **info: Descriptive fields stored with the job
+
+        Returns:
+            dict: The job as submitted
+        """
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._jobs[job_id] = {
+                'id': job_id,
+                'state': 'queued',
+                'created': time.time(),
+                'started': None,
+                'finished': None,
+                'result': None,
+                **info,
+            }
+        job = self._update(job_id)
+        threading.Thread(target=self._run, args=(job_id, work, queue), daemon=True).start()
+        return job
+
+    def _run(self, job_id, work, queue):
+        try:
+            with queue or nullcontext():
+                self._update(job_id, state='running', started=time.time())
+                success, result = work()
+        except Exception as e:
+            logger.error(f"Upload job {job_id} failed: {e}")
+            success, result = False, {"upload": "error", "msg": f"Upload failed: {e}", "upload_id": job_id}
+        self._update(job_id, state='succeeded' if success else 'failed', finished=time.time(), result=result)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        """All known jobs, newest first"""
+        with self._lock:
+            return [dict(job) for job in reversed(self._jobs.values())]
@@ -0,0 +1,141 @@
+"""
+Upload Staging for the USB Gadget
+
+Writing an upload straight into the loop-mounted FAT image on the SD card
+is the slowest part of a virtual USB upload, and the request used to hold
+the USB gadget queue for all of it. With staging, the upload lands on fast
+storage first - tmpfs when it fits in the RAM budget, otherwise a folder
+on the local disk - the client is answered, and the upload job moves the
+file into the gadget folder in the background with a single fsync.
+
+Files whose size is unknown or that fit in no tier are written into the
+gadget directly, as before.
+"""
+
+import os
+import shutil
+
+from loguru import logger
+
+
+RESERVE = 64 * 1048576     # Bytes left free on a tier's file system (and in RAM)
+COPY_BLOCK = 1048576
+
+
+def available_memory():
+    """MemAvailable from /proc/meminfo in bytes (None if unknown)"""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class UploadStaging:
+    """Picks a staging folder by upload size and moves staged files into place"""
+
+    def __init__(self, tiers, reserve=RESERVE):
+        """
+        Args:
+            tiers: List of (folder, limit in bytes or None, in_ram), fastest first
+            reserve: Bytes that must stay free on a tier (and in RAM for tmpfs tiers)
+        """
+        self.tiers = [(os.path.abspath(folder), limit, in_ram) for folder, limit, in_ram in tiers]
+        self.reserve = reserve
+
+    def _staged_bytes(self, folder):
+        total = 0
+        try:
+            for entry in os.scandir(folder):
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            pass
+        return total
+
+    def folder_for(self, size, ram=True):
+        """Staging folder for an upload of size bytes
+
+        Args:
+            size: Upload size (e.g. the request's Content-Length), None if unknown
+            ram: Whether tmpfs tiers may be used (no point for data already on disk)
+
+        Returns:
+            str: Folder, or None to write into the gadget directly
+        """
+        if not size:
+            return None
+        for folder, limit, in_ram in self.tiers:
+            if in_ram and not ram:
+                continue
+            try:
+                os.makedirs(folder, exist_ok=True)
+                free = shutil.disk_usage(folder).free
+            except OSError as e:
+                logger.warning(f"Upload staging folder {folder} unavailable: {e}")
+                continue
+            if in_ram:
+                memory = available_memory()
+                if memory is not None:
+                    free = min(free, memory)
+            if size > free - self.reserve:
+                continue
+            if limit is not None and self._staged_bytes(folder) + size > limit:
+                continue
+            return folder
+        return None
+
+    def is_staged(self, path):
+        return os.path.dirname(os.path.abspath(path)) in [folder for folder, _limit, _in_ram in self.tiers]
+
+    def move(self, path, folder):
+        """Move a staged file into folder (e.g. the USB gadget), flushed with one fsync
+
+        The copy is written under a hidden name and renamed once it is on
+        disk, so the printer never sees a partial file. The staged file is
+        removed only once the copy is in place; if the copy fails it stays in
+        staging (for leftovers() or a retry) and the error is raised.
+
+        Returns:
+            str: The file's new path
+        """
+        target = os.path.join(folder, os.path.basename(path))
+        temp_path = os.path.join(folder, f".{os.path.basename(path)}.staging")
+        try:
+            with open(path, 'rb') as source, open(temp_path, 'wb') as destination:
+                shutil.copyfileobj(source, destination, COPY_BLOCK)
+                destination.flush()
+                os.fsync(destination.fileno())
+            os.replace(temp_path, target)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        os.remove(path)
+        logger.debug(f"Moved staged upload {path} to {target}")
+        return target
+
+    def leftovers(self):
+        """Staged files that were never moved (the process stopped before their job ran)
+
+        Call at startup only: partial uploads in the staging folders are removed.
+        """
+        paths = []
+        for folder, _limit, _in_ram in self.tiers:
+            if not os.path.isdir(folder):
+                continue
+            for name in sorted(os.listdir(folder)):
+                path = os.path.join(folder, name)
+                if not os.path.isfile(path):
+                    continue
+                if name.startswith('.'):
+                    # Partial ingest from an interrupted request
+                    os.remove(path)
+                else:
+                    paths.append(path)
+        return paths
@@ -25,6 +25,11 @@ Configuration:
 - USB_GADGET_PATH: Path to USB gadget mount point (default: /mnt/usb_share)
 - ENABLE_USB_GADGET: Enable/disable USB gadget mode (default: true)
 - USB_AUTO_REFRESH: Auto-refresh USB after upload (default: false)
+- USB_GADGET_DIRECT: Write files straight into /piusb.bin instead of mounting it (default: false)
+- USB_GADGET_SPARE_IMAGE: Second image for double buffering in direct mode (default: none)
+- UPLOAD_STAGING: Receive USB gadget uploads on fast storage first (default: true)
+- UPLOAD_STAGING_RAM: tmpfs budget for staged uploads in MB, 0 = local disk only (default: 128)
+- USB_GADGET_EVICTION: Remove least recently used files when an upload does not fit the USB gadget (default: false)
 - DEBUG: Enable debug logging (default: false)
 
 Author: ChitUI Developer
@@ -37,6 +42,7 @@ from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_socketio import SocketIO
 from functools import wraps
+from contextlib import nullcontext
 
 # ===== System and Utility Imports =====
 from threading import Thread
@@ -52,10 +58,36 @@ import hashlib
 import uuid
 import threading
 import subprocess
+import shutil
 
 # ===== Plugin System Imports =====
 from plugins import PluginManager
 
+# ===== Core Service Imports =====
+from core import (make_ingest_request_class, save_upload, parse_print_file_header, read_print_file_header,
+                  HEADER_CAPTURE_SIZE)
+from core.printer_upload import upload_file_chunked, upload_file_to_many, relay_upload, MD5_PATTERN
+from core.transfer_journal import TransferJournal
+from core.chunk_tuning import AdaptiveChunkSizer
+from core.transfer_strategy import TransferStrategyCache
+from core.printer_http import timed_post, close_printer_session, set_bandwidth_limit
+from core.multipart_stream import MultipartFileStream
+from core.transfer_scheduler import TransferScheduler, USB_GADGET_QUEUE
+from core.upload_jobs import UploadJobs
+from core.file_index import FileIndex, printer_path
+from core.progress_bus import ProgressBus
+from core.print_compat import check_print_file, check_machine_name, IncompatiblePrintFile
+from core.gadget_reload import ReloadScheduler
+from core.gadget_controller import GadgetController
+from core.mount_state import MountState
+from core.storage_usage import StorageUsage, gadget_storage_usage
+from core.file_catalog import FileCatalog
+from core.upload_staging import UploadStaging
+from core.gadget_sync import GadgetWrites
+from core.gadget_eviction import GadgetEviction
+from core.resumable_upload import (ResumableUploads, UploadBusy, UploadOffsetMismatch, TUS_VERSION,
+                                   parse_upload_metadata, tus_response)
+
 # ===== Optional Camera Support =====
 # Camera support is optional - requires opencv-python-headless package
 # Used by the IP camera plugin for viewing network cameras
@@ -147,6 +179,33 @@ ENABLE_USB_GADGET = os.environ.get('ENABLE_USB_GADGET', 'true').lower() not in [
 # Set USB_AUTO_REFRESH='false' to disable and refresh manually
 USB_AUTO_REFRESH = os.environ.get('USB_AUTO_REFRESH', 'false').lower() not in ['0', 'false', 'no', 'off']
 
+# Direct USB Gadget Image Writes
+# When enabled, the Pi does not mount /piusb.bin: USB_GADGET_PATH is a plain folder
+# and each gadget reload writes its changes straight into the image's FAT32 file system
+# while the printer's drive is ejected (no mount/umount, shorter reconnect)
+USB_GADGET_DIRECT = os.environ.get('USB_GADGET_DIRECT', 'false').lower() not in ['0', 'false', 'no', 'off']
+# Optional second image (e.g. /piusb.spare.bin) for direct mode: changes are written into the
+# image the printer does not see, which is then swapped in with one media change
+USB_GADGET_SPARE_IMAGE = os.environ.get('USB_GADGET_SPARE_IMAGE') or None
+
+# Upload Staging
+# Uploads for the USB gadget are received on tmpfs (up to UPLOAD_STAGING_RAM MB) or the local
+# disk and moved into the gadget by the upload job, instead of being written into the FAT
+# image while the request (and the gadget queue) is held
+UPLOAD_STAGING = os.environ.get('UPLOAD_STAGING', 'true').lower() not in ['0', 'false', 'no', 'off']
+UPLOAD_STAGING_RAM = float(os.environ.get('UPLOAD_STAGING_RAM', '128') or 0)
+
+# USB Gadget Eviction
+# When an upload does not fit on the USB gadget, remove the print files that were
+# printed or uploaded least recently (never pinned ones or files being printed).
+# Disabled, such an upload is refused before it is received.
+USB_GADGET_EVICTION = os.environ.get('USB_GADGET_EVICTION', 'false').lower() not in ['0', 'false', 'no', 'off']
+
+# Upload Bandwidth Cap
+# Combined rate of all uploads to printers in MB/s (0 = unlimited)
+# Uploads to different printers run in parallel; cap them on slow networks
+UPLOAD_BANDWIDTH_LIMIT = float(os.environ.get('UPLOAD_BANDWIDTH_LIMIT', '0') or 0)
+
 # Runtime USB Gadget Status
 # These variables track whether USB gadget is actually available and working
 USE_USB_GADGET = False      # Will be set to True if USB gadget is available and writable
@@ -193,6 +252,12 @@ if not USE_USB_GADGET:
 
 ALLOWED_EXTENSIONS = {'ctb', 'goo', 'prz'}
 SETTINGS_FILE = os.path.join(DATA_FOLDER, 'chitui_settings.json')
+TRANSFERS_FILE = os.path.join(DATA_FOLDER, 'upload_transfers.json')
+UPLOAD_JOBS_FILE = os.path.join(DATA_FOLDER, 'upload_jobs.json')
+FILE_INDEX_FILE = os.path.join(DATA_FOLDER, 'file_index.json')
+FILE_CATALOG_FILE = os.path.join(DATA_FOLDER, 'file_catalog.db')
+STAGING_FOLDER = os.path.join(DATA_FOLDER, 'staging')
+RAM_STAGING_FOLDER = '/dev/shm/chitui-staging'
 
 # Create directories if they don't exist
 os.makedirs(DATA_FOLDER, exist_ok=True)
@@ -205,6 +270,53 @@ logger.info(f"Running as user: {os.getenv('USER', 'unknown')} (UID: {os.getuid()
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# ===== Single-pass Upload Ingest =====
+# Print file uploads are streamed straight into their destination folder while
+# being hashed (see core/upload_ingest.py), instead of being spooled to a temp
+# file, copied, and re-read for the MD5. The client announces printer and
+# destination in the query string so the folder is known before the file arrives.
+INGEST_ROUTES = ('/upload', '/plugin/file_manager/upload')
+
+
+def resolve_ingest_folder(req, filename):
+    """Pick the folder an incoming print file upload is streamed into"""
+    if req.path not in INGEST_ROUTES or not allowed_file(filename):
+        return None
+
+    printer = printers.get(req.args.get('printer', ''), {})
+    destination = req.args.get('destination', 'usb' if USE_USB_GADGET else 'local')
+    if upload_queue_key(req.args.get('printer'), destination) == USB_GADGET_QUEUE and staging_folder_for(req):
+        return staging_folder_for(req)
+    if destination == 'usb' and printer.get('usb_device_type') == 'virtual' \
+            and os.access(USB_GADGET_FOLDER, os.W_OK):
+        return USB_GADGET_FOLDER
+    return app.config['UPLOAD_FOLDER']
+
+
+app.request_class = make_ingest_request_class(resolve_ingest_folder)
+
+
+def staging_folder_for(req):
+    """Staging folder for a USB gadget upload in this request (None: write into the gadget)
+
+    Chosen once per request from its Content-Length, so the ingest and the
+    upload route agree on it.
+    """
+    if 'chitui.staging' not in req.environ:
+        req.environ['chitui.staging'] = upload_staging.folder_for(req.content_length)
+    return req.environ['chitui.staging']
+
+
+def upload_queue_key(printer_id, destination=None):
+    """Transfer queue an upload waits in: its printer, or the shared USB gadget"""
+    printer = printers.get(printer_id or '')
+    if printer is None:
+        return None
+    destination = destination or ('usb' if USE_USB_GADGET else 'local')
+    if destination == 'usb' and (USE_USB_GADGET or printer.get('usb_device_type') == 'virtual'):
+        return USB_GADGET_QUEUE
+    return printer['ip']
+
 
 # ========================================================================
 # USB GADGET HELPER FUNCTIONS
@@ -221,7 +333,7 @@ def trigger_usb_gadget_refresh():
     Trigger USB gadget to refresh/reconnect so printer detects new/changed files.
 
     This function attempts multiple methods to force a USB re-enumeration:
-    1. Filesystem sync to ensure all data is written
+    1. Flush the files ChitUI wrote into the gadget and its FAT volume
     2. ConfigFS UDC disconnect/reconnect (preferred method)
     3. Fallback to /sys/class/udc interface
     4. Module reload as last resort
@@ -241,9 +353,9 @@ def trigger_usb_gadget_refresh():
         return False
 
     try:
-        # Method 1: Ensure all data is written to disk
-        os.sync()
-        logger.debug("Synced filesystem")
+        # Method 1: Ensure the gadget's data is written to the image (not every file system on the Pi)
+        flushed = gadget_writes.flush(volume=not USB_GADGET_DIRECT)
+        logger.debug(f"Flushed USB gadget in {flushed['seconds'] * 1000:.1f} ms")
 
         # Method 2: Try to find and use configfs UDC paths
         configfs_gadget_dirs = []
@@ -1094,13 +1206,29 @@ def get_plugins():
     return jsonify(plugin_manager.get_plugin_info())
 
 
+def plugin_services():
+    """What plugins get at startup: the printers and the services they share with ChitUI
+
+    Plugins that handle uploads (file_manager) use these instead of their own
+    instances, so queues, jobs, progress and the USB gadget state stay in one place.
+    """
+    return dict(printers=printers, send_printer_cmd=send_printer_cmd, login_required=login_required,
+                transfer_journal=transfer_journal, transfer_strategies=transfer_strategies,
+                transfer_scheduler=transfer_scheduler, upload_jobs=upload_jobs, file_index=file_index,
+                progress_bus=progress_bus, resumable_uploads=resumable_uploads,
+                printer_attributes=printer_attributes, gadget_reloads=gadget_reloads,
+                gadget_controller=gadget_controller, mount_state=mount_state, storage_usage=storage_usage,
+                file_catalog=file_catalog, upload_staging=upload_staging, gadget_writes=gadget_writes,
+                gadget_eviction=gadget_eviction)
+
+
 @app.route('/plugins/<plugin_id>/enable', methods=['POST'])
 def enable_plugin(plugin_id):
     """Enable a plugin"""
     try:
         # Load the plugin if not already loaded
         if plugin_id not in plugin_manager.get_all_plugins():
-            plugin_manager.load_plugin(plugin_id, app, socketio, printers=printers, send_printer_cmd=send_printer_cmd)
+            plugin_manager.load_plugin(plugin_id, app, socketio, **plugin_services())
         # Enable it (sets the flag and saves settings)
         plugin_manager.enable_plugin(plugin_id)
         return jsonify({"success": True, "message": f"Plugin {plugin_id} enabled"})
@@ -1470,6 +1598,7 @@ def remove_printer(printer_id):
             del websockets[printer_id]
 
         if printer_id in printers:
+            close_printer_session(printers[printer_id]['ip'])
             del printers[printer_id]
 
         settings = load_settings()
@@ -1512,35 +1641,25 @@ def set_default_printer():
 # ============ FILE UPLOAD ROUTES ============
 
 @app.route('/progress')
+@login_required
 def progress():
-    """Server-sent events for upload progress"""
+    """Server-sent events for upload progress
+
+    Each event is the JSON progress of the upload (percentage, bytes,
+    bytes/second, ETA - see core/progress_bus), sent only when it changes.
+    The stream is a subscriber of the same progress bus that publishes the
+    socket.io 'upload_progress' events; it ends at 100%, after a minute
+    without changes and at the latest after progress_bus.STREAM_LIFETIME.
+    """
     upload_id = request.args.get('upload_id', 'default')
 
     def publish_progress():
-        max_iterations = 200  # Prevent infinite loop (100 seconds max)
-        iterations = 0
-
-        while iterations < max_iterations:
-            with uploadProgressLock:
-                current_progress = uploadProgress.get(upload_id, 0)
-
-            yield f"data:{current_progress}\n\n"
-
-            if current_progress >= 100:
-                # Clean up this upload's progress after sending 100%
-                time.sleep(1)
-                with uploadProgressLock:
-                    if upload_id in uploadProgress:
-                        del uploadProgress[upload_id]
-                break
-
-            time.sleep(0.5)
-            iterations += 1
-
-        # Final cleanup in case loop exited due to timeout
-        with uploadProgressLock:
-            if upload_id in uploadProgress:
-                del uploadProgress[upload_id]
+        for event in progress_bus.subscribe(upload_id):
+            if event is None:
+                # Comment line: keeps proxies from closing the idle stream
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data:{json.dumps(event)}\n\n"
 
     response = Response(stream_with_context(publish_progress()), mimetype="text/event-stream")
     response.headers['Cache-Control'] = 'no-cache, no-transform'
@@ -1552,14 +1671,22 @@ def progress():
 
 
 @app.route('/upload', methods=['GET', 'POST'])
+@login_required
 def upload_file():
     if request.method == 'POST':
-        # Check if another upload is in progress
-        if not uploadLock.acquire(blocking=False):
-            logger.warning("Upload already in progress")
-            return Response('{"upload": "error", "msg": "Another upload is already in progress. Please wait."}', status=429, mimetype="application/json")
-
-        try:
+        # Files written into the USB gadget must not race a gadget reload (staged files are moved by the job)
+        queue_key = upload_queue_key(request.args.get('printer'), request.args.get('destination'))
+        # Refuse an upload that cannot fit the USB gadget before the body is received
+        if queue_key == USB_GADGET_QUEUE and request.content_length:
+            plan = check_gadget_space(request.content_length)
+            if not plan['fits']:
+                return no_space_response(plan)
+            # Files are only removed by the job, once the upload is received and validated
+            if plan['evict'] and not staging_folder_for(request):
+                return no_space_response(plan, "Not enough space on the USB gadget, and no staging space to "
+                                               "receive the upload before old files are removed.")
+        writes_gadget = queue_key == USB_GADGET_QUEUE and not staging_folder_for(request)
+        with transfer_scheduler.slot(queue_key) if writes_gadget else nullcontext():
             if 'file' not in request.files:
                 logger.error("No 'file' parameter in request.")
                 return Response('{"upload": "error", "msg": "Malformed request - no file."}', status=400, mimetype="application/json")
@@ -1571,7 +1698,6 @@ def upload_file():
             if 'printer' not in form_data or form_data['printer'] == "":
                 logger.error("No 'printer' parameter in request.")
                 return Response('{"upload": "error", "msg": "Malformed request - no printer."}', status=400, mimetype="application/json")
-            printer = printers[form_data['printer']]
             if file and not allowed_file(file.filename):
                 logger.error("Invalid filetype.")
                 return Response('{"upload": "error", "msg": "Invalid filetype."}', status=400, mimetype="application/json")
@@ -1582,6 +1708,15 @@ def upload_file():
             logger.info(f"Upload destination: {destination}")
             logger.info(f"USB gadget mode: {'enabled' if USE_USB_GADGET else 'disabled'}")
 
+            # Optional list of printers that all get the same file
+            printer_ids = [pid for pid in form_data.get('printers', '').split(',') if pid]
+            if any(pid not in printers for pid in printer_ids):
+                logger.error(f"Unknown printer in upload targets: {printer_ids}")
+                return Response('{"upload": "error", "msg": "Malformed request - unknown printer."}', status=400, mimetype="application/json")
+            if len(printer_ids) > 1 and destination != 'local':
+                logger.error("Multi-printer upload to a destination other than local storage")
+                return Response('{"upload": "error", "msg": "Sending to several printers is only supported for local storage."}', status=400, mimetype="application/json")
+
             # Generate unique upload ID for progress tracking
             upload_id = form_data.get('upload_id', str(uuid.uuid4()))
 
@@ -1591,184 +1726,710 @@ def upload_file():
             printer_id = form_data['printer']
             usb_device_type = printers[printer_id].get('usb_device_type', 'physical')
 
-            # For virtual USB gadget, always use /mnt/usb_share
-            if destination == 'usb' and usb_device_type == 'virtual':
-                upload_folder = USB_GADGET_FOLDER
-                # Verify mount point is available and writable
-                if not os.path.exists(upload_folder):
-                    logger.error(f"USB gadget folder not found: {upload_folder}")
-                    return Response('{"upload": "error", "msg": "USB mount point not found. Please mount USB gadget first."}', status=500, mimetype="application/json")
-                if not os.access(upload_folder, os.W_OK):
-                    logger.error(f"USB gadget folder not writable: {upload_folder}")
-                    return Response('{"upload": "error", "msg": "USB mount point not writable. Check permissions."}', status=500, mimetype="application/json")
-            else:
-                upload_folder = app.config['UPLOAD_FOLDER']
+            upload_folder, folder_error = upload_destination_folder(printer_id, destination)
+            if folder_error:
+                return Response(json.dumps({"upload": "error", "msg": folder_error}), status=500, mimetype="application/json")
+            if upload_queue_key(printer_id, destination) == USB_GADGET_QUEUE and staging_folder_for(request):
+                upload_folder = staging_folder_for(request)
 
             filepath = os.path.join(upload_folder, filename)
             logger.info(f"Saving '{filename}' to {filepath} (upload_id: {upload_id})")
             logger.info(f"USB device type: {usb_device_type}, Upload folder: {upload_folder}")
             try:
                 # Initialize progress
-                with uploadProgressLock:
-                    uploadProgress[upload_id] = 0
-
-                # Save file with progress tracking
-                file.save(filepath)
-                logger.info(f"✓ File '{filename}' saved successfully!")
+                progress_bus.update(upload_id, 0)
 
-                # Check destination: if user selected USB and printer is configured for USB, process accordingly
-                # For virtual USB: file is already saved to /mnt/usb_share, just need to reload
-                # For physical USB or network upload: upload to printer via network
-                if destination == 'usb' and (USE_USB_GADGET or usb_device_type == 'virtual'):
-                    # File saved to USB gadget - update progress
-                    with uploadProgressLock:
-                        uploadProgress[upload_id] = 50
-                    socketio.emit('upload_progress', {'upload_id': upload_id, 'progress': 50}, namespace='/')
-
-                    logger.info("Destination: USB Gadget (Pi's virtual USB)")
-
-                    # For virtual USB gadget, unmount/mount/reload
-                    if usb_device_type == 'virtual':
-                        logger.info("Virtual USB gadget detected - performing unmount/mount/reload")
-                        with uploadProgressLock:
-                            uploadProgress[upload_id] = 75
-                        socketio.emit('upload_progress', {'upload_id': upload_id, 'progress': 75}, namespace='/')
-
-                        reload_usb_gadget()
-                        # Script handles all delays - no extra sleep needed
-                        refresh_success = True
-                    else:
-                        # Physical USB or auto-refresh disabled
-                        refresh_success = False
-                        if USB_AUTO_REFRESH:
-                            logger.info("Triggering USB gadget refresh to notify printer...")
-                            with uploadProgressLock:
-                                uploadProgress[upload_id] = 75
-                            socketio.emit('upload_progress', {'upload_id': upload_id, 'progress': 75}, namespace='/')
-                            refresh_success = trigger_usb_gadget_refresh()
-
-                            if refresh_success:
-                                logger.info("Waiting for printer to detect new file...")
-                                time.sleep(2)
-                        else:
-                            logger.info("USB auto-refresh disabled (USB_AUTO_REFRESH=false)")
-                            logger.info("💡 Manually refresh on printer or set USB_AUTO_REFRESH=true")
-
-                    # Set progress to 100%
-                    with uploadProgressLock:
-                        uploadProgress[upload_id] = 100
-                    socketio.emit('upload_progress', {'upload_id': upload_id, 'progress': 100}, namespace='/')
-
-                    logger.info("✓ Upload to USB gadget complete!")
-
-                    # Emit page refresh for virtual USB gadget
-                    if usb_device_type == 'virtual':
-                        socketio.emit('refresh_page', {'reason': 'virtual_usb_upload'})
-                        msg = "File saved to USB gadget. Page will refresh to show updated file list."
-                    elif USB_AUTO_REFRESH and refresh_success:
-                        msg = "File saved to USB gadget. Printer should detect it automatically."
-                    elif USB_AUTO_REFRESH and not refresh_success:
-                        msg = "File saved to USB gadget. Auto-refresh failed - manually refresh on printer."
-                        logger.warning("USB gadget refresh failed - manual intervention may be needed")
-                        logger.info("💡 To enable automatic refresh, run: sudo python3 main.py")
-                    else:
-                        msg = "File saved to USB gadget. Manually refresh on printer or reconnect USB to detect it."
-
-                    return Response(
-                        json.dumps({
-                            "upload": "success",
-                            "msg": msg,
-                            "upload_id": upload_id,
-                            "usb_gadget": True,
-                            "filename": filename,
-                            "refresh_triggered": refresh_success
-                        }),
-                        status=200,
-                        mimetype="application/json"
-                    )
+                # Commit the streamed upload (hashed and header-captured on the way in)
+                file_md5, header_bytes = save_upload(file, filepath, expect=file_catalog.expect)
+                if header_bytes:
+                    metadata = parse_print_file_header(header_bytes, filename)
                 else:
-                    # Upload to printer via network (either local or usb storage on printer)
-                    logger.info(f"Uploading to printer '{printer['name']}' - {destination} storage...")
-                    success = upload_file_to_printer(printer['ip'], filepath, upload_id, destination)
-
-                    if success:
-                        # Emit page refresh for physical USB uploads
-                        if destination == 'usb':
-                            socketio.emit('refresh_page', {'reason': 'physical_usb_upload'})
-
-                        return Response(
-                            json.dumps({
-                                "upload": "success",
-                                "msg": "File uploaded to printer",
-                                "upload_id": upload_id,
-                                "usb_gadget": False,
-                                "filename": filename
-                            }),
-                            status=200,
-                            mimetype="application/json"
-                        )
-                    else:
-                        return Response(
-                            json.dumps({
-                                "upload": "error",
-                                "msg": "Failed to upload to printer",
-                                "upload_id": upload_id,
-                                "usb_gadget": False
-                            }),
-                            status=500,
-                            mimetype="application/json"
-                        )
-
+                    metadata = read_print_file_header(filepath)
+                logger.info(f"✓ File '{filename}' saved successfully!")
+                if metadata:
+                    logger.info(f"File header: {metadata.get('format')} for '{metadata.get('machine_name', 'unknown')}' "
+                                f"({metadata.get('resolution_x')}x{metadata.get('resolution_y')}, "
+                                f"{metadata.get('layer_count')} layers)")
             except Exception as e:
                 logger.error(f"Upload failed: {e}")
                 return Response(f'{{"upload": "error", "msg": "Upload failed: {str(e)}", "upload_id": "{upload_id}"}}', status=500, mimetype="application/json")
-        finally:
-            # Always release the lock
-            uploadLock.release()
+
+            # Refuse a file the printer would reject before transferring it
+            problem, can_force = print_file_problem(printer_ids or [printer_id], metadata,
+                                                    force=bool(form_data.get('force')))
+            if problem:
+                discard_upload(filepath)
+                progress_bus.discard(upload_id)
+                return incompatible_response(problem, upload_id, can_force)
+
+        return submit_upload_job(printer_id, printer_ids, filepath, filename, destination,
+                                 upload_id, file_md5, metadata)
     else:
         return Response("u r doin it rong", status=405, mimetype='text/plain')
 
 
+def check_gadget_space(size):
+    """Whether an upload of size bytes can go into the USB gadget, without removing anything
+
+    Returns:
+        dict: The eviction plan; 'fits' is False if the upload has to be refused
+    """
+    plan = gadget_eviction.plan(size)
+    if plan['evict'] and not USB_GADGET_EVICTION:
+        plan['evictable'], plan['fits'] = plan['fits'], False
+    return plan
+
+
+def make_room_for_upload(size):
+    """Evict old files from the USB gadget (if enabled) so an upload of size bytes fits
+
+    Call with the USB gadget queue held, right before the file is written into it.
+
+    Returns:
+        dict: The eviction plan; 'fits' is False if the upload has to be refused
+    """
+    plan = gadget_eviction.make_room(size, evict=USB_GADGET_EVICTION)
+    if plan['evicted']:
+        storage_usage.refresh()
+        gadget_reloads.request(f"evict {', '.join(plan['evicted'])}")
+    return plan
+
+
+def no_space_message(plan):
+    """Why an upload does not fit on the USB gadget"""
+    if plan.get('evictable'):
+        return (f"Not enough space on the USB gadget. Delete files or set USB_GADGET_EVICTION=true to remove "
+                f"the {len(plan['evict'])} least recently used file(s) automatically.")
+    return "Not enough space on the USB gadget, even after removing all files that are not pinned."
+
+
+def no_space_response(plan, msg=None):
+    """507 answer for an upload that does not fit on the USB gadget"""
+    return Response(json.dumps({"upload": "error", "msg": msg or no_space_message(plan), "no_space": True,
+                                "eviction": plan}),
+                    status=507, mimetype="application/json")
+
+
+def upload_destination_folder(printer_id, destination):
+    """Folder an upload is stored in before it goes to the printer
+
+    Returns:
+        tuple: (folder, error message or None)
+    """
+    usb_device_type = printers[printer_id].get('usb_device_type', 'physical')
+
+    # For virtual USB gadget, always use /mnt/usb_share
+    if destination == 'usb' and usb_device_type == 'virtual':
+        # Verify mount point is available and writable
+        if not os.path.exists(USB_GADGET_FOLDER):
+            logger.error(f"USB gadget folder not found: {USB_GADGET_FOLDER}")
+            return USB_GADGET_FOLDER, "USB mount point not found. Please mount USB gadget first."
+        if not os.access(USB_GADGET_FOLDER, os.W_OK):
+            logger.error(f"USB gadget folder not writable: {USB_GADGET_FOLDER}")
+            return USB_GADGET_FOLDER, "USB mount point not writable. Check permissions."
+        return USB_GADGET_FOLDER, None
+    return app.config['UPLOAD_FOLDER'], None
+
+
+def print_file_problem(printer_ids, metadata, force=False):
+    """Why one of the printers would refuse a print file
+
+    Compares the parsed file header with the SDCP attributes each printer
+    reported, see core.print_compat. A file type or resolution mismatch is
+    always reported; a different machine name only until the user insists (force).
+
+    Returns:
+        tuple: (problem or None if the file fits them all, whether the user may send it anyway)
+    """
+    for printer_id in printer_ids:
+        problem = check_print_file(metadata, printer_attributes.get(printer_id))
+        if problem:
+            logger.warning(f"Upload does not fit {printers[printer_id]['name']}: {problem}")
+            return f"{printers[printer_id]['name']}: {problem}", False
+    if not force:
+        for printer_id in printer_ids:
+            warning = check_machine_name(metadata, printer_attributes.get(printer_id), printers[printer_id].get('model'))
+            if warning:
+                logger.warning(f"Upload may not fit {printers[printer_id]['name']}: {warning}")
+                return f"{printers[printer_id]['name']}: {warning}", True
+    return None, False
+
+
+def incompatible_response(problem, upload_id=None, can_force=False):
+    """422 answer for a print file that does not fit the target printer"""
+    return Response(json.dumps({
+        "upload": "error",
+        "msg": f"File does not fit the printer - {problem}",
+        "incompatible": True,
+        "can_force": can_force,
+        "upload_id": upload_id
+    }), status=422, mimetype="application/json")
+
+
+def submit_upload_job(printer_id, printer_ids, filepath, filename, destination, upload_id, file_md5, metadata):
+    """Queue the transfer of a received upload and answer the client with 202
+
+    The transfer (or USB gadget reload) runs as a background job in the
+    destination's queue; the client follows it through upload_job and
+    upload_progress events or GET /upload/jobs/<upload_id>.
+    """
+    # A job for several printers waits for each target's queue in its fan-out only: holding
+    # one of them meanwhile deadlocks against a job whose targets cross its own
+    job_queue = None if len(printer_ids) > 1 else upload_queue_key(printer_id, destination)
+
+    job = upload_jobs.submit(
+        upload_id,
+        lambda: process_upload(printer_id, printer_ids, filepath, filename, destination,
+                               upload_id, file_md5, metadata, held_queue=job_queue),
+        queue=transfer_scheduler.slot(job_queue) if job_queue else None,
+        filename=filename,
+        printers=printer_ids or [printer_id],
+        destination=destination,
+    )
+
+    return Response(
+        json.dumps({
+            "upload": "accepted",
+            "msg": "File received, transfer queued",
+            "upload_id": upload_id,
+            "job_id": upload_id,
+            "job": job,
+            "filename": filename,
+            "metadata": metadata
+        }),
+        status=202,
+        mimetype="application/json"
+    )
+
+
+@app.route('/upload/resumable', methods=['POST'])
+@login_required
+def create_resumable_upload():
+    """Start a resumable upload (tus creation)
+
+    Headers: Upload-Length (file size) and Upload-Metadata with filename,
+    printer and optionally destination, printers and upload_id.
+    """
+    try:
+        metadata = parse_upload_metadata(request.headers.get('Upload-Metadata'))
+    except ValueError as e:
+        logger.error(f"Resumable upload with malformed metadata: {e}")
+        return tus_response('{"upload": "error", "msg": "Malformed request - invalid Upload-Metadata."}', status=400)
+    try:
+        size = int(request.headers.get('Upload-Length', ''))
+    except ValueError:
+        size = 0
+    if size <= 0:
+        return tus_response('{"upload": "error", "msg": "Malformed request - Upload-Length missing."}', status=400)
+
+    printer_id = metadata.get('printer', '')
+    if printer_id not in printers:
+        logger.error(f"Resumable upload for unknown printer '{printer_id}'")
+        return tus_response('{"upload": "error", "msg": "Malformed request - no printer."}', status=400)
+    filename = secure_filename(metadata.get('filename', ''))
+    if not filename or not allowed_file(filename):
+        logger.error("Invalid filetype.")
+        return tus_response('{"upload": "error", "msg": "Invalid filetype."}', status=400)
+    destination = metadata.get('destination') or ('usb' if USE_USB_GADGET else 'local')
+    printer_ids = [pid for pid in metadata.get('printers', '').split(',') if pid]
+    if any(pid not in printers for pid in printer_ids):
+        return tus_response('{"upload": "error", "msg": "Malformed request - unknown printer."}', status=400)
+    if len(printer_ids) > 1 and destination != 'local':
+        return tus_response('{"upload": "error", "msg": "Sending to several printers is only supported for local storage."}', status=400)
+
+    metadata.update(filename=filename, destination=destination)
+    # Refuse an upload that cannot fit the USB gadget before any data is sent
+    if upload_queue_key(printer_id, destination) == USB_GADGET_QUEUE:
+        plan = check_gadget_space(size)
+        if not plan['fits']:
+            response = no_space_response(plan)
+            response.headers['Tus-Resumable'] = TUS_VERSION
+            return response
+    state = resumable_uploads.create(size, metadata)
+    return tus_response(json.dumps({"upload": "created", "id": state['id']}), status=201,
+                        Location=f"/upload/resumable/{state['id']}", Upload_Offset=0)
+
+
+@app.route('/upload/resumable/<upload_key>', methods=['HEAD', 'PATCH', 'DELETE'])
+@login_required
+def resumable_upload(upload_key):
+    """Offset of a resumable upload (HEAD), append to it (PATCH) or cancel it (DELETE)"""
+    state = resumable_uploads.get(upload_key)
+    if state is None:
+        return tus_response(status=404)
+
+    if request.method == 'HEAD':
+        return tus_response(status=200, Upload_Offset=state['offset'], Upload_Length=state['size'])
+    if request.method == 'DELETE':
+        resumable_uploads.remove(upload_key)
+        return tus_response()
+
+    if request.mimetype != 'application/offset+octet-stream':
+        return tus_response(status=415)
+    try:
+        state = resumable_uploads.append(upload_key, int(request.headers.get('Upload-Offset', -1)), request.stream)
+    except UploadOffsetMismatch:
+        return tus_response(status=409, Upload_Offset=state['offset'])
+    except UploadBusy:
+        return tus_response(status=423)
+    except ValueError:
+        return tus_response(status=400)
+    except Exception as e:
+        logger.warning(f"Resumable upload {upload_key} interrupted: {e}")
+        # Cancelled or expired meanwhile: nothing to resume
+        state = resumable_uploads.get(upload_key)
+        if state is None:
+            return tus_response('{"upload": "error", "msg": "Upload was cancelled or has expired."}', status=410)
+        return tus_response(status=500, Upload_Offset=state['offset'])
+
+    if state['offset'] < state['size']:
+        return tus_response(Upload_Offset=state['offset'])
+
+    # Complete: move it to its destination and hand it to the same job as /upload
+    metadata = state['metadata']
+    printer_id, filename, destination = metadata['printer'], metadata['filename'], metadata['destination']
+    printer_ids = [pid for pid in metadata.get('printers', '').split(',') if pid]
+    upload_id = metadata.get('upload_id') or str(uuid.uuid4())
+    file_metadata = read_print_file_header(resumable_uploads.part_path(upload_key))
+
+    problem, can_force = print_file_problem(printer_ids or [printer_id], file_metadata,
+                                            force='force' in metadata)
+    if problem:
+        resumable_uploads.remove(upload_key)
+        response = incompatible_response(problem, upload_id, can_force)
+        response.headers['Tus-Resumable'] = TUS_VERSION
+        return response
+
+    queue_key = upload_queue_key(printer_id, destination)
+    # Already on the local disk: staged there without a copy into RAM
+    staged = upload_staging.folder_for(state['size'], ram=False) if queue_key == USB_GADGET_QUEUE else None
+    with transfer_scheduler.slot(queue_key) if queue_key == USB_GADGET_QUEUE and not staged else nullcontext():
+        upload_folder, folder_error = upload_destination_folder(printer_id, destination)
+        if folder_error:
+            return tus_response(json.dumps({"upload": "error", "msg": folder_error}), status=500)
+        if queue_key == USB_GADGET_QUEUE and not staged:
+            plan = make_room_for_upload(state['size'])
+            if not plan['fits']:
+                resumable_uploads.remove(upload_key)
+                response = no_space_response(plan)
+                response.headers['Tus-Resumable'] = TUS_VERSION
+                return response
+        filepath = os.path.join(staged or upload_folder, filename)
+        progress_bus.update(upload_id, 0)
+        file_md5 = resumable_uploads.finish(upload_key, filepath, expect=file_catalog.expect)
+    logger.info(f"✓ File '{filename}' received through resumable upload {upload_key}")
+
+    response = submit_upload_job(printer_id, printer_ids, filepath, filename, destination,
+                                 upload_id, file_md5, file_metadata)
+    response.headers['Tus-Resumable'] = TUS_VERSION
+    response.headers['Upload-Offset'] = str(state['offset'])
+    return response
+
+
+def printers_with_file(printer_ids, destination, filename, md5, size):
+    """Printers that already hold this exact file (same path and content)
+
+    Uses the file index of earlier uploads and asks the printers, all at
+    once, for a fresh listing of the directory, so files deleted on a
+    printer are not missed. SDCP has no copy or rename command, so content
+    stored under another name still has to be transferred.
+    """
+    path = printer_path(destination, filename)
+    confirmed = file_index.confirm([(pid, path, md5, size) for pid in printer_ids],
+                                   lambda pid, directory, request_id: send_printer_cmd(pid, 258, {"Url": directory},
+                                                                                       request_id=request_id))
+    present = [pid for pid, _, _, _ in confirmed]
+    for pid in printer_ids:
+        if pid in present:
+            logger.info(f"'{path}' is already on {printers[pid]['name']}, skipping transfer")
+            continue
+        elsewhere = [p for located, p in file_index.locations(md5) if located == pid and p != path]
+        if elsewhere:
+            logger.info(f"Same content is on {printers[pid]['name']} as {', '.join(elsewhere)}; transferring as '{filename}'")
+    return present
+
+
+def printer_has_file(printer_id, destination, filename, md5, size):
+    """True if the printer already holds this exact file (see printers_with_file)"""
+    return bool(printers_with_file([printer_id], destination, filename, md5, size))
+
+
+def discard_upload(filepath):
+    """Remove an ingested upload that no longer needs to be sent"""
+    try:
+        os.remove(filepath)
+        logger.debug(f"Temporary file {filepath} removed")
+    except OSError as e:
+        logger.warning(f"Could not remove temporary file {filepath}: {e}")
+
+
+def process_upload(printer_id, printer_ids, filepath, filename, destination, upload_id, file_md5, metadata,
+                   held_queue=None):
+    """Finish an ingested upload: reload the USB gadget or send the file to the printer(s)
+
+    Runs as a background upload job. Returns (success, result) where result
+    is the JSON body the client receives when the job finishes.
+    """
+    printer = printers[printer_id]
+    usb_device_type = printer.get('usb_device_type', 'physical')
+
+    # Check destination: if user selected USB and printer is configured for USB, process accordingly
+    # For virtual USB: file is already saved to /mnt/usb_share, just need to reload
+    # For physical USB or network upload: upload to printer via network
+    if destination == 'usb' and (USE_USB_GADGET or usb_device_type == 'virtual'):
+        # Staged upload: copy it into the gadget now that the job holds the gadget queue
+        if upload_staging.is_staged(filepath):
+            progress_bus.update(upload_id, 25)
+            # Old files are removed only now, with the upload received and validated
+            plan = make_room_for_upload(os.path.getsize(filepath))
+            if not plan['fits']:
+                discard_upload(filepath)
+                return False, {
+                    "upload": "error",
+                    "msg": no_space_message(plan),
+                    "no_space": True,
+                    "upload_id": upload_id,
+                    "usb_gadget": True,
+                    "filename": filename
+                }
+            # Hashed on the way in: the catalog need not read it again
+            file_catalog.expect(os.path.join(USB_GADGET_FOLDER, os.path.basename(filepath)), file_md5,
+                                os.path.getsize(filepath))
+            try:
+                filepath = upload_staging.move(filepath, USB_GADGET_FOLDER)
+            except OSError as e:
+                # The file stays in staging and is moved again on the next start
+                logger.error(f"Could not move staged upload {filepath} into the USB gadget: {e}")
+                return False, {
+                    "upload": "error",
+                    "msg": f"Could not write the file into the USB gadget ({e.strerror or e}); it is kept and retried on restart",
+                    "upload_id": upload_id,
+                    "usb_gadget": True,
+                    "filename": filename
+                }
+        gadget_writes.written(filepath)
+
+        # File saved to USB gadget - update progress
+        progress_bus.update(upload_id, 50)
+
+        logger.info("Destination: USB Gadget (Pi's virtual USB)")
+
+        # For virtual USB gadget, unmount/mount/reload (batched with other changes, in the background)
+        reload = None
+        if usb_device_type == 'virtual':
+            logger.info("Virtual USB gadget detected - scheduling unmount/mount/reload")
+            reload = gadget_reloads.request(f"upload {filename}")
+            refresh_success = True
+        else:
+            # Physical USB or auto-refresh disabled
+            refresh_success = False
+            if USB_AUTO_REFRESH:
+                logger.info("Triggering USB gadget refresh to notify printer...")
+                progress_bus.update(upload_id, 75)
+                refresh_success = trigger_usb_gadget_refresh()
+
+                if refresh_success:
+                    logger.info("Waiting for printer to detect new file...")
+                    time.sleep(2)
+            else:
+                logger.info("USB auto-refresh disabled (USB_AUTO_REFRESH=false)")
+                logger.info("💡 Manually refresh on printer or set USB_AUTO_REFRESH=true")
+
+        # Set progress to 100%
+        progress_bus.update(upload_id, 100)
+
+        logger.info("✓ Upload to USB gadget complete!")
+        storage_usage.refresh()
+
+        # The file list is refreshed once the scheduled reload has finished
+        if usb_device_type == 'virtual':
+            msg = (f"File saved to USB gadget. The printer sees it after the USB reload "
+                   f"(starting in ~{reload['due_in']:.0f}s).")
+        elif USB_AUTO_REFRESH and refresh_success:
+            msg = "File saved to USB gadget. Printer should detect it automatically."
+        elif USB_AUTO_REFRESH and not refresh_success:
+            msg = "File saved to USB gadget. Auto-refresh failed - manually refresh on printer."
+            logger.warning("USB gadget refresh failed - manual intervention may be needed")
+            logger.info("💡 To enable automatic refresh, run: sudo python3 main.py")
+        else:
+            msg = "File saved to USB gadget. Manually refresh on printer or reconnect USB to detect it."
+
+        return True, {
+            "upload": "success",
+            "msg": msg,
+            "upload_id": upload_id,
+            "usb_gadget": True,
+            "filename": filename,
+            "refresh_triggered": refresh_success,
+            "reload": reload,
+            "metadata": metadata
+        }
+    elif len(printer_ids) > 1:
+        # Printers that already have this exact file are done without a transfer
+        size = os.path.getsize(filepath)
+        results = {pid: True for pid in printers_with_file(printer_ids, destination, filename, file_md5, size)}
+        pending = [pid for pid in printer_ids if pid not in results]
+
+        # Same file to the rest: hashed once, read once, sent concurrently
+        if pending:
+            sent = upload_file_to_printers(pending, filepath, upload_id, md5=file_md5, held_queue=held_queue)
+            for pid, ok in sent.items():
+                if ok:
+                    file_index.record(pid, printer_path(destination, filename), file_md5, size)
+            results.update(sent)
+        else:
+            discard_upload(filepath)
+            progress_bus.update(upload_id, 100)
+        failed = [printers[pid]['name'] for pid, ok in results.items() if not ok]
+
+        return not failed, {
+            "upload": "error" if failed else "success",
+            "msg": f"Failed to upload to {', '.join(failed)}" if failed else f"File uploaded to {len(results)} printers",
+            "upload_id": upload_id,
+            "usb_gadget": False,
+            "filename": filename,
+            "printers": results,
+            "metadata": metadata
+        }
+    else:
+        size = os.path.getsize(filepath)
+        if printer_has_file(printer_id, destination, filename, file_md5, size):
+            discard_upload(filepath)
+            progress_bus.update(upload_id, 100)
+            return True, {
+                "upload": "success",
+                "msg": "Printer already has this file, transfer skipped",
+                "upload_id": upload_id,
+                "usb_gadget": False,
+                "skipped": True,
+                "filename": filename,
+                "metadata": metadata
+            }
+
+        # Upload to printer via network (either local or usb storage on printer)
+        logger.info(f"Uploading to printer '{printer['name']}' - {destination} storage...")
+        success = upload_file_to_printer(printer['ip'], filepath, upload_id, destination, md5=file_md5)
+
+        if success:
+            file_index.record(printer_id, printer_path(destination, filename), file_md5, size)
+            # Emit page refresh for physical USB uploads
+            if destination == 'usb':
+                socketio.emit('refresh_page', {'reason': 'physical_usb_upload'})
+
+            return True, {
+                "upload": "success",
+                "msg": "File uploaded to printer",
+                "upload_id": upload_id,
+                "usb_gadget": False,
+                "filename": filename,
+                "metadata": metadata
+            }
+        else:
+            return False, {
+                "upload": "error",
+                "msg": "Failed to upload to printer",
+                "upload_id": upload_id,
+                "usb_gadget": False
+            }
+
+
+@app.route('/upload/check', methods=['POST'])
+@login_required
+def check_upload():
+    """Check a print file against its target printers before it is uploaded
+
+    Query parameters: printer, filename and optionally printers. The body is
+    the beginning of the file (its header, HEADER_CAPTURE_SIZE bytes).
+    """
+    printer_ids = ([pid for pid in request.args.get('printers', '').split(',') if pid]
+                   or [request.args.get('printer', '')])
+    if any(pid not in printers for pid in printer_ids):
+        return jsonify({"success": False, "message": "Unknown printer"}), 400
+    metadata = parse_print_file_header(request.stream.read(HEADER_CAPTURE_SIZE), request.args.get('filename', ''))
+    problem, can_force = print_file_problem(printer_ids, metadata)
+    return jsonify({"success": True, "compatible": problem is None, "can_force": can_force,
+                    "msg": f"File does not fit the printer - {problem}" if problem else None,
+                    "metadata": metadata})
+
+
+@app.route('/upload/lookup', methods=['GET'])
+@login_required
+def lookup_upload():
+    """Check whether a printer already has a file before it is uploaded
+
+    Query parameters: printer, filename, md5, size, destination
+    """
+    printer_id = request.args.get('printer', '')
+    filename = secure_filename(request.args.get('filename', ''))
+    md5 = request.args.get('md5', '')
+    destination = request.args.get('destination', 'local')
+    if printer_id not in printers or not filename or not MD5_PATTERN.match(md5):
+        return jsonify({"success": False, "message": "printer, filename and md5 are required"}), 400
+    try:
+        size = int(request.args.get('size', 0)) or None
+    except ValueError:
+        size = None
+    present = printer_has_file(printer_id, destination, filename, md5, size)
+    return jsonify({"success": True, "present": present, "path": printer_path(destination, filename)})
+
+
+@app.route('/upload/jobs', methods=['GET'])
+@login_required
+def list_upload_jobs():
+    """Recent upload jobs, newest first"""
+    return jsonify({"success": True, "jobs": upload_jobs.list()})
+
+
+@app.route('/upload/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_upload_job(job_id):
+    """State of one upload job, with its transfer progress while it runs"""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    job['progress'] = progress_bus.progress(job_id, 100 if job['state'] == 'succeeded' else 0)
+    job['transfer'] = progress_bus.get(job_id)
+    return jsonify({"success": True, "job": job})
+
+
+@app.route('/upload/relay', methods=['POST'])
+@login_required
+def upload_relay():
+    """Relay a browser upload straight to the printer's local storage
+
+    The browser computes the MD5 up front (web/js/md5-worker.js) and sends the
+    raw file as the request body. Each part is forwarded to the printer as soon
+    as it arrives, so nothing is written to the Pi's SD card.
+
+    Query parameters: printer, filename, md5, size, upload_id
+    """
+    # Wait for our turn in the printer's queue (other printers are not blocked)
+    with transfer_scheduler.slot(upload_queue_key(request.args.get('printer'), 'local')):
+        printer_id = request.args.get('printer', '')
+        filename = secure_filename(request.args.get('filename', ''))
+        md5 = request.args.get('md5', '')
+        upload_id = request.args.get('upload_id', str(uuid.uuid4()))
+
+        if printer_id not in printers:
+            logger.error(f"Relay upload for unknown printer '{printer_id}'")
+            return Response('{"upload": "error", "msg": "Malformed request - no printer."}', status=400, mimetype="application/json")
+        if not filename or not allowed_file(filename):
+            logger.error("Invalid filetype.")
+            return Response('{"upload": "error", "msg": "Invalid filetype."}', status=400, mimetype="application/json")
+        if not MD5_PATTERN.match(md5):
+            logger.error("Relay upload without a valid MD5")
+            return Response('{"upload": "error", "msg": "Malformed request - missing MD5."}', status=400, mimetype="application/json")
+        try:
+            total_size = int(request.args.get('size', request.content_length or 0))
+        except ValueError:
+            total_size = 0
+        if total_size <= 0 or (request.content_length is not None and request.content_length != total_size):
+            logger.error(f"Relay upload size mismatch (size={total_size}, body={request.content_length})")
+            return Response('{"upload": "error", "msg": "Malformed request - size mismatch."}', status=400, mimetype="application/json")
+
+        printer = printers[printer_id]
+        progress_bus.update(upload_id, 0)
+
+        def on_progress(sent, total):
+            progress_bus.update(upload_id, done=sent, total=total)
+
+        def check_header(head):
+            # The first part holds the file header; nothing was sent to the printer yet
+            problem, can_force = print_file_problem([printer_id], parse_print_file_header(head, filename),
+                                                    force=bool(request.args.get('force')))
+            if problem:
+                raise IncompatiblePrintFile(problem, can_force)
+
+        try:
+            success = relay_upload(request.stream, printer['ip'], filename, md5, total_size, on_progress=on_progress,
+                                   check_header=check_header)
+        except IncompatiblePrintFile as e:
+            progress_bus.discard(upload_id)
+            return incompatible_response(str(e), upload_id, e.can_force)
+        if success:
+            file_index.record(printer_id, printer_path('local', filename), md5, total_size)
+        else:
+            progress_bus.update(upload_id, 0)
+            return Response(
+                json.dumps({
+                    "upload": "error",
+                    "msg": "Failed to relay file to printer",
+                    "upload_id": upload_id,
+                    "usb_gadget": False
+                }),
+                status=500,
+                mimetype="application/json"
+            )
+
+        return Response(
+            json.dumps({
+                "upload": "success",
+                "msg": "File uploaded to printer",
+                "upload_id": upload_id,
+                "usb_gadget": False,
+                "filename": filename
+            }),
+            status=200,
+            mimetype="application/json"
+        )
+
+
 @app.route('/usb-gadget/storage', methods=['GET'])
 def get_usb_gadget_storage():
-    """Get USB gadget storage information"""
+    """Get USB gadget storage information (cached; changes are pushed as 'usb_gadget_storage')"""
+    return jsonify(storage_usage.get())
+
+
+@app.route('/files/catalog', methods=['GET'])
+@login_required
+def get_file_catalog():
+    """List the print files ChitUI holds locally (USB gadget folder and data/uploads)
+
+    Query parameters: folder ('usb' or 'uploads'), search, sort (name, size, mtime,
+    layers, print_time, exposure, machine), order ('asc' or 'desc'), limit, offset
+    """
     try:
-        import shutil
+        limit = int(request.args.get('limit', 0)) or None
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid limit or offset"}), 400
+    files, total = file_catalog.list(folder=request.args.get('folder') or None,
+                                     search=request.args.get('search') or None,
+                                     sort=request.args.get('sort', 'name'),
+                                     descending=request.args.get('order') == 'desc',
+                                     limit=limit, offset=offset)
+    return jsonify({"success": True, "files": files, "total": total})
+
+
+@app.route('/files/catalog/thumbnail', methods=['GET'])
+@login_required
+def get_file_catalog_thumbnail():
+    """Preview image of a catalogued print file (query parameters: folder, path)"""
+    png = file_catalog.thumbnail(request.args.get('folder', ''), request.args.get('path', ''))
+    if png is None:
+        return jsonify({"success": False, "message": "No preview"}), 404
+    return Response(png, mimetype='image/png')
 
-        # Check if USB gadget is available
-        if not os.path.exists('/mnt/usb_share'):
-            return jsonify({
-                "success": False,
-                "available": False,
-                "message": "USB gadget mount point not found"
-            })
 
-        # Get disk usage for /mnt/usb_share
-        stat = shutil.disk_usage('/mnt/usb_share')
+@app.route('/files/catalog/pin', methods=['POST'])
+@login_required
+def pin_catalog_file():
+    """Keep a file on the USB gadget when space is freed (JSON: folder, path, pinned)"""
+    data = request.json or {}
+    if not file_catalog.pin(data.get('folder', 'usb'), data.get('path', ''), bool(data.get('pinned', True))):
+        return jsonify({"success": False, "message": "File not found"}), 404
+    return jsonify({"success": True, "file": file_catalog.get(data.get('folder', 'usb'), data.get('path', ''))})
 
-        # Also try to get the size of /piusb.bin for total capacity
-        total_bytes = stat.total
-        if os.path.exists('/piusb.bin'):
-            bin_size = os.path.getsize('/piusb.bin')
-            # Use bin file size if it's larger (more accurate)
-            if bin_size > total_bytes:
-                total_bytes = bin_size
 
-        return jsonify({
-            "success": True,
-            "available": True,
-            "total": total_bytes,
-            "used": stat.used,
-            "free": stat.free,
-            "percent": round((stat.used / total_bytes * 100), 1) if total_bytes > 0 else 0
-        })
-    except Exception as e:
-        logger.error(f"Error getting USB gadget storage info: {e}")
-        return jsonify({
-            "success": False,
-            "available": False,
-            "message": str(e)
-        }), 500
+@app.route('/usb-gadget/eviction', methods=['GET'])
+@login_required
+def preview_gadget_eviction():
+    """Dry run: files that would be removed from the USB gadget for an upload of ?size= bytes"""
+    try:
+        size = int(request.args.get('size', 0))
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid size"}), 400
+    return jsonify({"success": True, "enabled": USB_GADGET_EVICTION, **gadget_eviction.plan(size)})
 
 
 @app.route('/usb-gadget/refresh', methods=['POST'])
@@ -1783,17 +2444,14 @@ def refresh_usb_gadget_endpoint():
 
     try:
         logger.info("Manual USB gadget refresh requested via API")
-        success = reload_usb_gadget()
-        if success:
-            return jsonify({
-                "success": True,
-                "message": "USB gadget disconnected and reconnected successfully. Printer should detect the change in ~4 seconds."
-            })
-        else:
-            return jsonify({
-                "success": False,
-                "message": "USB gadget reload failed. Check logs for details or try running with sudo."
-            }), 500
+        # Joins a reload that is already pending; the result follows as usb_gadget_reload events
+        reload = gadget_reloads.request('manual refresh', delay=0)
+        return jsonify({
+            "success": True,
+            "message": f"USB gadget reload starts in ~{reload['due_in']:.0f}s. "
+                       "Printer should detect the change a few seconds after it.",
+            "reload": reload
+        })
     except Exception as e:
         logger.error(f"Error in USB gadget refresh endpoint: {e}")
         return jsonify({
@@ -1807,7 +2465,13 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def upload_file_to_printer(printer_ip, filepath, upload_id, destination='local'):
+def printer_identity(printer_ip):
+    """Model and firmware version of the printer at printer_ip"""
+    printer = next((p for p in printers.values() if p.get('ip') == printer_ip), {})
+    return printer.get('model'), printer.get('firmware')
+
+
+def upload_file_to_printer(printer_ip, filepath, upload_id, destination='local', md5=None):
     """Upload file to printer in chunks via HTTP API
 
     Args:
@@ -1815,23 +2479,24 @@ def upload_file_to_printer(printer_ip, filepath, upload_id, destination='local')
         filepath: Path to the file to upload
         upload_id: Unique ID for tracking upload progress
         destination: Upload destination - 'local' for internal storage or 'usb' for USB storage
+        md5: MD5 hex digest if already computed during ingest (avoids re-reading the file)
     """
-    part_size = 1048576  # 1MB chunks
     filename = os.path.basename(filepath)
 
     # Initialize progress for this upload
-    with uploadProgressLock:
-        uploadProgress[upload_id] = 0
+    progress_bus.update(upload_id, 0)
 
-    # Calculate MD5 hash
-    md5_hash = hashlib.md5()
-    with open(filepath, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            md5_hash.update(byte_block)
+    # Calculate MD5 hash (unless it was computed while the upload streamed in)
+    if md5 is None:
+        md5_hash = hashlib.md5()
+        with open(filepath, "rb") as f:
+            for byte_block in iter(lambda: f.read(1048576), b""):
+                md5_hash.update(byte_block)
+        md5 = md5_hash.hexdigest()
 
     file_stats = os.stat(filepath)
     post_data = {
-        'S-File-MD5': md5_hash.hexdigest(),
+        'S-File-MD5': md5,
         'Check': 1,
         'Offset': 0,
         'Uuid': uuid.uuid4(),
@@ -1847,12 +2512,7 @@ def upload_file_to_printer(printer_ip, filepath, upload_id, destination='local')
         logger.info(f"Uploading complete file to USB storage (size: {file_stats.st_size} bytes)...")
 
         # Update progress to 30% (upload starting)
-        with uploadProgressLock:
-            uploadProgress[upload_id] = 30
-
-        # Read entire file
-        with open(filepath, 'rb') as f:
-            file_data = f.read()
+        progress_bus.update(upload_id, 30)
 
         # Try multiple USB upload methods with fallback
         upload_methods = [
@@ -1878,23 +2538,30 @@ def upload_file_to_printer(printer_ip, filepath, upload_id, destination='local')
             }
         ]
 
+        # Start with the method that worked for this model/firmware before
+        model, firmware = printer_identity(printer_ip)
+        upload_methods = transfer_strategies.order_methods(model, firmware, upload_methods)
+        timeout = transfer_strategies.usb_timeout(model, firmware, file_stats.st_size)
+
         # Update progress to 40%
-        with uploadProgressLock:
-            uploadProgress[upload_id] = 40
+        progress_bus.update(upload_id, 40)
+
+        def on_usb_progress(sent, total):
+            # Map the bytes sent so far to 40-95%
+            progress_bus.update(upload_id, 40 + int(sent * 55 / total) if total else 95, done=sent, total=total)
 
         for method in upload_methods:
             logger.info(f"Trying method: {method['name']}")
             logger.debug(f"  Filename: {method['filename']}")
             logger.debug(f"  Post data keys: {list(method['post_data'].keys())}")
 
-            post_files = {'File': (method['filename'], file_data)}
-
             try:
-                # Update progress to 60%
-                with uploadProgressLock:
-                    uploadProgress[upload_id] = 60
-
-                response = requests.post(url, data=method['post_data'], files=post_files, timeout=120)
+                # Stream the file from disk instead of building the body in memory
+                with MultipartFileStream(method['post_data'], 'File', method['filename'], filepath,
+                                         on_progress=on_usb_progress) as body:
+                    stats = {}
+                    response = timed_post(url, stats=stats, data=body, headers={'Content-Type': body.content_type},
+                                          timeout=timeout)
 
                 # Log response details
                 logger.info(f"Response status: {response.status_code}")
@@ -1909,9 +2576,10 @@ def upload_file_to_printer(printer_ip, filepath, upload_id, destination='local')
                     # Some printers return plain text on success
                     if response.status_code == 200:
                         logger.info(f"✓ Upload successful (HTTP 200, non-JSON response)")
-                        with uploadProgressLock:
-                            uploadProgress[upload_id] = 100
+                        progress_bus.update(upload_id, 100)
                         logger.info(f"✓ Method '{method['name']}' worked! Saving for future uploads.")
+                        transfer_strategies.remember(model, firmware, usb_method=method['name'],
+                                                     usb_throughput=round(stats['throughput']))
                         return True
                     else:
                         logger.warning(f"Method '{method['name']}' failed with status {response.status_code}")
@@ -1920,16 +2588,17 @@ def upload_file_to_printer(printer_ip, filepath, upload_id, destination='local')
                 # Check if upload succeeded
                 if status.get('success') or status.get('status') == 'success':
                     logger.info(f"✓ Upload successful!")
-                    with uploadProgressLock:
-                        uploadProgress[upload_id] = 100
+                    progress_bus.update(upload_id, 100)
                     logger.info(f"✓ Method '{method['name']}' worked! Saving for future uploads.")
+                    transfer_strategies.remember(model, firmware, usb_method=method['name'],
+                                                 usb_throughput=round(stats['throughput']))
                     return True
                 else:
                     logger.warning(f"Method '{method['name']}' failed: {status}")
                     continue
 
             except requests.exceptions.Timeout:
-                logger.warning(f"Method '{method['name']}' timed out (120s)")
+                logger.warning(f"Method '{method['name']}' timed out ({timeout:.0f}s)")
                 continue
             except requests.exceptions.RequestException as req_err:
                 logger.warning(f"Method '{method['name']}' request error: {req_err}")
@@ -1944,56 +2613,27 @@ def upload_file_to_printer(printer_ip, filepath, upload_id, destination='local')
         logger.error("  1. USB drive is inserted in printer's USB port")
         logger.error("  2. USB drive is formatted as FAT32 or exFAT")
         logger.error("  3. Printer firmware supports network uploads to USB")
-        with uploadProgressLock:
-            uploadProgress[upload_id] = 0
+        progress_bus.update(upload_id, 0)
         return False
 
     # Local uploads: send file in chunks
     else:
-        num_parts = (int)(file_stats.st_size / part_size)
-        logger.info(f"Uploading file in {num_parts + 1} parts...")
-
-        i = 0
-        while i <= num_parts:
-            offset = i * part_size
-            progress_value = round(i / num_parts * 100) if num_parts > 0 else 100
-
-            # Update progress (thread-safe)
-            with uploadProgressLock:
-                uploadProgress[upload_id] = progress_value
-
-            # Emit progress via WebSocket (bypasses SSE buffering issues)
-            socketio.emit('upload_progress', {
-                'upload_id': upload_id,
-                'progress': progress_value
-            }, namespace='/')
-
-            with open(filepath, 'rb') as f:
-                f.seek(offset)
-                file_part = f.read(part_size)
-                logger.debug(f"Uploading part {i}/{num_parts} (offset: {offset})")
-
-                if not upload_file_part(url, post_data, filename, file_part, offset):
-                    logger.error("Uploading file to printer failed.")
-                    # Set progress to 0 to indicate failure
-                    with uploadProgressLock:
-                        uploadProgress[upload_id] = 0
-                    return False
-
-                logger.debug(f"Part {i}/{num_parts} uploaded.")
-            i += 1
-
-        # Set progress to 100% (thread-safe)
-        with uploadProgressLock:
-            uploadProgress[upload_id] = 100
-
-        # Emit 100% via WebSocket
-        socketio.emit('upload_progress', {
-            'upload_id': upload_id,
-            'progress': 100
-        }, namespace='/')
-
-        logger.info(f"✓ Upload complete!")
+        transfer_start = time.monotonic()
+
+        def on_progress(sent, total):
+            progress_bus.update(upload_id, done=sent, total=total)
+
+        if not send_file_chunked(printer_ip, filepath, md5, on_progress):
+            logger.error("Uploading file to printer failed.")
+            # Set progress to 0 to indicate failure
+            progress_bus.update(upload_id, 0)
+            return False
+
+        progress_bus.update(upload_id, 100)
+
+        elapsed = time.monotonic() - transfer_start
+        logger.info(f"✓ Upload complete! ({file_stats.st_size / 1048576:.1f} MB in {elapsed:.1f}s, "
+                    f"{file_stats.st_size / elapsed / 1048576 if elapsed > 0 else 0:.2f} MB/s)")
 
     # Delete the temporary file after successful upload
     try:
@@ -2005,44 +2645,202 @@ def upload_file_to_printer(printer_ip, filepath, upload_id, destination='local')
     return True
 
 
-def upload_file_part(url, post_data, file_name, file_part, offset):
-    """Upload a single chunk to the printer"""
-    post_data['Offset'] = offset
-    post_files = {'File': (file_name, file_part)}
+def send_file_chunked(printer_ip, filepath, md5, on_progress, data=None):
+    """Chunked transfer of a local file to a printer's local storage
 
-    try:
-        response = requests.post(url, data=post_data, files=post_files, timeout=30)
+    Parts are retried with backoff; an interrupted transfer stays in the
+    journal and resumes from its last acknowledged offset. The part size
+    adapts to the measured throughput, starting from the best size found for
+    this printer model and firmware so far. data optionally holds the file
+    content (a shared mmap, see upload_file_to_printers).
+    """
+    model, firmware = printer_identity(printer_ip)
+    sizer = AdaptiveChunkSizer(transfer_strategies.part_size(model, firmware))
+    logger.info(f"Uploading '{os.path.basename(filepath)}' to {printer_ip} in parts of {sizer.size // 1024} KB (adaptive)...")
+
+    if not upload_file_chunked(printer_ip, filepath, md5, on_progress=on_progress, journal=transfer_journal,
+                               sizer=sizer, data=data,
+                               part_timeout=transfer_strategies.part_timeout(model, firmware)):
+        return False
+
+    transfer_strategies.remember(model, firmware, part_size=sizer.best_size, slowest_part=round(sizer.slowest, 1))
+    return True
+
+
+def upload_file_to_printers(printer_ids, filepath, upload_id, md5=None, held_queue=None):
+    """Send one file to the local storage of several printers at once
 
-        # Log response details for debugging
-        logger.debug(f"Upload response status: {response.status_code}")
-        logger.debug(f"Upload response headers: {response.headers}")
+    The file is hashed once and memory-mapped once; every printer is fed
+    concurrently from the same mapping, each in its own printer queue.
+    Progress is reported per printer and as an average under upload_id.
 
-        # Try to parse JSON response
+    Args:
+        printer_ids: IDs of the target printers
+        filepath: Path to the file to upload
+        upload_id: Unique ID for tracking upload progress
+        md5: MD5 hex digest if already computed during ingest
+        held_queue: Transfer queue the caller already holds (not waited for again)
+
+    Returns:
+        dict: printer ID -> True if that printer received the file
+    """
+    if md5 is None:
+        md5_hash = hashlib.md5()
+        with open(filepath, "rb") as f:
+            for byte_block in iter(lambda: f.read(1048576), b""):
+                md5_hash.update(byte_block)
+        md5 = md5_hash.hexdigest()
+
+    progress = {printer_id: 0 for printer_id in printer_ids}
+    sent_bytes = {printer_id: 0 for printer_id in printer_ids}
+    progress_lock = threading.Lock()
+    total_bytes = os.path.getsize(filepath) * len(printer_ids)
+    progress_bus.update(upload_id, 0)
+
+    def send(printer_id, data):
+        printer_ip = printers[printer_id]['ip']
+
+        def on_progress(sent, total):
+            with progress_lock:
+                progress[printer_id] = round(sent / total * 100) if total > 0 else 100
+                sent_bytes[printer_id] = sent
+                overall = round(sum(progress.values()) / len(progress))
+                done = sum(sent_bytes.values())
+                per_printer = dict(progress)
+            progress_bus.update(upload_id, overall, done=done, total=total_bytes, printers=per_printer)
+
+        queue = nullcontext() if printer_ip == held_queue else transfer_scheduler.slot(printer_ip)
+        with queue:
+            return send_file_chunked(printer_ip, filepath, md5, on_progress, data=data)
+
+    transfer_start = time.monotonic()
+    logger.info(f"Sending '{os.path.basename(filepath)}' to {len(printer_ids)} printers...")
+    results = upload_file_to_many(filepath, printer_ids, send)
+    elapsed = time.monotonic() - transfer_start
+
+    failed = [printer_id for printer_id, ok in results.items() if not ok]
+    if failed:
+        logger.error(f"Upload failed for printer(s): {', '.join(failed)}")
+    else:
+        logger.info(f"✓ Upload to {len(printer_ids)} printers complete in {elapsed:.1f}s")
         try:
-            status = json.loads(response.text)
-        except json.JSONDecodeError as json_err:
-            logger.error(f"Failed to parse JSON response from printer")
-            logger.error(f"Response status code: {response.status_code}")
-            logger.error(f"Response body: {response.text[:500]}")  # First 500 chars
-            return False
+            os.remove(filepath)
+            logger.debug(f"Temporary file {filepath} removed")
+        except OSError as e:
+            logger.warning(f"Could not remove temporary file {filepath}: {e}")
 
-        if status.get('success'):
-            return True
-        else:
-            logger.error(f"Upload part failed: {status}")
-            return False
-    except requests.exceptions.RequestException as req_err:
-        logger.error(f"Upload request error: {req_err}")
-        return False
-    except Exception as e:
-        logger.error(f"Upload part error: {e}")
-        return False
+    progress_bus.update(upload_id, 0 if failed else 100,
+                        printers={printer_id: 100 if ok else 0 for printer_id, ok in results.items()})
+    return results
 
 
-# Global variables for upload progress tracking (thread-safe)
-uploadProgress = {}  # Dictionary to track progress per upload session
-uploadProgressLock = threading.Lock()
-uploadLock = threading.Lock()  # Prevent concurrent uploads
+def publish_gadget_reload(status):
+    """Push USB gadget reload status; refresh file lists once a reload is done"""
+    socketio.emit('usb_gadget_reload', status, namespace='/')
+    if status['event'] == 'finished':
+        storage_usage.refresh()
+        if status['last']['ok']:
+            socketio.emit('refresh_page', {'reason': 'virtual_usb_reload'})
+
+
+def publish_mount_change(mount_point, old, new):
+    """Tell the browsers when the USB gadget folder is mounted, unmounted or remounted"""
+    if mount_point != os.path.realpath(USB_GADGET_FOLDER):
+        return
+    if new is None:
+        logger.warning(f"USB gadget unmounted from {mount_point}")
+    elif new.read_only and not (old and old.read_only):
+        logger.warning(f"USB gadget at {mount_point} is mounted read-only ({new.source})")
+    else:
+        logger.info(f"USB gadget mounted at {mount_point} ({new.source})")
+    socketio.emit('usb_gadget_mount', {'mounted': new is not None, 'read_only': bool(new and new.read_only)},
+                  namespace='/')
+    storage_usage.refresh()
+    # A mount hides the directory inotify was watching
+    file_catalog.rescan('usb')
+
+
+# Mount table from /proc/self/mountinfo, re-read only when the kernel reports a change
+mount_state = MountState()
+mount_state.add_listener(publish_mount_change)
+# Upload progress, pushed to the browsers as 'upload_progress' events when it changes
+progress_bus = ProgressBus(emit=lambda event: socketio.emit('upload_progress', event, namespace='/'))
+transfer_scheduler = TransferScheduler()  # One upload queue per printer
+# Gadget reloads batched per change window; they hold the USB gadget queue while running
+gadget_reloads = ReloadScheduler(lambda: reload_usb_gadget(), slot=lambda: transfer_scheduler.slot(USB_GADGET_QUEUE),
+                                 on_change=publish_gadget_reload)
+upload_jobs = UploadJobs(UPLOAD_JOBS_FILE,  # Background /upload jobs
+                         on_change=lambda job: socketio.emit('upload_job', job, namespace='/'))
+transfer_journal = TransferJournal(TRANSFERS_FILE)  # Resumable chunked transfers
+file_index = FileIndex(FILE_INDEX_FILE)  # MD5 -> files already on the printers
+# Partial browser uploads; never kept in the USB gadget image, where the printer would see them
+resumable_uploads = ResumableUploads(os.path.join(DATA_FOLDER, 'uploads'))
+# Fast landing area for USB gadget uploads: tmpfs for files within the RAM budget, else the local disk
+upload_staging = UploadStaging(([(RAM_STAGING_FOLDER, int(UPLOAD_STAGING_RAM * 1048576), True)]
+                                if UPLOAD_STAGING_RAM > 0 and os.path.isdir('/dev/shm') else [])
+                               + [(STAGING_FOLDER, None, False)] if UPLOAD_STAGING else [])
+# Print files in the USB gadget folder and data/uploads with their headers and previews, kept up to date by inotify
+file_catalog = FileCatalog(FILE_CATALOG_FILE, {'usb': USB_GADGET_FOLDER, 'uploads': os.path.join(DATA_FOLDER, 'uploads')},
+                           on_change=lambda folder, path, entry: socketio.emit(
+                               'file_catalog', {'folder': folder, 'path': path, 'file': entry}, namespace='/'))
+transfer_strategies = TransferStrategyCache(load_settings, save_settings)  # What works per printer model/firmware
+printer_attributes = {}  # MainboardID -> last SDCP Attributes (resolution, machine name, file types)
+transfers_retried = set()  # MainboardIDs whose journalled transfers were retried since they (re)connected
+
+
+def resume_pending_transfers(printer_ip=None):
+    """Continue chunked printer uploads that were interrupted by a restart or a lost connection
+
+    Args:
+        printer_ip: Only resume the transfers to this printer (all if None)
+    """
+    for state in transfer_journal.pending():
+        if printer_ip and state.get('printer_ip') != printer_ip:
+            continue
+        filepath = state.get('filepath')
+        if not filepath or not os.path.exists(filepath) or os.path.getsize(filepath) != state.get('total_size'):
+            logger.warning(f"Dropping interrupted upload of '{state.get('filename')}': local file is gone or changed")
+            transfer_journal.remove(state['key'])
+            continue
+
+        logger.info(f"Resuming interrupted upload of '{state['filename']}' to {state['printer_ip']}")
+        with transfer_scheduler.slot(state['printer_ip']):
+            if not transfer_journal.get(state['key']):
+                continue  # Finished by another attempt while this one waited
+            upload_id = f"resume_{uuid.uuid4().hex[:8]}"
+            if not upload_file_to_printer(state['printer_ip'], filepath, upload_id, 'local', md5=state['md5']):
+                logger.warning(f"Interrupted upload of '{state['filename']}' could not be resumed yet")
+            progress_bus.discard(upload_id)
+
+
+def retry_transfers_on_contact(printer_id):
+    """Resume a printer's journalled transfers on its first status or attributes after (re)connecting"""
+    if printer_id in transfers_retried or printer_id not in printers:
+        return
+    transfers_retried.add(printer_id)
+    printer_ip = printers[printer_id]['ip']
+    if any(state.get('printer_ip') == printer_ip for state in transfer_journal.pending()):
+        Thread(target=resume_pending_transfers, args=(printer_ip,), daemon=True).start()
+
+
+def move_staged_uploads(paths):
+    """Move uploads that were staged when ChitUI stopped into the USB gadget"""
+    moved = []
+    with transfer_scheduler.slot(USB_GADGET_QUEUE):
+        for path in paths:
+            if not make_room_for_upload(os.path.getsize(path))['fits']:
+                logger.error(f"Staged upload {path} does not fit the USB gadget, keeping it")
+                continue
+            try:
+                target = upload_staging.move(path, USB_GADGET_FOLDER)
+                gadget_writes.written(target)
+                moved.append(os.path.basename(target))
+            except OSError as e:
+                logger.error(f"Could not move staged upload {path} into the USB gadget, keeping it: {e}")
+    if moved:
+        logger.info(f"Moved {len(moved)} staged upload(s) into the USB gadget: {', '.join(moved)}")
+        storage_usage.refresh()
+        gadget_reloads.request(f"staged uploads {', '.join(moved)}")
 
 
 # ============ SOCKETIO HANDLERS ============
@@ -2052,6 +2850,7 @@ def sio_handle_connect(auth):
     logger.info('Client connected')
     logger.info(f'Available printers: {list(printers.keys())}')
     socketio.emit('printers', printers)
+    socketio.emit('usb_gadget_storage', storage_usage.get(), to=request.sid)
 
 
 @socketio.on('disconnect')
@@ -2103,33 +2902,23 @@ def mount_usb_gadget():
         logger.info("Mounting USB gadget...")
 
         # Check if already mounted and if it's read-only
-        try:
-            check_result = subprocess.run(['mountpoint', '-q', '/mnt/usb_share'],
-                                        capture_output=True)
-            if check_result.returncode == 0:
-                # Already mounted - check if read-only
-                mount_info = subprocess.run(['mount'], capture_output=True, text=True)
-                for line in mount_info.stdout.split('\n'):
-                    if '/mnt/usb_share' in line:
-                        if 'ro,' in line or '(ro)' in line:
-                            logger.warning("USB gadget is mounted read-only, remounting as read-write...")
-                            # Remount as read-write
-                            result = subprocess.run(['mount', '-o', 'remount,rw', '/mnt/usb_share'],
-                                                  capture_output=True, text=True, timeout=5)
-                            if result.returncode == 0:
-                                logger.info("✓ USB gadget remounted as read-write")
-                                return True
-                            else:
-                                logger.error(f"Failed to remount as rw: {result.stderr}")
-                                # Try unmounting and mounting fresh
-                                logger.info("Trying full unmount/mount cycle...")
-                                unmount_usb_gadget()
-                                time.sleep(0.5)
-                        else:
-                            logger.info("USB gadget already mounted as read-write")
-                            return True
-        except Exception as e:
-            logger.debug(f"Mountpoint check error (continuing): {e}")
+        mount = mount_state.get('/mnt/usb_share')
+        if mount is not None:
+            if not mount.read_only:
+                logger.info("USB gadget already mounted as read-write")
+                return True
+            logger.warning("USB gadget is mounted read-only, remounting as read-write...")
+            # Remount as read-write
+            result = subprocess.run(['mount', '-o', 'remount,rw', '/mnt/usb_share'],
+                                  capture_output=True, text=True, timeout=5)
+            if result.returncode == 0:
+                logger.info("✓ USB gadget remounted as read-write")
+                return True
+            logger.error(f"Failed to remount as rw: {result.stderr}")
+            # Try unmounting and mounting fresh
+            logger.info("Trying full unmount/mount cycle...")
+            unmount_usb_gadget()
+            mount_state.wait('/mnt/usb_share', mounted=False, timeout=5)
 
         # Try mounting from fstab first
         result = subprocess.run(['mount', '/mnt/usb_share'],
@@ -2159,12 +2948,94 @@ def mount_usb_gadget():
         logger.error(f"Error mounting USB gadget: {e}")
         return False
 
+def remember_gadget_sequence(sequence):
+    """Persist the gadget reload sequence that works on this host"""
+    settings = load_settings()
+    settings['usb_gadget_sequence'] = sequence
+    save_settings(settings)
+
+
+# Files written into the gadget since the last reload/refresh; flushed instead of os.sync()
+gadget_writes = GadgetWrites(USB_GADGET_FOLDER if USB_GADGET_DIRECT else '/mnt/usb_share')
+# Reloads the gadget through sysfs/configfs when ChitUI may write there itself
+gadget_controller = GadgetController('/piusb.bin', USB_GADGET_FOLDER if USB_GADGET_DIRECT else '/mnt/usb_share',
+                                     sequence=load_settings().get('usb_gadget_sequence'),
+                                     on_sequence=remember_gadget_sequence, direct=USB_GADGET_DIRECT,
+                                     spare_image=USB_GADGET_SPARE_IMAGE, mounts=mount_state, writes=gadget_writes)
+# Storage usage of the drive the printer sees, recomputed when it changes and pushed to the browsers
+storage_usage = StorageUsage(lambda: gadget_storage_usage(USB_GADGET_FOLDER, gadget_controller.active_image,
+                                                          direct=USB_GADGET_DIRECT),
+                             emit=lambda usage: socketio.emit('usb_gadget_storage', usage, namespace='/'))
+
+
+def gadget_free_space():
+    """Free bytes on the USB gadget as the next upload finds it (None if unknown)"""
+    if USB_GADGET_DIRECT:
+        # The image only changes on reload: count what the folder will hold instead
+        usage = gadget_storage_usage(USB_GADGET_FOLDER, gadget_controller.active_image, direct=True)
+        if not usage.get('available'):
+            return None
+        in_folder = 0
+        for folder, dirs, files in os.walk(USB_GADGET_FOLDER):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            in_folder += sum(os.path.getsize(os.path.join(folder, name)) for name in files if not name.startswith('.'))
+        return usage['total'] - in_folder
+    if mount_state.get(USB_GADGET_FOLDER) is None:
+        return None
+    return shutil.disk_usage(USB_GADGET_FOLDER).free
+
+
+def evict_gadget_file(path):
+    """Remove a file from the USB gadget to make room (path relative to the gadget folder)"""
+    full_path = os.path.join(USB_GADGET_FOLDER, path)
+    os.remove(full_path)
+    gadget_writes.removed(full_path)
+    if USB_GADGET_DIRECT:
+        gadget_controller.remove(path)
+    file_catalog.forget('usb', path)
+
+
+def gadget_file_path(filename):
+    """Path in the USB gadget folder of a file a printer reports ('/usb/x.goo' or 'x.goo'), or None"""
+    if not filename or filename.startswith('/local/'):
+        return None
+    return filename[len('/usb/'):] if filename.startswith('/usb/') else filename.lstrip('/')
+
+
+def track_print_status(printer_id, status):
+    """Remember which file each printer is printing; a newly started print counts as use in the catalog"""
+    if 'CurrentStatus' not in status or printers.get(printer_id, {}).get('usb_device_type') != 'virtual':
+        return
+    printing = 1 in (status.get('CurrentStatus') or [])
+    path = gadget_file_path((status.get('PrintInfo') or {}).get('Filename')) if printing else None
+    if path == printing_files.get(printer_id):
+        return
+    if path:
+        printing_files[printer_id] = path
+        file_catalog.mark_printed('usb', path)
+    else:
+        printing_files.pop(printer_id, None)
+
+
+printing_files = {}  # MainboardID -> gadget path of the file it is printing
+# Frees space on the USB gadget for uploads (least recently printed/uploaded first)
+gadget_eviction = GadgetEviction(file_catalog, gadget_free_space, evict_gadget_file,
+                                 protected=lambda: set(printing_files.values()))
+
+
 def reload_usb_gadget():
     """Reload the USB gadget to reflect file changes on the printer"""
     try:
         logger.info("Reloading USB gadget to notify printer...")
 
-        # Use the reload script - it works when run manually so call it from Python
+        if gadget_controller.available():
+            return gadget_controller.reload()
+        if USB_GADGET_DIRECT:
+            # The script would mount the image over the folder
+            logger.error("USB_GADGET_DIRECT needs write access to the gadget's sysfs files (run as root)")
+            return False
+
+        # Without access to the gadget's sysfs files, use the reload script - it works when run manually so call it from Python
         script_path = os.path.join(os.path.dirname(__file__), 'scripts', 'reload_usb_gadget.sh')
         if os.path.exists(script_path):
             logger.info(f"Running reload script: {script_path}")
@@ -2215,14 +3086,13 @@ def delete_file_from_mount(file_path):
         # Delete the file
         os.remove(mount_path)
         logger.info(f"Deleted file from mount point: {mount_path}")
+        gadget_writes.removed(mount_path)
+        if USB_GADGET_DIRECT:
+            gadget_controller.remove(os.path.relpath(mount_path, '/mnt/usb_share'))
+        storage_usage.refresh()
 
-        # Reload the USB gadget so the printer sees the change
-        logger.info(">>> Starting USB gadget reload after delete...")
-        reload_result = reload_usb_gadget()
-        if reload_result:
-            logger.info("✓ USB gadget reload completed successfully")
-        else:
-            logger.warning("⚠ USB gadget reload returned False - printer may not detect change")
+        # Reload the USB gadget so the printer sees the change (batched with other deletes)
+        gadget_reloads.request(f"delete {os.path.basename(mount_path)}")
 
         return True
     except Exception as e:
@@ -2235,6 +3105,7 @@ def sio_handle_action_delete(data):
 
     printer_id = data['id']
     file_path = data['data']
+    file_index.forget(printer_id, file_path)
 
     # Get the printer's USB device type setting
     usb_device_type = 'physical'  # Default to physical
@@ -2257,8 +3128,7 @@ def sio_handle_action_delete(data):
                 'message': f'File deleted from virtual USB gadget: {os.path.basename(file_path)}',
                 'type': 'success'
             })
-            # Trigger page refresh after successful virtual USB delete
-            socketio.emit('refresh_page', {'reason': 'virtual_usb_delete'})
+            # The page is refreshed once the scheduled gadget reload has finished
         else:
             logger.error(f"✗ Failed to delete {file_path} from virtual USB gadget")
             socketio.emit('toast', {
@@ -2394,7 +3264,7 @@ def get_printer_files(id, url):
     send_printer_cmd(id, 258, {"Url": url})
 
 
-def send_printer_cmd(id, cmd, data={}):
+def send_printer_cmd(id, cmd, data={}, request_id=None):
     printer = printers.get(id)
     if not printer:
         logger.error(f"Printer {id} not found")
@@ -2410,7 +3280,7 @@ def send_printer_cmd(id, cmd, data={}):
         "Data": {
             "Cmd": cmd,
             "Data": data,
-            "RequestID": os.urandom(8).hex(),
+            "RequestID": request_id or os.urandom(8).hex(),
             "MainboardID": id,
             "TimeStamp": ts,
             "From": 0
@@ -2418,6 +3288,8 @@ def send_printer_cmd(id, cmd, data={}):
         "Topic": "sdcp/request/" + id
     }
     logger.debug("printer << \n{p}", p=json.dumps(payload, indent=4))
+    if cmd == 258 and request_id is None:
+        file_index.expect_listing(id, payload['Data']['RequestID'], data.get('Url', '/'))
     
     try:
         websockets[id].send(json.dumps(payload))
@@ -2496,6 +3368,7 @@ def connect_printers(printers_to_connect):
 def ws_connected_handler(printer_id):
     if printer_id in printers:
         printers[printer_id]['online'] = True
+        transfers_retried.discard(printer_id)
         logger.info("Connected to: {n}".format(n=printers[printer_id]['name']))
         socketio.emit('printers', printers)
 
@@ -2503,6 +3376,7 @@ def ws_connected_handler(printer_id):
 def ws_disconnected_handler(printer_id, status_code, message):
     if printer_id in printers:
         printers[printer_id]['online'] = False
+        transfers_retried.discard(printer_id)
         logger.info("Connection to '{n}' closed: {m} ({s})".format(
             n=printers[printer_id]['name'], m=message, s=status_code))
         socketio.emit('printers', printers)
@@ -2532,6 +3406,7 @@ def check_printer_connections():
                     logger.info(f"Printer '{printers[printer_id]['name']}' connection restored")
                 elif not is_connected and current_online:
                     printers[printer_id]['online'] = False
+                    transfers_retried.discard(printer_id)
                     changed = True
                     logger.info(f"Printer '{printers[printer_id]['name']}' connection lost")
 
@@ -2551,10 +3426,22 @@ def ws_msg_handler(ws, msg):
             plugin_manager.notify_printer_message(printer_id, data)
 
         if data['Topic'].startswith("sdcp/response/"):
+            response = data['Data']
+            if response.get('Cmd') == 258 and \
+                    file_index.observe_listing(response.get('MainboardID', printer_id), response.get('RequestID'),
+                                               response.get('Data', {}).get('FileList', [])):
+                # Listed to confirm an upload can be skipped, not for the web interface
+                return
             socketio.emit('printer_response', data)
         elif data['Topic'].startswith("sdcp/status/"):
+            if printer_id and isinstance(data.get('Status'), dict):
+                track_print_status(printer_id, data['Status'])
+                retry_transfers_on_contact(printer_id)
             socketio.emit('printer_status', data)
         elif data['Topic'].startswith("sdcp/attributes/"):
+            if printer_id and isinstance(data.get('Attributes'), dict):
+                printer_attributes[printer_id] = data['Attributes']
+                retry_transfers_on_contact(printer_id)
             socketio.emit('printer_attributes', data)
         elif data['Topic'].startswith("sdcp/error/"):
             socketio.emit('printer_error', data)
@@ -2609,7 +3496,11 @@ def main():
 
     # Mount USB gadget if enabled
     global USE_USB_GADGET, UPLOAD_FOLDER
-    if ENABLE_USB_GADGET and os.path.exists(USB_GADGET_FOLDER):
+    mount_state.watch()
+    file_catalog.start()
+    if ENABLE_USB_GADGET and USB_GADGET_DIRECT:
+        logger.info(f"USB gadget in direct mode: {USB_GADGET_FOLDER} is written into /piusb.bin on reload")
+    elif ENABLE_USB_GADGET and os.path.exists(USB_GADGET_FOLDER):
         logger.info("Mounting USB gadget on startup...")
         if mount_usb_gadget():
             logger.info("✓ USB gadget mounted successfully")
@@ -2632,9 +3523,11 @@ def main():
 
     settings = load_settings()
 
+    set_bandwidth_limit(UPLOAD_BANDWIDTH_LIMIT * 1048576)
+
     # Load plugins
     logger.info("Loading plugins...")
-    plugin_manager.load_all_plugins(app, socketio, printers=printers, send_printer_cmd=send_printer_cmd)
+    plugin_manager.load_all_plugins(app, socketio, **plugin_services())
 
     if settings.get("auto_discover", True):
         logger.info("Starting with auto-discovery enabled")
@@ -2647,6 +3540,15 @@ def main():
 
     load_saved_printers()
 
+    # Continue uploads that were cut short by the last shutdown
+    if transfer_journal.pending():
+        Thread(target=resume_pending_transfers, daemon=True).start()
+    staged = upload_staging.leftovers()
+    if staged and os.access(USB_GADGET_FOLDER, os.W_OK):
+        Thread(target=move_staged_uploads, args=(staged,), daemon=True).start()
+    elif staged:
+        logger.warning(f"{len(staged)} staged upload(s) kept until the USB gadget is writable again")
+
     # Start background connection health checker
     logger.info("Starting printer connection health monitor...")
     Thread(target=check_printer_connections, daemon=True).start()
@@ -10,7 +10,20 @@ Provides complete file management functionality including:
 """
 
 from plugins.base import ChitUIPlugin
+from core import save_upload, parse_print_file_header, read_print_file_header, HEADER_CAPTURE_SIZE
+from core.printer_upload import upload_file_chunked, upload_file_to_many, relay_upload, MD5_PATTERN
+from core.chunk_tuning import AdaptiveChunkSizer, PART_SIZE
+from core.printer_upload import PART_TIMEOUT
+from core.transfer_strategy import USB_TIMEOUT
+from core.transfer_scheduler import USB_GADGET_QUEUE
+from core.file_index import printer_path
+from core.print_compat import check_print_file, check_machine_name, IncompatiblePrintFile
+from core.resumable_upload import (UploadBusy, UploadOffsetMismatch, TUS_VERSION, parse_upload_metadata,
+                                   tus_response)
+from core.printer_http import timed_post
+from core.multipart_stream import MultipartFileStream
 from flask import Blueprint, request, Response, jsonify
+from contextlib import nullcontext
 from werkzeug.utils import secure_filename
 from loguru import logger
 import os
@@ -19,10 +32,16 @@ import uuid
 import threading
 import time
 import subprocess
-import requests
 import json
 
 
+# Objects main.py passes to plugins that this plugin shares with it (see plugin_services() there)
+SHARED_SERVICES = ('login_required', 'transfer_journal', 'transfer_strategies', 'transfer_scheduler', 'upload_jobs',
+                   'file_index', 'progress_bus', 'resumable_uploads', 'printer_attributes', 'gadget_reloads',
+                   'gadget_controller', 'mount_state', 'storage_usage', 'file_catalog', 'upload_staging',
+                   'gadget_writes', 'gadget_eviction')
+
+
 class FileManagerPlugin(ChitUIPlugin):
     def __init__(self, plugin_dir):
         super().__init__(plugin_dir)
@@ -30,6 +49,10 @@ class FileManagerPlugin(ChitUIPlugin):
         self.socketio = None
         self.printers = None
         self.send_printer_cmd = None
+        self.transfer_journal = None
+        self.transfer_strategies = None
+        self.file_index = None
+        self.printer_attributes = {}
 
         # Upload configuration
         self.DATA_FOLDER = None
@@ -40,10 +63,20 @@ class FileManagerPlugin(ChitUIPlugin):
         self.USB_AUTO_REFRESH = False
         self.ENABLE_USB_GADGET = True
 
-        # Upload progress tracking (thread-safe)
-        self.uploadProgress = {}
-        self.uploadProgressLock = threading.Lock()
-        self.uploadLock = threading.Lock()
+        # Upload progress, published as 'upload_progress' events
+        self.progress_bus = None
+        self.resumable_uploads = None
+        self.transfer_scheduler = None
+        self.gadget_reloads = None
+        self.gadget_controller = None
+        self.mount_state = None
+        self.storage_usage = None
+        self.file_catalog = None
+        self.upload_staging = None
+        self.gadget_writes = None
+        self.gadget_eviction = None
+        self.upload_jobs = None
+        self.login_required = None
 
         logger.info("File Manager Plugin initialized")
 
@@ -75,12 +108,36 @@ class FileManagerPlugin(ChitUIPlugin):
         self.socketio = socketio
         self.printers = kwargs.get('printers', {})
         self.send_printer_cmd = kwargs.get('send_printer_cmd')
+        # Upload queues, jobs, progress, the USB gadget and its file catalog are main.py's: a
+        # second instance here would race it (e.g. two inotify threads on one catalog database)
+        missing = [name for name in SHARED_SERVICES if kwargs.get(name) is None]
+        if missing:
+            raise RuntimeError(f"File manager needs ChitUI's shared services, missing: {', '.join(missing)}")
+        self.login_required = kwargs['login_required']
+        self.transfer_journal = kwargs['transfer_journal']
+        self.transfer_strategies = kwargs['transfer_strategies']
+        self.transfer_scheduler = kwargs['transfer_scheduler']
+        self.upload_jobs = kwargs['upload_jobs']
+        self.file_index = kwargs['file_index']
+        self.progress_bus = kwargs['progress_bus']
+        self.resumable_uploads = kwargs['resumable_uploads']
+        self.printer_attributes = kwargs['printer_attributes']
+        self.gadget_reloads = kwargs['gadget_reloads']
+        self.gadget_controller = kwargs['gadget_controller']
+        self.mount_state = kwargs['mount_state']
+        self.storage_usage = kwargs['storage_usage']
+        self.file_catalog = kwargs['file_catalog']
+        self.upload_staging = kwargs['upload_staging']
+        self.gadget_writes = kwargs['gadget_writes']
+        self.gadget_eviction = kwargs['gadget_eviction']
 
         # Get configuration from environment or app config
         self.DATA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
         self.USB_GADGET_FOLDER = os.environ.get('USB_GADGET_PATH', '/mnt/usb_share')
         self.ENABLE_USB_GADGET = os.environ.get('ENABLE_USB_GADGET', 'true').lower() not in ['0', 'false', 'no', 'off']
         self.USB_AUTO_REFRESH = os.environ.get('USB_AUTO_REFRESH', 'false').lower() not in ['0', 'false', 'no', 'off']
+        self.USB_GADGET_DIRECT = os.environ.get('USB_GADGET_DIRECT', 'false').lower() not in ['0', 'false', 'no', 'off']
+        self.USB_GADGET_EVICTION = os.environ.get('USB_GADGET_EVICTION', 'false').lower() not in ['0', 'false', 'no', 'off']
 
         # Check if USB gadget is available and writable
         self._check_usb_gadget()
@@ -129,15 +186,22 @@ class FileManagerPlugin(ChitUIPlugin):
                       static_url_path='/static')
 
         @bp.route('/upload', methods=['GET', 'POST'])
+        @self.login_required
         def upload_file():
             if request.method == 'POST':
-                # Check if another upload is in progress
-                if not self.uploadLock.acquire(blocking=False):
-                    logger.warning("Upload already in progress")
-                    return Response('{"upload": "error", "msg": "Another upload is already in progress. Please wait."}',
-                                  status=429, mimetype="application/json")
-
-                try:
+                # Files written into the USB gadget must not race a gadget reload (staged files are moved by the job)
+                queue_key = self._upload_queue_key(request.args.get('printer'), request.args.get('destination'))
+                # Refuse an upload that cannot fit the USB gadget before the body is received
+                if queue_key == USB_GADGET_QUEUE and request.content_length:
+                    plan = self._check_gadget_space(request.content_length)
+                    if not plan['fits']:
+                        return self._no_space_response(plan)
+                    # Files are only removed by the job, once the upload is received and validated
+                    if plan['evict'] and not self._staging_folder_for(request):
+                        return self._no_space_response(plan, "Not enough space on the USB gadget, and no staging "
+                                                             "space to receive the upload before old files are removed.")
+                writes_gadget = queue_key == USB_GADGET_QUEUE and not self._staging_folder_for(request)
+                with self.transfer_scheduler.slot(queue_key) if writes_gadget else nullcontext():
                     if 'file' not in request.files:
                         logger.error("No 'file' parameter in request.")
                         return Response('{"upload": "error", "msg": "Malformed request - no file."}',
@@ -155,7 +219,6 @@ class FileManagerPlugin(ChitUIPlugin):
                         return Response('{"upload": "error", "msg": "Malformed request - no printer."}',
                                       status=400, mimetype="application/json")
 
-                    printer = self.printers[form_data['printer']]
                     if file and not self._allowed_file(file.filename):
                         logger.error("Invalid filetype.")
                         return Response('{"upload": "error", "msg": "Invalid filetype."}',
@@ -166,6 +229,17 @@ class FileManagerPlugin(ChitUIPlugin):
                     logger.info(f"Upload destination: {destination}")
                     logger.info(f"USB gadget mode: {'enabled' if self.USE_USB_GADGET else 'disabled'}")
 
+                    # Optional list of printers that all get the same file
+                    printer_ids = [pid for pid in form_data.get('printers', '').split(',') if pid]
+                    if any(pid not in self.printers for pid in printer_ids):
+                        logger.error(f"Unknown printer in upload targets: {printer_ids}")
+                        return Response('{"upload": "error", "msg": "Malformed request - unknown printer."}',
+                                      status=400, mimetype="application/json")
+                    if len(printer_ids) > 1 and destination != 'local':
+                        logger.error("Multi-printer upload to a destination other than local storage")
+                        return Response('{"upload": "error", "msg": "Sending to several printers is only supported for local storage."}',
+                                      status=400, mimetype="application/json")
+
                     # Generate unique upload ID for progress tracking
                     upload_id = form_data.get('upload_id', str(uuid.uuid4()))
                     filename = secure_filename(file.filename)
@@ -174,20 +248,13 @@ class FileManagerPlugin(ChitUIPlugin):
                     printer_id = form_data['printer']
                     usb_device_type = self.printers[printer_id].get('usb_device_type', 'physical')
 
-                    # For virtual USB gadget, always use /mnt/usb_share
-                    if destination == 'usb' and usb_device_type == 'virtual':
-                        upload_folder = self.USB_GADGET_FOLDER
-                        # Verify mount point is available and writable
-                        if not os.path.exists(upload_folder):
-                            logger.error(f"USB gadget folder not found: {upload_folder}")
-                            return Response('{"upload": "error", "msg": "USB mount point not found. Please mount USB gadget first."}',
-                                          status=500, mimetype="application/json")
-                        if not os.access(upload_folder, os.W_OK):
-                            logger.error(f"USB gadget folder not writable: {upload_folder}")
-                            return Response('{"upload": "error", "msg": "USB mount point not writable. Check permissions."}',
-                                          status=500, mimetype="application/json")
-                    else:
-                        upload_folder = self.UPLOAD_FOLDER
+                    upload_folder, folder_error = self._upload_destination_folder(printer_id, destination)
+                    if folder_error:
+                        return Response(json.dumps({"upload": "error", "msg": folder_error}),
+                                      status=500, mimetype="application/json")
+                    if self._upload_queue_key(printer_id, destination) == USB_GADGET_QUEUE \
+                            and self._staging_folder_for(request):
+                        upload_folder = self._staging_folder_for(request)
 
                     filepath = os.path.join(upload_folder, filename)
                     logger.info(f"Saving '{filename}' to {filepath} (upload_id: {upload_id})")
@@ -195,169 +262,331 @@ class FileManagerPlugin(ChitUIPlugin):
 
                     try:
                         # Initialize progress
-                        with self.uploadProgressLock:
-                            self.uploadProgress[upload_id] = 0
+                        self.progress_bus.update(upload_id, 0)
 
-                        # Save file with progress tracking
-                        file.save(filepath)
-                        logger.info(f"✓ File '{filename}' saved successfully!")
-
-                        # Check destination: if user selected USB and printer is configured for USB, process accordingly
-                        if destination == 'usb' and (self.USE_USB_GADGET or usb_device_type == 'virtual'):
-                            # File saved to USB gadget - update progress
-                            with self.uploadProgressLock:
-                                self.uploadProgress[upload_id] = 50
-                            self.socketio.emit('upload_progress', {'upload_id': upload_id, 'progress': 50}, namespace='/')
-
-                            logger.info("Destination: USB Gadget (Pi's virtual USB)")
-
-                            # For virtual USB gadget, unmount/mount/reload
-                            if usb_device_type == 'virtual':
-                                logger.info("Virtual USB gadget detected - performing unmount/mount/reload")
-                                with self.uploadProgressLock:
-                                    self.uploadProgress[upload_id] = 75
-                                self.socketio.emit('upload_progress', {'upload_id': upload_id, 'progress': 75}, namespace='/')
-
-                                self._reload_usb_gadget()
-                                refresh_success = True
-                            else:
-                                # Physical USB or auto-refresh disabled
-                                refresh_success = False
-                                if self.USB_AUTO_REFRESH:
-                                    logger.info("Triggering USB gadget refresh to notify printer...")
-                                    with self.uploadProgressLock:
-                                        self.uploadProgress[upload_id] = 75
-                                    self.socketio.emit('upload_progress', {'upload_id': upload_id, 'progress': 75}, namespace='/')
-                                    refresh_success = self._trigger_usb_gadget_refresh()
-
-                                    if refresh_success:
-                                        logger.info("Waiting for printer to detect new file...")
-                                        time.sleep(2)
-                                else:
-                                    logger.info("USB auto-refresh disabled (USB_AUTO_REFRESH=false)")
-                                    logger.info("💡 Manually refresh on printer or set USB_AUTO_REFRESH=true")
-
-                            # Set progress to 100%
-                            with self.uploadProgressLock:
-                                self.uploadProgress[upload_id] = 100
-                            self.socketio.emit('upload_progress', {'upload_id': upload_id, 'progress': 100}, namespace='/')
-
-                            logger.info("✓ Upload to USB gadget complete!")
-
-                            # Emit page refresh for virtual USB gadget
-                            if usb_device_type == 'virtual':
-                                self.socketio.emit('refresh_page', {'reason': 'virtual_usb_upload'})
-                                msg = "File saved to USB gadget. Page will refresh to show updated file list."
-                            elif self.USB_AUTO_REFRESH and refresh_success:
-                                msg = "File saved to USB gadget. Printer should detect it automatically."
-                            elif self.USB_AUTO_REFRESH and not refresh_success:
-                                msg = "File saved to USB gadget. Auto-refresh failed - manually refresh on printer."
-                                logger.warning("USB gadget refresh failed - manual intervention may be needed")
-                                logger.info("💡 To enable automatic refresh, run: sudo python3 main.py")
-                            else:
-                                msg = "File saved to USB gadget. Manually refresh on printer or reconnect USB to detect it."
-
-                            return Response(
-                                json.dumps({
-                                    "upload": "success",
-                                    "msg": msg,
-                                    "upload_id": upload_id,
-                                    "usb_gadget": True,
-                                    "filename": filename,
-                                    "refresh_triggered": refresh_success
-                                }),
-                                status=200,
-                                mimetype="application/json"
-                            )
+                        # Commit the streamed upload (hashed and header-captured on the way in)
+                        file_md5, header_bytes = save_upload(file, filepath, expect=self.file_catalog.expect)
+                        if header_bytes:
+                            metadata = parse_print_file_header(header_bytes, filename)
                         else:
-                            # Upload to printer via network (either local or usb storage on printer)
-                            logger.info(f"Uploading to printer '{printer['name']}' - {destination} storage...")
-                            success = self._upload_file_to_printer(printer['ip'], filepath, upload_id, destination)
-
-                            if success:
-                                # Emit page refresh for physical USB uploads
-                                if destination == 'usb':
-                                    self.socketio.emit('refresh_page', {'reason': 'physical_usb_upload'})
-
-                                return Response(
-                                    json.dumps({
-                                        "upload": "success",
-                                        "msg": "File uploaded to printer",
-                                        "upload_id": upload_id,
-                                        "usb_gadget": False,
-                                        "filename": filename
-                                    }),
-                                    status=200,
-                                    mimetype="application/json"
-                                )
-                            else:
-                                return Response(
-                                    json.dumps({
-                                        "upload": "error",
-                                        "msg": "Failed to upload to printer",
-                                        "upload_id": upload_id,
-                                        "usb_gadget": False
-                                    }),
-                                    status=500,
-                                    mimetype="application/json"
-                                )
-
+                            metadata = read_print_file_header(filepath)
+                        logger.info(f"✓ File '{filename}' saved successfully!")
                     except Exception as e:
                         logger.error(f"Upload failed: {e}")
                         return Response(f'{{"upload": "error", "msg": "Upload failed: {str(e)}", "upload_id": "{upload_id}"}}',
                                       status=500, mimetype="application/json")
-                finally:
-                    # Always release the lock
-                    self.uploadLock.release()
+
+                    # Refuse a file the printer would reject before transferring it
+                    problem, can_force = self._print_file_problem(printer_ids or [printer_id], metadata,
+                                                                  force=bool(form_data.get('force')))
+                    if problem:
+                        self._discard_upload(filepath)
+                        self.progress_bus.discard(upload_id)
+                        return self._incompatible_response(problem, upload_id, can_force)
+
+                return self._submit_upload_job(printer_id, printer_ids, filepath, filename, destination,
+                                               upload_id, file_md5, metadata)
             else:
                 return Response("u r doin it rong", status=405, mimetype='text/plain')
 
+        @bp.route('/upload/resumable', methods=['POST'])
+        @self.login_required
+        def create_resumable_upload():
+            """Start a resumable upload (tus creation)"""
+            try:
+                metadata = parse_upload_metadata(request.headers.get('Upload-Metadata'))
+            except ValueError as e:
+                logger.error(f"Resumable upload with malformed metadata: {e}")
+                return tus_response('{"upload": "error", "msg": "Malformed request - invalid Upload-Metadata."}',
+                                    status=400)
+            try:
+                size = int(request.headers.get('Upload-Length', ''))
+            except ValueError:
+                size = 0
+            if size <= 0:
+                return tus_response('{"upload": "error", "msg": "Malformed request - Upload-Length missing."}', status=400)
+
+            printer_id = metadata.get('printer', '')
+            if printer_id not in self.printers:
+                logger.error(f"Resumable upload for unknown printer '{printer_id}'")
+                return tus_response('{"upload": "error", "msg": "Malformed request - no printer."}', status=400)
+            filename = secure_filename(metadata.get('filename', ''))
+            if not filename or not self._allowed_file(filename):
+                logger.error("Invalid filetype.")
+                return tus_response('{"upload": "error", "msg": "Invalid filetype."}', status=400)
+            destination = metadata.get('destination') or ('usb' if self.USE_USB_GADGET else 'local')
+            printer_ids = [pid for pid in metadata.get('printers', '').split(',') if pid]
+            if any(pid not in self.printers for pid in printer_ids):
+                return tus_response('{"upload": "error", "msg": "Malformed request - unknown printer."}', status=400)
+            if len(printer_ids) > 1 and destination != 'local':
+                return tus_response('{"upload": "error", "msg": "Sending to several printers is only supported for local storage."}',
+                                    status=400)
+
+            metadata.update(filename=filename, destination=destination)
+            # Refuse an upload that cannot fit the USB gadget before any data is sent
+            if self._upload_queue_key(printer_id, destination) == USB_GADGET_QUEUE:
+                plan = self._check_gadget_space(size)
+                if not plan['fits']:
+                    response = self._no_space_response(plan)
+                    response.headers['Tus-Resumable'] = TUS_VERSION
+                    return response
+            state = self.resumable_uploads.create(size, metadata)
+            return tus_response(json.dumps({"upload": "created", "id": state['id']}), status=201,
+                                Location=f"{request.path}/{state['id']}", Upload_Offset=0)
+
+        @bp.route('/upload/resumable/<upload_key>', methods=['HEAD', 'PATCH', 'DELETE'])
+        @self.login_required
+        def resumable_upload(upload_key):
+            """Offset of a resumable upload (HEAD), append to it (PATCH) or cancel it (DELETE)"""
+            state = self.resumable_uploads.get(upload_key)
+            if state is None:
+                return tus_response(status=404)
+
+            if request.method == 'HEAD':
+                return tus_response(status=200, Upload_Offset=state['offset'], Upload_Length=state['size'])
+            if request.method == 'DELETE':
+                self.resumable_uploads.remove(upload_key)
+                return tus_response()
+
+            if request.mimetype != 'application/offset+octet-stream':
+                return tus_response(status=415)
+            try:
+                state = self.resumable_uploads.append(upload_key, int(request.headers.get('Upload-Offset', -1)),
+                                                      request.stream)
+            except UploadOffsetMismatch:
+                return tus_response(status=409, Upload_Offset=state['offset'])
+            except UploadBusy:
+                return tus_response(status=423)
+            except ValueError:
+                return tus_response(status=400)
+            except Exception as e:
+                logger.warning(f"Resumable upload {upload_key} interrupted: {e}")
+                # Cancelled or expired meanwhile: nothing to resume
+                state = self.resumable_uploads.get(upload_key)
+                if state is None:
+                    return tus_response('{"upload": "error", "msg": "Upload was cancelled or has expired."}',
+                                        status=410)
+                return tus_response(status=500, Upload_Offset=state['offset'])
+
+            if state['offset'] < state['size']:
+                return tus_response(Upload_Offset=state['offset'])
+
+            # Complete: move it to its destination and hand it to the same job as upload
+            metadata = state['metadata']
+            printer_id, filename, destination = metadata['printer'], metadata['filename'], metadata['destination']
+            printer_ids = [pid for pid in metadata.get('printers', '').split(',') if pid]
+            upload_id = metadata.get('upload_id') or str(uuid.uuid4())
+            file_metadata = read_print_file_header(self.resumable_uploads.part_path(upload_key))
+
+            problem, can_force = self._print_file_problem(printer_ids or [printer_id], file_metadata,
+                                                          force='force' in metadata)
+            if problem:
+                self.resumable_uploads.remove(upload_key)
+                response = self._incompatible_response(problem, upload_id, can_force)
+                response.headers['Tus-Resumable'] = TUS_VERSION
+                return response
+
+            queue_key = self._upload_queue_key(printer_id, destination)
+            # Already on the local disk: staged there without a copy into RAM
+            staged = self.upload_staging.folder_for(state['size'], ram=False) if queue_key == USB_GADGET_QUEUE else None
+            with self.transfer_scheduler.slot(queue_key) if queue_key == USB_GADGET_QUEUE and not staged else nullcontext():
+                upload_folder, folder_error = self._upload_destination_folder(printer_id, destination)
+                if folder_error:
+                    return tus_response(json.dumps({"upload": "error", "msg": folder_error}), status=500)
+                if queue_key == USB_GADGET_QUEUE and not staged:
+                    plan = self._make_room_for_upload(state['size'])
+                    if not plan['fits']:
+                        self.resumable_uploads.remove(upload_key)
+                        response = self._no_space_response(plan)
+                        response.headers['Tus-Resumable'] = TUS_VERSION
+                        return response
+                filepath = os.path.join(staged or upload_folder, filename)
+                self.progress_bus.update(upload_id, 0)
+                file_md5 = self.resumable_uploads.finish(upload_key, filepath, expect=self.file_catalog.expect)
+            logger.info(f"✓ File '{filename}' received through resumable upload {upload_key}")
+
+            response = self._submit_upload_job(printer_id, printer_ids, filepath, filename, destination,
+                                               upload_id, file_md5, file_metadata)
+            response.headers['Tus-Resumable'] = TUS_VERSION
+            response.headers['Upload-Offset'] = str(state['offset'])
+            return response
+
+        @bp.route('/upload/check', methods=['POST'])
+        def check_upload():
+            """Check a print file (its first bytes as the body) against its target printers"""
+            printer_ids = ([pid for pid in request.args.get('printers', '').split(',') if pid]
+                           or [request.args.get('printer', '')])
+            if any(pid not in self.printers for pid in printer_ids):
+                return jsonify({"success": False, "message": "Unknown printer"}), 400
+            metadata = parse_print_file_header(request.stream.read(HEADER_CAPTURE_SIZE),
+                                               request.args.get('filename', ''))
+            problem, can_force = self._print_file_problem(printer_ids, metadata)
+            return jsonify({"success": True, "compatible": problem is None, "can_force": can_force,
+                            "msg": f"File does not fit the printer - {problem}" if problem else None,
+                            "metadata": metadata})
+
+        @bp.route('/upload/lookup', methods=['GET'])
+        def lookup_upload():
+            """Check whether a printer already has a file before it is uploaded"""
+            printer_id = request.args.get('printer', '')
+            filename = secure_filename(request.args.get('filename', ''))
+            md5 = request.args.get('md5', '')
+            destination = request.args.get('destination', 'local')
+            if printer_id not in self.printers or not filename or not MD5_PATTERN.match(md5):
+                return jsonify({"success": False, "message": "printer, filename and md5 are required"}), 400
+            try:
+                size = int(request.args.get('size', 0)) or None
+            except ValueError:
+                size = None
+            present = self._printer_has_file(printer_id, destination, filename, md5, size)
+            return jsonify({"success": True, "present": present, "path": printer_path(destination, filename)})
+
+        @bp.route('/upload/jobs', methods=['GET'])
+        def list_upload_jobs():
+            """Recent upload jobs, newest first"""
+            return jsonify({"success": True, "jobs": self.upload_jobs.list()})
+
+        @bp.route('/upload/jobs/<job_id>', methods=['GET'])
+        def get_upload_job(job_id):
+            """State of one upload job, with its transfer progress while it runs"""
+            job = self.upload_jobs.get(job_id)
+            if job is None:
+                return jsonify({"success": False, "message": "Job not found"}), 404
+            job['progress'] = self.progress_bus.progress(job_id, 100 if job['state'] == 'succeeded' else 0)
+            job['transfer'] = self.progress_bus.get(job_id)
+            return jsonify({"success": True, "job": job})
+
+        @bp.route('/upload/relay', methods=['POST'])
+        @self.login_required
+        def upload_relay():
+            """Relay a browser upload straight to the printer's local storage
+
+            The browser sends the MD5 up front and the raw file as the body;
+            parts are forwarded to the printer as they arrive, nothing is
+            written locally. Query parameters: printer, filename, md5, size, upload_id
+            """
+            # Wait for our turn in the printer's queue (other printers are not blocked)
+            with self.transfer_scheduler.slot(self._upload_queue_key(request.args.get('printer'), 'local')):
+                printer_id = request.args.get('printer', '')
+                filename = secure_filename(request.args.get('filename', ''))
+                md5 = request.args.get('md5', '')
+                upload_id = request.args.get('upload_id', str(uuid.uuid4()))
+
+                if printer_id not in self.printers:
+                    logger.error(f"Relay upload for unknown printer '{printer_id}'")
+                    return Response('{"upload": "error", "msg": "Malformed request - no printer."}',
+                                  status=400, mimetype="application/json")
+                if not filename or not self._allowed_file(filename):
+                    logger.error("Invalid filetype.")
+                    return Response('{"upload": "error", "msg": "Invalid filetype."}',
+                                  status=400, mimetype="application/json")
+                if not MD5_PATTERN.match(md5):
+                    logger.error("Relay upload without a valid MD5")
+                    return Response('{"upload": "error", "msg": "Malformed request - missing MD5."}',
+                                  status=400, mimetype="application/json")
+                try:
+                    total_size = int(request.args.get('size', request.content_length or 0))
+                except ValueError:
+                    total_size = 0
+                if total_size <= 0 or (request.content_length is not None and request.content_length != total_size):
+                    logger.error(f"Relay upload size mismatch (size={total_size}, body={request.content_length})")
+                    return Response('{"upload": "error", "msg": "Malformed request - size mismatch."}',
+                                  status=400, mimetype="application/json")
+
+                printer = self.printers[printer_id]
+                self.progress_bus.update(upload_id, 0)
+
+                def on_progress(sent, total):
+                    self.progress_bus.update(upload_id, done=sent, total=total)
+
+                def check_header(head):
+                    # The first part holds the file header; nothing was sent to the printer yet
+                    problem, can_force = self._print_file_problem([printer_id], parse_print_file_header(head, filename),
+                                                                  force=bool(request.args.get('force')))
+                    if problem:
+                        raise IncompatiblePrintFile(problem, can_force)
+
+                try:
+                    success = relay_upload(request.stream, printer['ip'], filename, md5, total_size,
+                                           on_progress=on_progress,
+                                           check_header=check_header)
+                except IncompatiblePrintFile as e:
+                    self.progress_bus.discard(upload_id)
+                    return self._incompatible_response(str(e), upload_id, e.can_force)
+                if success and self.file_index:
+                    self.file_index.record(printer_id, printer_path('local', filename), md5, total_size)
+                if not success:
+                    self.progress_bus.update(upload_id, 0)
+                    return Response(
+                        json.dumps({
+                            "upload": "error",
+                            "msg": "Failed to relay file to printer",
+                            "upload_id": upload_id,
+                            "usb_gadget": False
+                        }),
+                        status=500,
+                        mimetype="application/json"
+                    )
+
+                return Response(
+                    json.dumps({
+                        "upload": "success",
+                        "msg": "File uploaded to printer",
+                        "upload_id": upload_id,
+                        "usb_gadget": False,
+                        "filename": filename
+                    }),
+                    status=200,
+                    mimetype="application/json"
+                )
+
         @bp.route('/usb-gadget/storage', methods=['GET'])
         def get_usb_gadget_storage():
-            """Get USB gadget storage information"""
+            """Get USB gadget storage information (cached; shared with main.py)"""
+            return jsonify(self.storage_usage.get())
+
+        @bp.route('/files/catalog', methods=['GET'])
+        def get_file_catalog():
+            """List the print files held locally (same query parameters as main.py)"""
             try:
-                import shutil
-
-                # Check if USB gadget is available
-                if not os.path.exists('/mnt/usb_share'):
-                    return jsonify({
-                        "success": False,
-                        "available": False,
-                        "message": "USB gadget mount point not found"
-                    })
-
-                # Get disk usage for /mnt/usb_share
-                stat = shutil.disk_usage('/mnt/usb_share')
-
-                # Also try to get the size of /piusb.bin for total capacity
-                total_bytes = stat.total
-                if os.path.exists('/piusb.bin'):
-                    bin_size = os.path.getsize('/piusb.bin')
-                    # Use bin file size if it's larger (more accurate)
-                    if bin_size > total_bytes:
-                        total_bytes = bin_size
-
-                used_bytes = stat.used
-                free_bytes = stat.free
-
-                # Calculate percentage used
-                percent_used = (used_bytes / total_bytes * 100) if total_bytes > 0 else 0
-
-                return jsonify({
-                    "success": True,
-                    "available": True,
-                    "total": total_bytes,
-                    "used": used_bytes,
-                    "free": free_bytes,
-                    "percent": round(percent_used, 1)
-                })
-            except Exception as e:
-                logger.error(f"Error getting USB gadget storage: {e}")
-                return jsonify({
-                    "success": False,
-                    "available": False,
-                    "message": str(e)
-                })
+                limit = int(request.args.get('limit', 0)) or None
+                offset = int(request.args.get('offset', 0))
+            except ValueError:
+                return jsonify({"success": False, "message": "Invalid limit or offset"}), 400
+            files, total = self.file_catalog.list(folder=request.args.get('folder') or None,
+                                                  search=request.args.get('search') or None,
+                                                  sort=request.args.get('sort', 'name'),
+                                                  descending=request.args.get('order') == 'desc',
+                                                  limit=limit, offset=offset)
+            return jsonify({"success": True, "files": files, "total": total})
+
+        @bp.route('/files/catalog/thumbnail', methods=['GET'])
+        def get_file_catalog_thumbnail():
+            """Preview image of a catalogued print file (query parameters: folder, path)"""
+            png = self.file_catalog.thumbnail(request.args.get('folder', ''), request.args.get('path', ''))
+            if png is None:
+                return jsonify({"success": False, "message": "No preview"}), 404
+            return Response(png, mimetype='image/png')
+
+        @bp.route('/files/catalog/pin', methods=['POST'])
+        @self.login_required
+        def pin_catalog_file():
+            """Keep a file on the USB gadget when space is freed (JSON: folder, path, pinned)"""
+            data = request.json or {}
+            folder, path = data.get('folder', 'usb'), data.get('path', '')
+            if not self.file_catalog.pin(folder, path, bool(data.get('pinned', True))):
+                return jsonify({"success": False, "message": "File not found"}), 404
+            return jsonify({"success": True, "file": self.file_catalog.get(folder, path)})
+
+        @bp.route('/usb-gadget/eviction', methods=['GET'])
+        @self.login_required
+        def preview_gadget_eviction():
+            """Dry run: files that would be removed from the USB gadget for an upload of ?size= bytes"""
+            try:
+                size = int(request.args.get('size', 0))
+            except ValueError:
+                return jsonify({"success": False, "message": "Invalid size"}), 400
+            return jsonify({"success": True, "enabled": self.USB_GADGET_EVICTION, **self.gadget_eviction.plan(size)})
 
         return bp
 
@@ -370,6 +599,8 @@ class FileManagerPlugin(ChitUIPlugin):
 
             printer_id = data['id']
             file_path = data['data']
+            if self.file_index:
+                self.file_index.forget(printer_id, file_path)
 
             # Check if this is a virtual USB gadget and file is on USB
             if printer_id in self.printers:
@@ -384,9 +615,8 @@ class FileManagerPlugin(ChitUIPlugin):
                     success = self._delete_file_from_mount(file_path)
 
                     if success:
+                        # The UI is refreshed once the scheduled gadget reload has finished
                         logger.info("✓ File deleted from mount point successfully")
-                        # Refresh the UI after delete
-                        socketio.emit('refresh_page', {'reason': 'file_deleted_from_usb'})
                     else:
                         logger.error("✗ Failed to delete file from mount point")
                     return
@@ -407,24 +637,359 @@ class FileManagerPlugin(ChitUIPlugin):
         return '.' in filename and \
                filename.rsplit('.', 1)[1].lower() in self.ALLOWED_EXTENSIONS
 
-    def _upload_file_to_printer(self, printer_ip, filepath, upload_id, destination='local'):
-        """Upload file to printer in chunks via HTTP API"""
-        part_size = 1048576  # 1MB chunks
+    def _process_upload(self, printer_id, printer_ids, filepath, filename, destination, upload_id, file_md5,
+                        metadata, held_queue=None):
+        """Finish an ingested upload: reload the USB gadget or send the file to the printer(s)
+
+        Runs as a background upload job. Returns (success, result) where
+        result is the JSON body the client receives when the job finishes.
+        """
+        printer = self.printers[printer_id]
+        usb_device_type = printer.get('usb_device_type', 'physical')
+
+        # Check destination: if user selected USB and printer is configured for USB, process accordingly
+        if destination == 'usb' and (self.USE_USB_GADGET or usb_device_type == 'virtual'):
+            # Staged upload: copy it into the gadget now that the job holds the gadget queue
+            if self.upload_staging.is_staged(filepath):
+                self.progress_bus.update(upload_id, 25)
+                # Old files are removed only now, with the upload received and validated
+                plan = self._make_room_for_upload(os.path.getsize(filepath))
+                if not plan['fits']:
+                    self._discard_upload(filepath)
+                    return False, {
+                        "upload": "error",
+                        "msg": self._no_space_message(plan),
+                        "no_space": True,
+                        "upload_id": upload_id,
+                        "usb_gadget": True,
+                        "filename": filename
+                    }
+                # Hashed on the way in: the catalog need not read it again
+                self.file_catalog.expect(os.path.join(self.USB_GADGET_FOLDER, os.path.basename(filepath)), file_md5,
+                                         os.path.getsize(filepath))
+                try:
+                    filepath = self.upload_staging.move(filepath, self.USB_GADGET_FOLDER)
+                except OSError as e:
+                    # The file stays in staging and is moved again on the next start
+                    logger.error(f"Could not move staged upload {filepath} into the USB gadget: {e}")
+                    return False, {
+                        "upload": "error",
+                        "msg": f"Could not write the file into the USB gadget ({e.strerror or e}); it is kept and retried on restart",
+                        "upload_id": upload_id,
+                        "usb_gadget": True,
+                        "filename": filename
+                    }
+            self.gadget_writes.written(filepath)
+
+            # File saved to USB gadget - update progress
+            self.progress_bus.update(upload_id, 50)
+
+            logger.info("Destination: USB Gadget (Pi's virtual USB)")
+
+            # For virtual USB gadget, unmount/mount/reload (batched with other changes, in the background)
+            reload = None
+            if usb_device_type == 'virtual':
+                logger.info("Virtual USB gadget detected - scheduling unmount/mount/reload")
+                reload = self.gadget_reloads.request(f"upload {filename}")
+                refresh_success = True
+            else:
+                # Physical USB or auto-refresh disabled
+                refresh_success = False
+                if self.USB_AUTO_REFRESH:
+                    logger.info("Triggering USB gadget refresh to notify printer...")
+                    self.progress_bus.update(upload_id, 75)
+                    refresh_success = self._trigger_usb_gadget_refresh()
+
+                    if refresh_success:
+                        logger.info("Waiting for printer to detect new file...")
+                        time.sleep(2)
+                else:
+                    logger.info("USB auto-refresh disabled (USB_AUTO_REFRESH=false)")
+                    logger.info("💡 Manually refresh on printer or set USB_AUTO_REFRESH=true")
+
+            # Set progress to 100%
+            self.progress_bus.update(upload_id, 100)
+
+            logger.info("✓ Upload to USB gadget complete!")
+            self.storage_usage.refresh()
+
+            # The file list is refreshed once the scheduled reload has finished
+            if usb_device_type == 'virtual':
+                msg = (f"File saved to USB gadget. The printer sees it after the USB reload "
+                       f"(starting in ~{reload['due_in']:.0f}s).")
+            elif self.USB_AUTO_REFRESH and refresh_success:
+                msg = "File saved to USB gadget. Printer should detect it automatically."
+            elif self.USB_AUTO_REFRESH and not refresh_success:
+                msg = "File saved to USB gadget. Auto-refresh failed - manually refresh on printer."
+                logger.warning("USB gadget refresh failed - manual intervention may be needed")
+                logger.info("💡 To enable automatic refresh, run: sudo python3 main.py")
+            else:
+                msg = "File saved to USB gadget. Manually refresh on printer or reconnect USB to detect it."
+
+            return True, {
+                "upload": "success",
+                "msg": msg,
+                "upload_id": upload_id,
+                "usb_gadget": True,
+                "filename": filename,
+                "refresh_triggered": refresh_success,
+                "reload": reload,
+                "metadata": metadata
+            }
+        elif len(printer_ids) > 1:
+            # Printers that already have this exact file are done without a transfer
+            size = os.path.getsize(filepath)
+            results = {pid: True for pid in
+                       self._printers_with_file(printer_ids, destination, filename, file_md5, size)}
+            pending = [pid for pid in printer_ids if pid not in results]
+
+            # Same file to the rest: hashed once, read once, sent concurrently
+            if pending:
+                sent = self._upload_file_to_printers(pending, filepath, upload_id,
+                                                     md5=file_md5, held_queue=held_queue)
+                for pid, ok in sent.items():
+                    if ok and self.file_index:
+                        self.file_index.record(pid, printer_path(destination, filename), file_md5, size)
+                results.update(sent)
+            else:
+                self._discard_upload(filepath)
+                self.progress_bus.update(upload_id, 100)
+            failed = [self.printers[pid]['name'] for pid, ok in results.items() if not ok]
+
+            return not failed, {
+                "upload": "error" if failed else "success",
+                "msg": f"Failed to upload to {', '.join(failed)}" if failed else f"File uploaded to {len(results)} printers",
+                "upload_id": upload_id,
+                "usb_gadget": False,
+                "filename": filename,
+                "printers": results,
+                "metadata": metadata
+            }
+        else:
+            size = os.path.getsize(filepath)
+            if self._printer_has_file(printer_id, destination, filename, file_md5, size):
+                self._discard_upload(filepath)
+                self.progress_bus.update(upload_id, 100)
+                return True, {
+                    "upload": "success",
+                    "msg": "Printer already has this file, transfer skipped",
+                    "upload_id": upload_id,
+                    "usb_gadget": False,
+                    "skipped": True,
+                    "filename": filename,
+                    "metadata": metadata
+                }
+
+            # Upload to printer via network (either local or usb storage on printer)
+            logger.info(f"Uploading to printer '{printer['name']}' - {destination} storage...")
+            success = self._upload_file_to_printer(printer['ip'], filepath, upload_id, destination, md5=file_md5)
+
+            if success:
+                if self.file_index:
+                    self.file_index.record(printer_id, printer_path(destination, filename), file_md5, size)
+                # Emit page refresh for physical USB uploads
+                if destination == 'usb':
+                    self.socketio.emit('refresh_page', {'reason': 'physical_usb_upload'})
+
+                return True, {
+                    "upload": "success",
+                    "msg": "File uploaded to printer",
+                    "upload_id": upload_id,
+                    "usb_gadget": False,
+                    "filename": filename,
+                    "metadata": metadata
+                }
+            else:
+                return False, {
+                    "upload": "error",
+                    "msg": "Failed to upload to printer",
+                    "upload_id": upload_id,
+                    "usb_gadget": False
+                }
+
+    def _check_gadget_space(self, size):
+        """Whether an upload of size bytes can go into the USB gadget, without removing anything"""
+        plan = self.gadget_eviction.plan(size)
+        if plan['evict'] and not self.USB_GADGET_EVICTION:
+            plan['evictable'], plan['fits'] = plan['fits'], False
+        return plan
+
+    def _make_room_for_upload(self, size):
+        """Evict old files from the USB gadget (if enabled); call with the gadget queue held, right before writing"""
+        plan = self.gadget_eviction.make_room(size, evict=self.USB_GADGET_EVICTION)
+        if plan['evicted']:
+            self.storage_usage.refresh()
+            self.gadget_reloads.request(f"evict {', '.join(plan['evicted'])}")
+        return plan
+
+    def _no_space_message(self, plan):
+        """Why an upload does not fit on the USB gadget"""
+        if plan.get('evictable'):
+            return (f"Not enough space on the USB gadget. Delete files or set USB_GADGET_EVICTION=true to remove "
+                    f"the {len(plan['evict'])} least recently used file(s) automatically.")
+        return "Not enough space on the USB gadget, even after removing all files that are not pinned."
+
+    def _no_space_response(self, plan, msg=None):
+        """507 answer for an upload that does not fit on the USB gadget"""
+        return Response(json.dumps({"upload": "error", "msg": msg or self._no_space_message(plan), "no_space": True,
+                                    "eviction": plan}),
+                        status=507, mimetype="application/json")
+
+    def _staging_folder_for(self, req):
+        """Staging folder for a USB gadget upload in this request (chosen once, shared with the ingest)"""
+        if 'chitui.staging' not in req.environ:
+            req.environ['chitui.staging'] = self.upload_staging.folder_for(req.content_length)
+        return req.environ['chitui.staging']
+
+    def _upload_destination_folder(self, printer_id, destination):
+        """Folder an upload is stored in before it goes to the printer
+
+        Returns:
+            tuple: (folder, error message or None)
+        """
+        usb_device_type = self.printers[printer_id].get('usb_device_type', 'physical')
+
+        # For virtual USB gadget, always use /mnt/usb_share
+        if destination == 'usb' and usb_device_type == 'virtual':
+            # Verify mount point is available and writable
+            if not os.path.exists(self.USB_GADGET_FOLDER):
+                logger.error(f"USB gadget folder not found: {self.USB_GADGET_FOLDER}")
+                return self.USB_GADGET_FOLDER, "USB mount point not found. Please mount USB gadget first."
+            if not os.access(self.USB_GADGET_FOLDER, os.W_OK):
+                logger.error(f"USB gadget folder not writable: {self.USB_GADGET_FOLDER}")
+                return self.USB_GADGET_FOLDER, "USB mount point not writable. Check permissions."
+            return self.USB_GADGET_FOLDER, None
+        return self.UPLOAD_FOLDER, None
+
+    def _print_file_problem(self, printer_ids, metadata, force=False):
+        """Why one of the printers would refuse a print file, and whether the user may send it anyway
+
+        A file type or resolution mismatch is always reported; a different
+        machine name only until the user insists (force).
+        """
+        for printer_id in printer_ids:
+            problem = check_print_file(metadata, self.printer_attributes.get(printer_id))
+            if problem:
+                logger.warning(f"Upload does not fit {self.printers[printer_id]['name']}: {problem}")
+                return f"{self.printers[printer_id]['name']}: {problem}", False
+        if not force:
+            for printer_id in printer_ids:
+                warning = check_machine_name(metadata, self.printer_attributes.get(printer_id),
+                                             self.printers[printer_id].get('model'))
+                if warning:
+                    logger.warning(f"Upload may not fit {self.printers[printer_id]['name']}: {warning}")
+                    return f"{self.printers[printer_id]['name']}: {warning}", True
+        return None, False
+
+    def _incompatible_response(self, problem, upload_id=None, can_force=False):
+        """422 answer for a print file that does not fit the target printer"""
+        return Response(json.dumps({
+            "upload": "error",
+            "msg": f"File does not fit the printer - {problem}",
+            "incompatible": True,
+            "can_force": can_force,
+            "upload_id": upload_id
+        }), status=422, mimetype="application/json")
+
+    def _submit_upload_job(self, printer_id, printer_ids, filepath, filename, destination, upload_id, file_md5,
+                           metadata):
+        """Queue the transfer of a received upload and answer the client with 202
+
+        The transfer (or USB gadget reload) runs as a background job in the
+        destination's queue; the client follows it through upload_job and
+        upload_progress events or GET upload/jobs/<upload_id>.
+        """
+        # A job for several printers waits for each target's queue in its fan-out only: holding
+        # one of them meanwhile deadlocks against a job whose targets cross its own
+        job_queue = None if len(printer_ids) > 1 else self._upload_queue_key(printer_id, destination)
+
+        job = self.upload_jobs.submit(
+            upload_id,
+            lambda: self._process_upload(printer_id, printer_ids, filepath, filename, destination,
+                                         upload_id, file_md5, metadata, held_queue=job_queue),
+            queue=self.transfer_scheduler.slot(job_queue) if job_queue else None,
+            filename=filename,
+            printers=printer_ids or [printer_id],
+            destination=destination,
+        )
+
+        return Response(
+            json.dumps({
+                "upload": "accepted",
+                "msg": "File received, transfer queued",
+                "upload_id": upload_id,
+                "job_id": upload_id,
+                "job": job,
+                "filename": filename,
+                "metadata": metadata
+            }),
+            status=202,
+            mimetype="application/json"
+        )
+
+    def _printers_with_file(self, printer_ids, destination, filename, md5, size):
+        """Printers that already hold this exact file (same path and content)
+
+        Checked against the shared file index and a fresh listing from each
+        printer, requested from all of them at once. SDCP has no copy or
+        rename command, so content stored under another name still has to
+        be transferred.
+        """
+        if not self.file_index:
+            return []
+        path = printer_path(destination, filename)
+        confirmed = self.file_index.confirm(
+            [(pid, path, md5, size) for pid in printer_ids],
+            lambda pid, directory, request_id: self.send_printer_cmd(pid, 258, {"Url": directory},
+                                                                     request_id=request_id))
+        present = [pid for pid, _, _, _ in confirmed]
+        for pid in present:
+            logger.info(f"'{path}' is already on {self.printers[pid]['name']}, skipping transfer")
+        return present
+
+    def _printer_has_file(self, printer_id, destination, filename, md5, size):
+        """True if the printer already holds this exact file (see _printers_with_file)"""
+        return bool(self._printers_with_file([printer_id], destination, filename, md5, size))
+
+    def _discard_upload(self, filepath):
+        """Remove an ingested upload that no longer needs to be sent"""
+        try:
+            os.remove(filepath)
+            logger.debug(f"Temporary file {filepath} removed")
+        except OSError as e:
+            logger.warning(f"Could not remove temporary file {filepath}: {e}")
+
+    def _upload_queue_key(self, printer_id, destination=None):
+        """Transfer queue an upload waits in: its printer, or the shared USB gadget"""
+        printer = self.printers.get(printer_id or '')
+        if printer is None:
+            return None
+        destination = destination or ('usb' if self.USE_USB_GADGET else 'local')
+        if destination == 'usb' and (self.USE_USB_GADGET or printer.get('usb_device_type') == 'virtual'):
+            return USB_GADGET_QUEUE
+        return printer['ip']
+
+    def _upload_file_to_printer(self, printer_ip, filepath, upload_id, destination='local', md5=None):
+        """Upload file to printer in chunks via HTTP API
+
+        md5 is passed in when it was already computed during ingest.
+        """
         filename = os.path.basename(filepath)
 
         # Initialize progress for this upload
-        with self.uploadProgressLock:
-            self.uploadProgress[upload_id] = 0
+        self.progress_bus.update(upload_id, 0)
 
-        # Calculate MD5 hash
-        md5_hash = hashlib.md5()
-        with open(filepath, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                md5_hash.update(byte_block)
+        # Calculate MD5 hash (unless it was computed while the upload streamed in)
+        if md5 is None:
+            md5_hash = hashlib.md5()
+            with open(filepath, "rb") as f:
+                for byte_block in iter(lambda: f.read(1048576), b""):
+                    md5_hash.update(byte_block)
+            md5 = md5_hash.hexdigest()
 
         file_stats = os.stat(filepath)
         post_data = {
-            'S-File-MD5': md5_hash.hexdigest(),
+            'S-File-MD5': md5,
             'Check': 1,
             'Offset': 0,
             'Uuid': uuid.uuid4(),
@@ -440,37 +1005,42 @@ class FileManagerPlugin(ChitUIPlugin):
             logger.info(f"Uploading complete file to USB storage (size: {file_stats.st_size} bytes)...")
 
             # Update progress to 30% (upload starting)
-            with self.uploadProgressLock:
-                self.uploadProgress[upload_id] = 30
-
-            # Read entire file
-            with open(filepath, 'rb') as f:
-                file_content = f.read()
+            self.progress_bus.update(upload_id, 30)
 
             # Try different upload methods for USB
             upload_methods = [
                 {
                     'name': 'USB complete upload',
                     'post_data': post_data,
-                    'files': {'file': (filename, file_content, 'application/octet-stream')}
+                    'file_field': 'file',
+                    'filename': filename
                 }
             ]
 
+            # Start with the method that worked for this model/firmware before
+            model, firmware = self._printer_identity(printer_ip)
+            timeout = USB_TIMEOUT
+            if self.transfer_strategies:
+                upload_methods = self.transfer_strategies.order_methods(model, firmware, upload_methods)
+                timeout = self.transfer_strategies.usb_timeout(model, firmware, file_stats.st_size)
+
             # Update progress to 40%
-            with self.uploadProgressLock:
-                self.uploadProgress[upload_id] = 40
+            self.progress_bus.update(upload_id, 40)
+
+            def on_usb_progress(sent, total):
+                # Map the bytes sent so far to 40-95%
+                self.progress_bus.update(upload_id, 40 + int(sent * 55 / total) if total else 95, done=sent, total=total)
 
             for method in upload_methods:
                 logger.info(f"Trying method: {method['name']}")
 
-                post_files = method['files']
-
                 try:
-                    # Update progress to 60%
-                    with self.uploadProgressLock:
-                        self.uploadProgress[upload_id] = 60
-
-                    response = requests.post(url, data=method['post_data'], files=post_files, timeout=120)
+                    # Stream the file from disk instead of building the body in memory
+                    with MultipartFileStream(method['post_data'], method['file_field'], method['filename'], filepath,
+                                             on_progress=on_usb_progress) as body:
+                        stats = {}
+                        response = timed_post(url, stats=stats, data=body,
+                                              headers={'Content-Type': body.content_type}, timeout=timeout)
 
                     logger.info(f"Response status: {response.status_code}")
                     logger.info(f"Response headers: {response.headers}")
@@ -484,9 +1054,9 @@ class FileManagerPlugin(ChitUIPlugin):
                             # No JSON body but 200 status = success
                             if response.status_code == 200:
                                 logger.info(f"✓ Upload successful (HTTP 200, non-JSON response)")
-                                with self.uploadProgressLock:
-                                    self.uploadProgress[upload_id] = 100
+                                self.progress_bus.update(upload_id, 100)
                                 logger.info(f"✓ Method '{method['name']}' worked! Saving for future uploads.")
+                                self._remember_usb_method(model, firmware, method, stats)
                                 return True
                     else:
                         status = {}
@@ -494,9 +1064,9 @@ class FileManagerPlugin(ChitUIPlugin):
                     # Check for success
                     if status.get('success') or status.get('status') == 'success':
                         logger.info(f"✓ Upload successful!")
-                        with self.uploadProgressLock:
-                            self.uploadProgress[upload_id] = 100
+                        self.progress_bus.update(upload_id, 100)
                         logger.info(f"✓ Method '{method['name']}' worked! Saving for future uploads.")
+                        self._remember_usb_method(model, firmware, method, stats)
                         return True
                     else:
                         logger.warning(f"Method failed: {status}")
@@ -510,64 +1080,112 @@ class FileManagerPlugin(ChitUIPlugin):
             logger.error("  1. Printer has a USB drive inserted")
             logger.error("  2. USB drive is formatted as FAT32 or exFAT")
             logger.error("  3. Printer firmware supports network uploads to USB")
-            with self.uploadProgressLock:
-                self.uploadProgress[upload_id] = 0
+            self.progress_bus.update(upload_id, 0)
             return False
 
         # Local storage: chunked upload
         else:
             logger.info(f"Upload destination: Local storage")
-            logger.info(f"Uploading file in {part_size} byte chunks...")
-
-            with open(filepath, 'rb') as file:
-                offset = 0
-                while True:
-                    chunk = file.read(part_size)
-                    if not chunk:
-                        break
 
-                    # Update progress (thread-safe)
-                    progress_value = min(int((offset / file_stats.st_size) * 90), 90)
-                    with self.uploadProgressLock:
-                        self.uploadProgress[upload_id] = progress_value
+            def on_progress(sent, total):
+                progress_value = min(int((sent / total) * 90), 90) if total > 0 else 90
+                self.progress_bus.update(upload_id, progress_value, done=sent, total=total)
 
-                    # Emit progress via WebSocket (bypasses SSE buffering issues)
-                    self.socketio.emit('upload_progress', {
-                        'upload_id': upload_id,
-                        'progress': progress_value
-                    }, namespace='/')
+            if not self._send_file_chunked(printer_ip, filepath, md5, on_progress):
+                logger.error("Uploading file to printer failed.")
+                # Set progress to 0 to indicate failure
+                self.progress_bus.update(upload_id, 0)
+                return False
 
-                    post_data['Offset'] = offset
-                    post_files = {'file': (filename, chunk, 'application/octet-stream')}
+            self.progress_bus.update(upload_id, 100)
 
-                    try:
-                        response = requests.post(url, data=post_data, files=post_files, timeout=60)
-                        status = response.json()
-                        if not (status.get('success') or status.get('status') == 'success'):
-                            logger.error(f"Chunk upload failed at offset {offset}: {status}")
-                            logger.error("Uploading file to printer failed.")
-                            # Set progress to 0 to indicate failure
-                            with self.uploadProgressLock:
-                                self.uploadProgress[upload_id] = 0
-                            return False
-                    except Exception as e:
-                        logger.error(f"Error during chunk upload: {e}")
-                        return False
-
-                    offset += len(chunk)
+            logger.info("✓ File uploaded successfully!")
+            return True
 
-            # Set progress to 100% (thread-safe)
-            with self.uploadProgressLock:
-                self.uploadProgress[upload_id] = 100
+    def _printer_identity(self, printer_ip):
+        """Model and firmware version of the printer at printer_ip"""
+        printer = next((p for p in self.printers.values() if p.get('ip') == printer_ip), {})
+        return printer.get('model'), printer.get('firmware')
+
+    def _remember_usb_method(self, model, firmware, method, stats):
+        """Store the USB upload method that worked and the speed it reached"""
+        if self.transfer_strategies:
+            self.transfer_strategies.remember(model, firmware, usb_method=method['name'],
+                                              usb_throughput=round(stats.get('throughput', 0)))
+
+    def _send_file_chunked(self, printer_ip, filepath, md5, on_progress, data=None):
+        """Chunked transfer of a local file to a printer's local storage
+
+        Parts are retried with backoff and interrupted transfers resume from
+        the journal; the part size adapts to the measured throughput,
+        starting from the best size found for this printer model and
+        firmware so far. data optionally holds the file content (a shared mmap).
+        """
+        model, firmware = self._printer_identity(printer_ip)
+        initial, part_timeout = PART_SIZE, PART_TIMEOUT
+        if self.transfer_strategies:
+            initial = self.transfer_strategies.part_size(model, firmware)
+            part_timeout = self.transfer_strategies.part_timeout(model, firmware)
+        sizer = AdaptiveChunkSizer(initial)
+        logger.info(f"Uploading file to {printer_ip} in {sizer.size} byte chunks (adaptive)...")
+
+        if not upload_file_chunked(printer_ip, filepath, md5, on_progress=on_progress, journal=self.transfer_journal,
+                                   sizer=sizer, data=data, part_timeout=part_timeout):
+            return False
 
-            # Emit 100% via WebSocket
-            self.socketio.emit('upload_progress', {
-                'upload_id': upload_id,
-                'progress': 100
-            }, namespace='/')
+        if self.transfer_strategies:
+            self.transfer_strategies.remember(model, firmware, part_size=sizer.best_size,
+                                              slowest_part=round(sizer.slowest, 1))
+        return True
+
+    def _upload_file_to_printers(self, printer_ids, filepath, upload_id, md5=None, held_queue=None):
+        """Send one file to the local storage of several printers at once
+
+        The file is hashed once and memory-mapped once; every printer is fed
+        concurrently from the same mapping, each in its own printer queue.
+        Returns a dict of printer ID -> success.
+        """
+        if md5 is None:
+            md5_hash = hashlib.md5()
+            with open(filepath, "rb") as f:
+                for byte_block in iter(lambda: f.read(1048576), b""):
+                    md5_hash.update(byte_block)
+            md5 = md5_hash.hexdigest()
+
+        progress = {printer_id: 0 for printer_id in printer_ids}
+        sent_bytes = {printer_id: 0 for printer_id in printer_ids}
+        progress_lock = threading.Lock()
+        total_bytes = os.path.getsize(filepath) * len(printer_ids)
+        self.progress_bus.update(upload_id, 0)
+
+        def send(printer_id, data):
+            printer_ip = self.printers[printer_id]['ip']
+
+            def on_progress(sent, total):
+                with progress_lock:
+                    progress[printer_id] = round(sent / total * 100) if total > 0 else 100
+                    sent_bytes[printer_id] = sent
+                    overall = round(sum(progress.values()) / len(progress))
+                    done = sum(sent_bytes.values())
+                    per_printer = dict(progress)
+                self.progress_bus.update(upload_id, overall, done=done, total=total_bytes, printers=per_printer)
+
+            queue = nullcontext() if printer_ip == held_queue else self.transfer_scheduler.slot(printer_ip)
+            with queue:
+                return self._send_file_chunked(printer_ip, filepath, md5, on_progress, data=data)
+
+        logger.info(f"Sending '{os.path.basename(filepath)}' to {len(printer_ids)} printers...")
+        results = upload_file_to_many(filepath, printer_ids, send)
+
+        failed = [printer_id for printer_id, ok in results.items() if not ok]
+        if failed:
+            logger.error(f"Upload failed for printer(s): {', '.join(failed)}")
+        else:
+            logger.info(f"✓ File uploaded to {len(printer_ids)} printers!")
 
-            logger.info("✓ File uploaded successfully!")
-            return True
+        self.progress_bus.update(upload_id, 0 if failed else 100,
+                                 printers={printer_id: 100 if ok else 0 for printer_id, ok in results.items()})
+        return results
 
     def _trigger_usb_gadget_refresh(self):
         """Trigger USB gadget to refresh/reconnect so printer detects new/changed files"""
@@ -576,9 +1194,9 @@ class FileManagerPlugin(ChitUIPlugin):
             return False
 
         try:
-            # Method 1: Ensure all data is written to disk
-            os.sync()
-            logger.debug("Synced filesystem")
+            # Method 1: Ensure the gadget's data is written to the image (not every file system on the Pi)
+            flushed = self.gadget_writes.flush(volume=not self.USB_GADGET_DIRECT)
+            logger.debug(f"Flushed USB gadget in {flushed['seconds'] * 1000:.1f} ms")
 
             # Method 2: Try to find and use configfs UDC paths
             configfs_gadget_dirs = []
@@ -687,33 +1305,23 @@ class FileManagerPlugin(ChitUIPlugin):
             logger.info("Mounting USB gadget...")
 
             # Check if already mounted and if it's read-only
-            try:
-                check_result = subprocess.run(['mountpoint', '-q', '/mnt/usb_share'],
-                                            capture_output=True)
-                if check_result.returncode == 0:
-                    # Already mounted - check if read-only
-                    mount_info = subprocess.run(['mount'], capture_output=True, text=True)
-                    for line in mount_info.stdout.split('\n'):
-                        if '/mnt/usb_share' in line:
-                            if 'ro,' in line or '(ro)' in line:
-                                logger.warning("USB gadget is mounted read-only, remounting as read-write...")
-                                # Remount as read-write
-                                result = subprocess.run(['mount', '-o', 'remount,rw', '/mnt/usb_share'],
-                                                      capture_output=True, text=True, timeout=5)
-                                if result.returncode == 0:
-                                    logger.info("✓ USB gadget remounted as read-write")
-                                    return True
-                                else:
-                                    logger.error(f"Failed to remount as rw: {result.stderr}")
-                                    # Try unmounting and mounting fresh
-                                    logger.info("Trying full unmount/mount cycle...")
-                                    self._unmount_usb_gadget()
-                                    time.sleep(0.5)
-                            else:
-                                logger.info("USB gadget already mounted as read-write")
-                                return True
-            except Exception as e:
-                logger.debug(f"Mountpoint check error (continuing): {e}")
+            mount = self.mount_state.get('/mnt/usb_share')
+            if mount is not None:
+                if not mount.read_only:
+                    logger.info("USB gadget already mounted as read-write")
+                    return True
+                logger.warning("USB gadget is mounted read-only, remounting as read-write...")
+                # Remount as read-write
+                result = subprocess.run(['mount', '-o', 'remount,rw', '/mnt/usb_share'],
+                                      capture_output=True, text=True, timeout=5)
+                if result.returncode == 0:
+                    logger.info("✓ USB gadget remounted as read-write")
+                    return True
+                logger.error(f"Failed to remount as rw: {result.stderr}")
+                # Try unmounting and mounting fresh
+                logger.info("Trying full unmount/mount cycle...")
+                self._unmount_usb_gadget()
+                self.mount_state.wait('/mnt/usb_share', mounted=False, timeout=5)
 
             # Try mounting from fstab first
             result = subprocess.run(['mount', '/mnt/usb_share'],
@@ -743,43 +1351,6 @@ class FileManagerPlugin(ChitUIPlugin):
             logger.error(f"Error mounting USB gadget: {e}")
             return False
 
-    def _reload_usb_gadget(self):
-        """Reload the USB gadget to reflect file changes on the printer"""
-        try:
-            logger.info("Reloading USB gadget to notify printer...")
-
-            # Use the reload script - it works when run manually so call it from Python
-            script_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'scripts', 'reload_usb_gadget.sh')
-            if os.path.exists(script_path):
-                logger.info(f"Running reload script: {script_path}")
-                result = subprocess.run(['sudo', 'bash', script_path],
-                                      capture_output=True, text=True, timeout=30)
-
-                # Log script output
-                if result.stdout:
-                    for line in result.stdout.strip().split('\n'):
-                        logger.info(f"  SCRIPT: {line}")
-                if result.stderr:
-                    for line in result.stderr.strip().split('\n'):
-                        logger.warning(f"  SCRIPT ERR: {line}")
-
-                if result.returncode == 0:
-                    logger.info("✓ USB gadget reload complete!")
-                    return True
-                else:
-                    logger.error(f"✗ Reload script failed (exit code {result.returncode})")
-                    return False
-
-            logger.error(f"Reload script not found at {script_path}")
-            return False
-
-        except subprocess.TimeoutExpired:
-            logger.error("USB gadget reload timed out")
-            return False
-        except Exception as e:
-            logger.error(f"Error reloading USB gadget: {e}")
-            return False
-
     def _delete_file_from_mount(self, file_path):
         """Delete a file directly from the USB gadget mount point"""
         try:
@@ -799,14 +1370,13 @@ class FileManagerPlugin(ChitUIPlugin):
             # Delete the file
             os.remove(mount_path)
             logger.info(f"Deleted file from mount point: {mount_path}")
+            self.gadget_writes.removed(mount_path)
+            if self.USB_GADGET_DIRECT:
+                self.gadget_controller.remove(os.path.relpath(mount_path, '/mnt/usb_share'))
+            self.storage_usage.refresh()
 
-            # Reload the USB gadget so the printer sees the change
-            logger.info(">>> Starting USB gadget reload after delete...")
-            reload_result = self._reload_usb_gadget()
-            if reload_result:
-                logger.info("✓ USB gadget reload completed successfully")
-            else:
-                logger.warning("⚠ USB gadget reload returned False - printer may not detect change")
+            # Reload the USB gadget so the printer sees the change (batched with other deletes)
+            self.gadget_reloads.request(f"delete {os.path.basename(mount_path)}")
 
             return True
         except Exception as e:
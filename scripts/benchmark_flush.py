@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+USB gadget flush benchmark
+
+Compares the two ways of getting an upload onto the printer's virtual USB
+drive before a gadget reload: os.sync(), which flushes every file system on
+the Pi, and GadgetWrites.flush(), which fsyncs only the files ChitUI wrote
+and then syncs the gadget's volume. Each run writes a file into the
+mounted vfat image (/mnt/usb_share on /piusb.bin), flushes it and times the
+flush - once with the SD card idle and once while background writers keep
+it busy, which is when os.sync() has to wait for unrelated data too.
+
+Run it on the Pi with the gadget image mounted (as the ChitUI user); the
+files it writes into the gadget folder and the load directory are removed
+afterwards.
+
+Usage:
+    python3 scripts/benchmark_flush.py [--folder /mnt/usb_share] [--size-mb 20]
+                                       [--runs 7] [--load-dir data] [--writers 2]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+from loguru import logger
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.gadget_sync import GadgetWrites  # noqa: E402
+from core.mount_state import MountState  # noqa: E402
+
+
+LOAD_BLOCK = 4 * 1048576
+LOAD_FILE_BLOCKS = 16   # 64 MB per background file
+
+
+class DiskLoad:
+    """Background writers that keep dirty data queued on the SD card"""
+
+    def __init__(self, folder, writers):
+        self.folder = folder
+        self.writers = writers
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _write(self, number):
+        block = os.urandom(LOAD_BLOCK)
+        path = os.path.join(self.folder, f'.flush_benchmark_load{number}')
+        while not self._stop.is_set():
+            with open(path, 'wb') as f:
+                for _ in range(LOAD_FILE_BLOCKS):
+                    if self._stop.is_set():
+                        break
+                    f.write(block)
+
+    def __enter__(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self._threads = [threading.Thread(target=self._write, args=(number,), daemon=True)
+                         for number in range(self.writers)]
+        for thread in self._threads:
+            thread.start()
+        time.sleep(1)   # Let dirty pages build up
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        for number in range(self.writers):
+            try:
+                os.remove(os.path.join(self.folder, f'.flush_benchmark_load{number}'))
+            except OSError:
+                pass
+
+
+def run(folder, mode, size, runs):
+    """Median and maximum flush time in ms of runs uploads of size bytes"""
+    writes = GadgetWrites(folder)
+    data = os.urandom(size)
+    times = []
+    for number in range(runs):
+        path = os.path.join(folder, f'flush_benchmark{number}.goo')
+        with open(path, 'wb') as f:
+            f.write(data)
+        writes.written(path)
+        start = time.monotonic()
+        if mode == 'os.sync':
+            os.sync()
+        else:
+            writes.flush()
+        times.append((time.monotonic() - start) * 1000)
+        time.sleep(0.3)
+    for number in range(runs):
+        os.remove(os.path.join(folder, f'flush_benchmark{number}.goo'))
+        writes.removed(os.path.join(folder, f'flush_benchmark{number}.goo'))
+    writes.flush()
+    return statistics.median(times), max(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--folder', default=os.environ.get('USB_GADGET_PATH', '/mnt/usb_share'),
+                        help='Mount point of the gadget image')
+    parser.add_argument('--size-mb', type=float, default=20, help='Size of each written file')
+    parser.add_argument('--runs', type=int, default=7, help='Files written and flushed per measurement')
+    parser.add_argument('--load-dir', default='data', help='Folder on the SD card the background writers use')
+    parser.add_argument('--writers', type=int, default=2, help='Background writer threads')
+    parser.add_argument('--any-fs', action='store_true',
+                        help='Run even if --folder is not a vfat mount (the numbers then say little)')
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    mount = MountState().get(args.folder)
+    if mount is None or mount.fstype != 'vfat':
+        found = f"a {mount.fstype} mount" if mount else "not mounted"
+        if not args.any_fs:
+            parser.error(f"{args.folder} is {found}; mount the gadget image there (or pass --any-fs)")
+        print(f"Warning: {args.folder} is {found}, not the vfat gadget image")
+    else:
+        print(f"Gadget volume: {mount.source} on {mount.mount_point} ({mount.fstype})")
+
+    size = int(args.size_mb * 1048576)
+    print(f"{args.runs} x {args.size_mb:g} MB per measurement, {args.writers} background writer(s) in "
+          f"{os.path.abspath(args.load_dir)}\n")
+    for busy in (False, True):
+        for mode in ('os.sync', 'targeted'):
+            if busy:
+                with DiskLoad(args.load_dir, args.writers):
+                    median, worst = run(args.folder, mode, size, args.runs)
+            else:
+                median, worst = run(args.folder, mode, size, args.runs)
+            os.sync()
+            print(f"{'busy' if busy else 'idle':4s}  {mode:8s}  median {median:8.1f} ms  max {worst:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Upload benchmark against a simulated printer
+
+Starts a local HTTP server that behaves like the printer's chunked upload
+endpoint (port 3030, /uploadFile/upload) with a configurable per-part
+latency and link bandwidth, then uploads the same file with fixed part sizes
+and with adaptive part sizing and prints the throughput of each run.
+
+Usage:
+    python3 scripts/benchmark_upload.py [--size-mb 32] [--latency 0.15]
+                                        [--bandwidth-mb 4] [--max-part-kb 0]
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+from werkzeug.formparser import parse_form_data
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.chunk_tuning import AdaptiveChunkSizer  # noqa: E402
+from core.printer_upload import upload_file_chunked  # noqa: E402
+
+
+class SimulatedPrinter:
+    """Printer upload endpoint with per-part latency and limited bandwidth"""
+
+    def __init__(self, port, latency, bandwidth, max_part=0):
+        self.transfers = {}
+        self.completed = {}
+        self.parts = 0
+        printer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body):
+                out = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def do_POST(self):
+                length = int(self.headers['Content-Length'])
+                body = self.rfile.read(length)
+                # Time on the wire plus the printer storing the part
+                time.sleep(latency + (length / bandwidth if bandwidth else 0))
+                printer.parts += 1
+
+                environ = {'wsgi.input': io.BytesIO(body), 'CONTENT_LENGTH': str(length),
+                           'CONTENT_TYPE': self.headers['Content-Type'], 'REQUEST_METHOD': 'POST'}
+                _, form, files = parse_form_data(environ)
+                part = files.get('File') or files.get('file')
+                data = part.read()
+                if max_part and len(data) > max_part:
+                    return self.reply({'success': False, 'code': 'part too large'})
+
+                buf = printer.transfers.setdefault(form['Uuid'], bytearray())
+                offset = int(form['Offset'])
+                if offset > len(buf):
+                    return self.reply({'success': False, 'code': 'bad offset'})
+                buf[offset:offset + len(data)] = data
+                if len(buf) >= int(form['TotalSize']):
+                    printer.completed[form['Uuid']] = hashlib.md5(buf).hexdigest() == form['S-File-MD5']
+                self.reply({'success': True, 'code': '000000'})
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run(label, filepath, md5, size, **kwargs):
+    sizer = kwargs.get('sizer')
+    start = time.monotonic()
+    ok = upload_file_chunked('127.0.0.1', filepath, md5, **kwargs)
+    elapsed = time.monotonic() - start
+    part = f"{sizer.best_size // 1024} KB best" if sizer else ''
+    print(f"{label:<18} {'ok' if ok else 'FAILED':<7} {elapsed:7.2f} s "
+          f"{size / elapsed / 1048576:7.2f} MB/s  {part}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=32, help='File size to upload (MB)')
+    parser.add_argument('--latency', type=float, default=0.15, help='Printer time per part (s)')
+    parser.add_argument('--bandwidth-mb', type=float, default=4, help='Link bandwidth (MB/s, 0 = unlimited)')
+    parser.add_argument('--max-part-kb', type=int, default=0, help='Largest part the printer accepts (0 = any)')
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    # upload_file_chunked always talks to port 3030
+    printer = SimulatedPrinter(3030, args.latency, args.bandwidth_mb * 1048576, args.max_part_kb * 1024)
+    size = args.size_mb * 1048576
+    with tempfile.NamedTemporaryFile(suffix='.goo', delete=False) as f:
+        f.write(os.urandom(size))
+        filepath = f.name
+
+    try:
+        md5 = hashlib.md5(open(filepath, 'rb').read()).hexdigest()
+        print(f"Simulated printer: {args.latency * 1000:.0f} ms per part, "
+              f"{args.bandwidth_mb or 'unlimited'} MB/s, file {args.size_mb} MB\n")
+        baseline = run('fixed 1 MB', filepath, md5, size, part_size=1048576)
+        run('fixed 256 KB', filepath, md5, size, part_size=256 * 1024)
+        adaptive = run('adaptive', filepath, md5, size, sizer=AdaptiveChunkSizer())
+        print(f"\nAdaptive vs fixed 1 MB: {baseline / adaptive:.2f}x")
+    finally:
+        os.remove(filepath)
+        printer.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Upload memory benchmark
+
+Measures what sending a file to the printer in parts allocates, with
+tracemalloc, and how much CPU it takes. Two ways of building the parts are
+compared against the same simulated printer (benchmark_upload.py's, run in
+a child process so its own allocations are not counted):
+
+- copy: read each part into a new bytes object and post it through
+  requests' files=, which joins the form fields and the part into yet
+  another copy (how parts were sent before)
+- mmap: upload_file_chunked, which maps the file once and posts each part
+  as a memoryview slice in a MultipartBuffer, so the part is not copied
+  before it reaches the socket
+
+Usage:
+    python3 scripts/benchmark_upload_memory.py [--size-mb 64] [--part-kb 1024]
+"""
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from loguru import logger
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.printer_http import printer_session  # noqa: E402
+from core.printer_upload import new_upload_post_data, printer_upload_url, upload_file_chunked  # noqa: E402
+from benchmark_upload import SimulatedPrinter  # noqa: E402
+
+
+def serve_printer(ready):
+    # No latency or bandwidth limit: only the client's allocations and CPU matter here
+    SimulatedPrinter(3030, 0, 0)
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+
+def upload_copying(filepath, md5, part_size):
+    """Send the file the way parts were built before: one bytes copy per part, then files="""
+    url = printer_upload_url('127.0.0.1')
+    session = printer_session('127.0.0.1')
+    post_data = new_upload_post_data(md5, os.path.getsize(filepath))
+    with open(filepath, 'rb') as f:
+        offset = 0
+        while True:
+            part = f.read(part_size)
+            if not part:
+                return True
+            post_data['Offset'] = offset
+            response = session.post(url, data=post_data, files={'File': (os.path.basename(filepath), part)})
+            if not response.json().get('success'):
+                return False
+            offset += len(part)
+
+
+def measure(label, upload):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start, cpu = time.monotonic(), time.process_time()
+    ok = upload()
+    elapsed, cpu = time.monotonic() - start, time.process_time() - cpu
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<6} {'ok' if ok else 'FAILED':<7} peak {peak / 1048576:7.2f} MB allocated  "
+          f"{cpu:6.2f} s CPU  {elapsed:6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=64, help='File size to upload (MB)')
+    parser.add_argument('--part-kb', type=int, default=1024, help='Part size (KB)')
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    ready = multiprocessing.Event()
+    printer = multiprocessing.Process(target=serve_printer, args=(ready,), daemon=True)
+    printer.start()
+    ready.wait(10)
+
+    size, part_size = args.size_mb * 1048576, args.part_kb * 1024
+    parts = -(-size // part_size)
+    with tempfile.NamedTemporaryFile(suffix='.goo', delete=False) as f:
+        f.write(os.urandom(size))
+        filepath = f.name
+
+    try:
+        md5 = hashlib.md5(open(filepath, 'rb').read()).hexdigest()
+        print(f"{args.size_mb} MB in {parts} parts of {args.part_kb} KB\n")
+        # Warm up the session and the page cache so neither run pays for them
+        upload_file_chunked('127.0.0.1', filepath, md5, part_size=part_size)
+        measure('copy', lambda: upload_copying(filepath, md5, part_size))
+        measure('mmap', lambda: upload_file_chunked('127.0.0.1', filepath, md5, part_size=part_size))
+    finally:
+        os.remove(filepath)
+        printer.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import os
+
+import pytest
+
+from core.fat_image import FatImage, FatImageError, format_image
+from core.storage_usage import gadget_storage_usage
+
+
+IMAGE_SIZE = 40 * 1048576   # Smallest FAT32 size class: 512 byte clusters
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / 'piusb.bin'
+    format_image(str(path), IMAGE_SIZE)
+    return str(path)
+
+
+def write_source(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def read_back(fat, path):
+    """Contents of a file in the image, following its cluster chain"""
+    entry = fat.stat(path)
+    data = b''.join(os.pread(fat._fd, fat.cluster_size, fat._offset(cluster)) for cluster in fat._chain(entry.cluster))
+    return data[:entry.size]
+
+
+def test_format_creates_empty_file_system(image):
+    with FatImage(image, readonly=True) as fat:
+        assert fat.cluster_size == 512
+        assert fat.listdir('/') == []
+        total, used, free = fat.usage()
+        # Only the root directory's cluster is in use
+        assert used == fat.cluster_size
+        assert total == used + free
+
+
+def test_format_rejects_images_too_small(tmp_path):
+    with pytest.raises(FatImageError):
+        format_image(str(tmp_path / 'tiny.bin'), 8 * 1048576)
+
+
+def test_open_rejects_non_fat_files(tmp_path):
+    path = write_source(tmp_path, 'zero.bin', bytes(4096))
+    with pytest.raises(FatImageError):
+        FatImage(path)
+
+
+def test_add_file_reads_back(image, tmp_path):
+    data = os.urandom(3 * 512 + 100)
+    source = write_source(tmp_path, 'CUBE.GOO', data)
+    with FatImage(image) as fat:
+        fat.add_file('CUBE.GOO', source, mtime=1700000000)
+    with FatImage(image, readonly=True) as fat:
+        entry = fat.stat('/cube.goo')
+        assert (entry.name, entry.is_dir, entry.size) == ('CUBE.GOO', False, len(data))
+        assert read_back(fat, 'CUBE.GOO') == data
+
+
+def test_long_file_names(image, tmp_path):
+    name = 'Benchy 0.05mm with a rather long name - ünïcode.goo'
+    source = write_source(tmp_path, 'benchy.goo', b'benchy')
+    with FatImage(image) as fat:
+        fat.add_file(name, source)
+        fat.add_file('Benchy 0.05mm second.goo', source)
+    with FatImage(image, readonly=True) as fat:
+        entries = {entry.name: entry for entry in fat.listdir('/')}
+        assert set(entries) == {name, 'Benchy 0.05mm second.goo'}
+        # Both get distinct 8.3 aliases
+        assert entries[name].short_name != entries['Benchy 0.05mm second.goo'].short_name
+        assert fat.stat(name.upper()).name == name
+        assert read_back(fat, name) == b'benchy'
+
+
+def test_replacing_a_file_keeps_one_entry(image, tmp_path):
+    with FatImage(image) as fat:
+        fat.add_file('model.goo', write_source(tmp_path, 'a', b'first'))
+        fat.add_file('model.goo', write_source(tmp_path, 'b', b'second version'))
+        assert [entry.name for entry in fat.listdir('/')] == ['model.goo']
+        assert read_back(fat, 'model.goo') == b'second version'
+
+
+def test_subdirectory_spanning_clusters(image, tmp_path):
+    source = write_source(tmp_path, 'part', b'x' * 10)
+    names = [f'plate {number:03d} long name.goo' for number in range(60)]
+    with FatImage(image) as fat:
+        for name in names:
+            fat.add_file(f'usb/jobs/{name}', source)
+    with FatImage(image, readonly=True) as fat:
+        assert [entry.name for entry in fat.listdir('/')] == ['usb']
+        assert sorted(entry.name for entry in fat.listdir('/usb/jobs')) == names
+        # 60 names with long-name slots need far more than one 16-entry cluster
+        assert len(fat._chain(fat.stat('/usb/jobs').cluster)) > 4
+        assert read_back(fat, f'usb/jobs/{names[-1]}') == b'x' * 10
+
+
+def test_missing_parent_directory(image):
+    with FatImage(image, readonly=True) as fat:
+        assert fat.stat('/nope/file.goo') is None
+        with pytest.raises(FileNotFoundError):
+            fat.listdir('/nope')
+
+
+def test_remove_file_and_directory(image, tmp_path):
+    source = write_source(tmp_path, 'part', os.urandom(2000))
+    with FatImage(image) as fat:
+        before = fat.usage()
+        fat.add_file('keep.goo', source)
+        fat.add_file('dir/a.goo', source)
+        fat.add_file('dir/sub/b.goo', source)
+        fat.remove('dir')
+        assert fat.stat('dir') is None
+        assert [entry.name for entry in fat.listdir('/')] == ['keep.goo']
+        fat.remove('keep.goo')
+        assert fat.listdir('/') == []
+        assert fat.usage() == before
+        with pytest.raises(FileNotFoundError):
+            fat.remove('keep.goo')
+        with pytest.raises(FatImageError):
+            fat.remove('/')
+
+
+def test_removed_slots_are_reused(image, tmp_path):
+    source = write_source(tmp_path, 'part', b'data')
+    with FatImage(image) as fat:
+        fat.add_file('first long file name.goo', source)
+        fat.remove('first long file name.goo')
+        fat.add_file('second long file name.goo', source)
+        entry = fat.stat('second long file name.goo')
+        assert entry.slots[0] == 1   # Right after the volume label
+        assert read_back(fat, 'second long file name.goo') == b'data'
+
+
+def test_free_space_accounting(image, tmp_path):
+    """usage() is what eviction compares an upload's size against"""
+    size = 10 * 512 + 1
+    source = write_source(tmp_path, 'part', os.urandom(size))
+    with FatImage(image) as fat:
+        total, used, free = fat.usage()
+        fat.add_file('a.goo', source)
+        assert fat.usage() == (total, used + 11 * 512, free - 11 * 512)
+
+    # The count survives reopening and matches /usb-gadget/storage in direct mode
+    with FatImage(image, readonly=True) as fat:
+        assert fat.usage() == (total, used + 11 * 512, free - 11 * 512)
+    usage = gadget_storage_usage(str(tmp_path / 'mnt'), image, direct=True)
+    assert (usage['total'], usage['free']) == (total, free - 11 * 512)
+
+    with FatImage(image) as fat:
+        fat.remove('a.goo')
+        assert fat.usage() == (total, used, free)
+
+
+def test_add_file_larger_than_free_space(image, tmp_path):
+    with FatImage(image) as fat:
+        _total, _used, free = fat.usage()
+        source = tmp_path / 'huge'
+        with open(source, 'wb') as f:
+            f.truncate(free + 1)
+        with pytest.raises(FatImageError):
+            fat.add_file('huge.goo', str(source))
+        assert fat.usage()[2] == free
+        assert fat.stat('huge.goo') is None
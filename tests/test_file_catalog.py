@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+from core.file_catalog import FileCatalog, file_md5
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    folder = tmp_path / 'usb'
+    folder.mkdir()
+    return FileCatalog(str(tmp_path / 'catalog.db'), {'usb': str(folder)})
+
+
+def add(catalog, path, data=b'data', mtime=None):
+    full = os.path.join(catalog.folders['usb'], path)
+    os.makedirs(os.path.dirname(full), exist_ok=True)
+    with open(full, 'wb') as f:
+        f.write(data)
+    if mtime is not None:
+        os.utime(full, (mtime, mtime))
+    return catalog.index_file('usb', path)
+
+
+def names(entries):
+    return [entry['path'] for entry in entries]
+
+
+def test_index_file_hashes_and_lists(catalog):
+    entry = add(catalog, 'cube.goo', b'cube')
+    assert entry['md5'] == file_md5(os.path.join(catalog.folders['usb'], 'cube.goo'))
+    assert (entry['name'], entry['size'], entry['pinned']) == ('cube.goo', 4, 0)
+    assert catalog.find_md5(entry['md5'])[0]['path'] == 'cube.goo'
+
+
+def test_expected_md5_is_not_recomputed(catalog, monkeypatch):
+    full = os.path.join(catalog.folders['usb'], 'cube.goo')
+    catalog.expect(full, 'announced', 4)
+    monkeypatch.setattr('core.file_catalog.file_md5', lambda path: pytest.fail('file was hashed again'))
+    assert add(catalog, 'cube.goo', b'cube')['md5'] == 'announced'
+
+
+def test_expected_md5_with_other_size_is_ignored(catalog):
+    full = os.path.join(catalog.folders['usb'], 'cube.goo')
+    catalog.expect(full, 'announced', 99)
+    assert add(catalog, 'cube.goo', b'cube')['md5'] == file_md5(full)
+
+
+@pytest.mark.parametrize('search, expected', [
+    ('cube', ['cube_100%.goo', 'cube_50.goo', 'cubeX100.goo']),
+    ('_1', ['cube_100%.goo']),
+    ('100%', ['cube_100%.goo']),
+    ('%', ['cube_100%.goo']),
+    ('_', ['cube_100%.goo', 'cube_50.goo']),
+    ('\\', ['back\\slash.goo']),
+    ('CUBE', ['cube_100%.goo', 'cube_50.goo', 'cubeX100.goo']),
+])
+def test_list_search_treats_wildcards_literally(catalog, search, expected):
+    # '_' and '%' would match 'X' and anything else if they reached LIKE unescaped
+    for path in ('cube_100%.goo', 'cube_50.goo', 'cubeX100.goo', 'back\\slash.goo'):
+        add(catalog, path)
+    entries, total = catalog.list(search=search)
+    assert names(entries) == expected
+    assert total == len(expected)
+
+
+def test_list_sorts_and_pages(catalog):
+    for index, path in enumerate(('b.goo', 'a.goo', 'c.goo')):
+        add(catalog, path, b'x' * (index + 1))
+    entries, total = catalog.list(sort='size', descending=True, limit=2)
+    assert (names(entries), total) == (['c.goo', 'a.goo'], 3)
+    assert names(catalog.list(sort='name', limit=2, offset=2)[0]) == ['c.goo']
+    # Unknown sort keys fall back to the name
+    assert names(catalog.list(sort='1; DROP TABLE files')[0]) == ['a.goo', 'b.goo', 'c.goo']
+
+
+def test_least_recently_used(catalog):
+    add(catalog, 'old.goo', mtime=1000)
+    add(catalog, 'new.goo', mtime=3000)
+    add(catalog, 'printed.goo', mtime=500)
+    add(catalog, 'pinned.goo', mtime=100)
+    catalog.mark_printed('usb', 'printed.goo', when=2000)
+    catalog.pin('usb', 'pinned.goo')
+    assert names(catalog.least_recently_used('usb')) == ['old.goo', 'printed.goo', 'new.goo']
+
+    catalog.pin('usb', 'pinned.goo', pinned=False)
+    assert names(catalog.least_recently_used('usb'))[0] == 'pinned.goo'
+
+
+def test_reindexing_new_content_keeps_pin_and_print(catalog):
+    add(catalog, 'cube.goo', b'one', mtime=1000)
+    catalog.pin('usb', 'cube.goo')
+    catalog.mark_printed('usb', 'cube.goo', when=1500)
+    entry = add(catalog, 'cube.goo', b'two!', mtime=2000)
+    assert (entry['pinned'], entry['printed'], entry['uploaded'], entry['size']) == (1, 1500, 2000, 4)
+
+
+def test_forget_removes_directory_prefix_only(catalog):
+    for path in ('jobs/a.goo', 'jobs/sub/b.goo', 'jobs2/c.goo', 'jobs.goo'):
+        add(catalog, path)
+    changes = []
+    catalog.on_change = lambda folder, path, entry: changes.append((path, entry))
+    catalog.forget('usb', 'jobs/')
+    assert sorted(names(catalog.list()[0])) == ['jobs.goo', 'jobs2/c.goo']
+    assert sorted(changes) == [('jobs/a.goo', None), ('jobs/sub/b.goo', None)]
+
+
+def test_forget_single_file_and_missing_file(catalog):
+    add(catalog, 'a.goo')
+    add(catalog, 'a.goo.bak.goo')
+    catalog.forget('usb', 'a.goo')
+    assert names(catalog.list()[0]) == ['a.goo.bak.goo']
+
+    os.remove(os.path.join(catalog.folders['usb'], 'a.goo.bak.goo'))
+    assert catalog.index_file('usb', 'a.goo.bak.goo') is None
+    assert catalog.list() == ([], 0)
+
+
+def test_scan_finds_new_and_removed_files(catalog):
+    add(catalog, 'gone.goo')
+    os.remove(os.path.join(catalog.folders['usb'], 'gone.goo'))
+    with open(os.path.join(catalog.folders['usb'], 'new.ctb'), 'wb') as f:
+        f.write(b'new')
+    with open(os.path.join(catalog.folders['usb'], 'notes.txt'), 'wb') as f:
+        f.write(b'not a print file')
+    catalog.scan()
+    assert names(catalog.list()[0]) == ['new.ctb']
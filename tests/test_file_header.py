@@ -0,0 +1,139 @@
+import struct
+import zlib
+
+from core.file_header import (
+    CTB_HEADER_STRUCT, CTB_PREVIEW_STRUCT, GOO_INFO_STRUCT, GOO_PARAMS_OFFSET, GOO_PARAMS_STRUCT,
+    GOO_SMALL_PREVIEW, parse_ctb_header, parse_goo_header, parse_print_file_header, read_print_file_header,
+    read_print_file_preview,
+)
+
+
+def goo_file(machine='ELEGOO Saturn 4 Ultra', layers=1200, resolution=(11520, 5120), params=True):
+    info = GOO_INFO_STRUCT.pack(b'V3.0', b'\x07\x00\x00\x00DLP\x00', b'CHITUBOX', b'2.1', b'2024-01-01',
+                                machine.encode(), b'MSLA', b'Standard', 4, 1, 0)
+    data = bytearray(info)
+    # Small preview: the first pixel red (RGB565, big-endian), the rest black
+    data += b'\xF8\x00' + bytes(GOO_SMALL_PREVIEW[0] * GOO_SMALL_PREVIEW[1] * 2 - 2) + b'\r\n'
+    data += bytes(GOO_PARAMS_OFFSET - len(data))
+    if params:
+        values = [layers, resolution[0], resolution[1], False, False,
+                  218.88, 122.88, 220.0, 0.05,      # platform, layer thickness
+                  2.5, False, 0.5,                   # exposure, delay mode, turn off time
+                  0, 0, 0, 0, 0, 0,
+                  35.0, 5,                           # bottom exposure, bottom layers
+                  *([0.0] * 16),
+                  255, 255, False, 5400,             # pwm, advance mode, print time
+                  1.0, 1.0, 1.0, b'$', False, 0]
+        data += GOO_PARAMS_STRUCT.pack(*values)
+    return bytes(data)
+
+
+def ctb_file(magic=0x12FD0086, version=4, machine='ELEGOO Mars 4', preview=True):
+    header_size = CTB_HEADER_STRUCT.size
+    slicer_offset = header_size
+    name_offset = slicer_offset + 64
+    preview_offset = name_offset + len(machine)
+    rle = struct.pack('<HH', 0xF800 | 0x20, 3) + struct.pack('<H', 0x001F)   # 4 red pixels, then 1 blue
+    fields = [magic, version, 68.04, 120.96, 150.0, 0, 0,
+              10.0, 0.05, 2.0, 30.0, 1.0,                # height, layer height, exposure, bottom, light off
+              6, 9024, 5120,                              # bottom layers, resolution
+              preview_offset if preview else 0, 0, 800, 0,
+              3600, 0, 0, 0, 4,
+              255, 255, 0,
+              slicer_offset, 80]
+    data = bytearray(CTB_HEADER_STRUCT.pack(*fields))
+    slicer = bytearray(64)
+    struct.pack_into('<II', slicer, 28, name_offset, len(machine))
+    data += slicer + machine.encode()
+    if preview:
+        data += CTB_PREVIEW_STRUCT.pack(5, 1, preview_offset + CTB_PREVIEW_STRUCT.size, len(rle)) + rle
+    return bytes(data)
+
+
+def png_pixels(png):
+    """(width, height, RGB rows) of a PNG written by encode_png"""
+    assert png[:8] == b'\x89PNG\r\n\x1a\n'
+    width, height = struct.unpack('>II', png[16:24])
+    idat = png.index(b'IDAT')
+    length = struct.unpack('>I', png[idat - 4:idat])[0]
+    raw = zlib.decompress(png[idat + 4:idat + 4 + length])
+    stride = width * 3 + 1
+    return width, height, [raw[y * stride + 1:(y + 1) * stride] for y in range(height)]
+
+
+def test_goo_header():
+    header = parse_goo_header(goo_file())
+    assert header['format'] == 'goo'
+    assert header['machine_name'] == 'ELEGOO Saturn 4 Ultra'
+    assert header['software'] == 'CHITUBOX'
+    assert (header['resolution_x'], header['resolution_y'], header['layer_count']) == (11520, 5120, 1200)
+    assert (header['layer_height'], header['exposure_time']) == (0.05, 2.5)
+    assert (header['bottom_exposure_time'], header['bottom_layers'], header['print_time']) == (35.0, 5, 5400)
+
+
+def test_truncated_goo_header_has_no_parameters():
+    header = parse_goo_header(goo_file()[:GOO_PARAMS_OFFSET])
+    assert header['machine_name'] == 'ELEGOO Saturn 4 Ultra'
+    assert 'resolution_x' not in header
+
+
+def test_goo_rejects_other_data():
+    assert parse_goo_header(b'') is None
+    assert parse_goo_header(b'\x00' * GOO_INFO_STRUCT.size) is None
+
+
+def test_ctb_header():
+    header = parse_ctb_header(ctb_file())
+    assert (header['format'], header['version'], header['encrypted']) == ('ctb', 4, False)
+    assert header['machine_name'] == 'ELEGOO Mars 4'
+    assert (header['resolution_x'], header['resolution_y'], header['layer_count']) == (9024, 5120, 800)
+    assert (header['layer_height'], header['exposure_time'], header['bottom_exposure_time']) == (0.05, 2.0, 30.0)
+    assert (header['bottom_layers'], header['print_time']) == (6, 3600)
+
+
+def test_ctb_variants():
+    assert parse_ctb_header(ctb_file(magic=0x12FD0019))['format'] == 'cbddlp'
+    # Before version 3 there is no slicer info block with the machine name
+    assert 'machine_name' not in parse_ctb_header(ctb_file(version=2))
+    assert parse_ctb_header(struct.pack('<I', 0x12FD0107)) == {'format': 'ctb', 'encrypted': True}
+    assert parse_ctb_header(struct.pack('<I', 0xDEADBEEF) + bytes(200)) is None
+    # A machine name pointing past the captured bytes is left out
+    assert 'machine_name' not in parse_ctb_header(ctb_file()[:CTB_HEADER_STRUCT.size + 64])
+
+
+def test_format_detection_ignores_misleading_extensions():
+    assert parse_print_file_header(goo_file(), 'model.ctb')['format'] == 'goo'
+    assert parse_print_file_header(ctb_file(), 'model.goo')['format'] == 'ctb'
+    assert parse_print_file_header(b'not a print file' * 100, 'model.goo') is None
+    # Too short for the CTB header struct: not recognised, no exception
+    assert parse_print_file_header(struct.pack('<I', 0x12FD0086) + bytes(10), 'model.ctb') is None
+
+
+def test_goo_preview(tmp_path):
+    path = tmp_path / 'cube.goo'
+    path.write_bytes(goo_file())
+    header = read_print_file_header(str(path))
+    width, height, rows = png_pixels(read_print_file_preview(str(path), header, 'small'))
+    assert (width, height) == GOO_SMALL_PREVIEW
+    assert rows[0][:6] == b'\xff\x00\x00\x00\x00\x00'
+    assert png_pixels(read_print_file_preview(str(path), header, 'big'))[:2] == (290, 290)
+
+    # A file cut off inside its preview has none
+    path.write_bytes(goo_file()[:GOO_INFO_STRUCT.size + 100])
+    assert read_print_file_preview(str(path), header, 'small') is None
+
+
+def test_ctb_preview(tmp_path):
+    path = tmp_path / 'cube.ctb'
+    path.write_bytes(ctb_file())
+    header = read_print_file_header(str(path))
+    assert png_pixels(read_print_file_preview(str(path), header, 'big')) == \
+        (5, 1, [b'\xf8\x00\x00' * 4 + b'\x00\x00\xf8'])
+    assert read_print_file_preview(str(path), header, 'small') is None
+
+    path.write_bytes(ctb_file(preview=False))
+    assert read_print_file_preview(str(path), read_print_file_header(str(path))) is None
+
+
+def test_missing_file():
+    assert read_print_file_header('/nonexistent/cube.goo') is None
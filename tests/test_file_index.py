@@ -0,0 +1,91 @@
+import threading
+import time
+
+from core import file_index as file_index_module
+from core.file_index import FileIndex, printer_path
+
+
+def make_index(tmp_path):
+    index = FileIndex(str(tmp_path / 'file_index.json'))
+    index.record('a', printer_path('local', 'cube.goo'), 'md5', 100)
+    index.record('b', printer_path('local', 'cube.goo'), 'md5', 100)
+    return index
+
+
+def listing(*names):
+    return [{'name': name, 'usedSize': 100, 'type': 1} for name in names]
+
+
+class FakePrinters:
+    """Answers SDCP 258 requests from a thread, like the websocket handler"""
+
+    def __init__(self, index, files, delay=0.2):
+        self.index = index
+        self.files = files      # printer id -> names listed, None = never answers
+        self.delay = delay
+        self.requests = []
+        self.internal = []
+
+    def request_listing(self, printer_id, directory, request_id):
+        self.requests.append((printer_id, directory, time.monotonic()))
+        if self.files.get(printer_id) is not None:
+            def answer():
+                time.sleep(self.delay)
+                self.internal.append(self.index.observe_listing(printer_id, request_id,
+                                                                listing(*self.files[printer_id])))
+            threading.Thread(target=answer, daemon=True).start()
+        return True
+
+
+def test_printers_are_listed_at_once(tmp_path):
+    index = make_index(tmp_path)
+    printers = FakePrinters(index, {'a': ['/local/cube.goo'], 'b': ['/local/cube.goo']}, delay=0.5)
+    start = time.monotonic()
+    confirmed = index.confirm([(pid, '/local/cube.goo', 'md5', 100) for pid in ('a', 'b')],
+                              printers.request_listing)
+    assert sorted(pid for pid, _, _, _ in confirmed) == ['a', 'b']
+    # Both requests go out before either answer is awaited
+    assert time.monotonic() - start < 0.9
+    assert printers.requests[1][2] - printers.requests[0][2] < 0.2
+    # The answers are ChitUI's own and are not forwarded to the web interface
+    assert printers.internal == [True, True]
+
+
+def test_timeouts_share_one_deadline(tmp_path):
+    index = make_index(tmp_path)
+    printers = FakePrinters(index, {'a': None, 'b': None})
+    start = time.monotonic()
+    assert index.confirm([(pid, '/local/cube.goo', 'md5', 100) for pid in ('a', 'b')],
+                         printers.request_listing, timeout=0.3) == []
+    assert time.monotonic() - start < 0.6
+    assert index._listings == {}
+
+
+def test_deleted_file_is_not_confirmed(tmp_path):
+    index = make_index(tmp_path)
+    printers = FakePrinters(index, {'a': [], 'b': ['/local/cube.goo']})
+    confirmed = index.confirm([(pid, '/local/cube.goo', 'md5', 100) for pid in ('a', 'b')],
+                              printers.request_listing)
+    assert [pid for pid, _, _, _ in confirmed] == ['b']
+    assert not index.has('a', '/local/cube.goo', 'md5')
+
+
+def test_recent_listing_is_reused(tmp_path, monkeypatch):
+    index = make_index(tmp_path)
+    # The web interface listed the directory moments ago
+    index.expect_listing('a', 'ui-request', '/local')
+    assert index.observe_listing('a', 'ui-request', listing('/local/cube.goo')) is False
+    printers = FakePrinters(index, {'a': ['/local/cube.goo']})
+    assert index.confirm([('a', '/local/cube.goo', 'md5', 100)], printers.request_listing)
+    assert printers.requests == []
+
+    monkeypatch.setattr(file_index_module, 'LISTING_MAX_AGE', 0)
+    assert index.confirm([('a', '/local/cube.goo', 'md5', 100)], printers.request_listing)
+    assert len(printers.requests) == 1
+
+
+def test_unknown_content_is_not_listed(tmp_path):
+    index = make_index(tmp_path)
+    printers = FakePrinters(index, {'a': ['/local/cube.goo']})
+    assert index.confirm([('a', '/local/cube.goo', 'other', 100)], printers.request_listing) == []
+    assert printers.requests == []
@@ -0,0 +1,231 @@
+import os
+import shutil
+
+import pytest
+
+from core import gadget_controller
+from core.fat_image import FatImage, format_image
+from core.gadget_controller import GadgetController, MASS_STORAGE_OPTIONS
+
+
+class FakeKernel:
+    """Writes into a fake sysfs/configfs tree with the kernel's side effects
+
+    forced_eject empties the LUN's backing file, writing a gadget's UDC
+    attribute binds or unbinds it (the host configures a bound gadget at
+    once) and modprobe adds or removes the module directories.
+    """
+
+    def __init__(self, root, monkeypatch, configfs_gadget=True, udc=True):
+        self.root = root
+        self.configfs = root / 'config'
+        self.udc_class = root / 'class' / 'udc'
+        self.modules = root / 'module'
+        self.legacy = root / 'platform' / '3f980000.usb' / 'gadget'
+        self.mountinfo = root / 'mountinfo'
+        self.mountinfo.write_text('')
+        self.configfs.mkdir()
+        self.udc_class.mkdir(parents=True)
+        self.modules.mkdir()
+        self.commands = []
+        self.eject_ignored = False
+        if udc:
+            self.add_udc()
+        if configfs_gadget:
+            gadget = self.configfs / 'g1'
+            (gadget / 'functions' / 'mass_storage.usb0' / 'lun.0').mkdir(parents=True)
+            (gadget / 'UDC').write_text('fe980000.usb\n')
+        monkeypatch.setattr(gadget_controller, '_write', self.write)
+
+    def add_udc(self):
+        (self.udc_class / 'fe980000.usb').mkdir(exist_ok=True)
+        (self.udc_class / 'fe980000.usb' / 'state').write_text('configured\n')
+
+    def lun(self, image, forced_eject=True):
+        """Create the LUN (configfs, or the legacy module's) presenting image"""
+        gadgets = list(self.configfs.glob('*/functions/mass_storage.*/lun.*'))
+        lun = gadgets[0] if gadgets else self.legacy / 'lun0'
+        lun.mkdir(parents=True, exist_ok=True)
+        (lun / 'file').write_text(f'{image}\n')
+        if forced_eject:
+            (lun / 'forced_eject').write_text('')
+        return lun
+
+    def write(self, path, value):
+        name, folder = os.path.basename(path), os.path.dirname(path)
+        if name == 'forced_eject':
+            if not self.eject_ignored:
+                with open(os.path.join(folder, 'file'), 'w') as f:
+                    f.write('')
+            return
+        with open(path, 'w') as f:
+            f.write(value.strip() + '\n' if value.strip() else '')
+        if name == 'UDC':
+            state = self.udc_class / (value.strip() or 'fe980000.usb') / 'state'
+            state.write_text('configured\n' if value.strip() else 'not attached\n')
+
+    def run(self, args):
+        self.commands.append(args)
+        if args[:2] == ['modprobe', '-r']:
+            shutil.rmtree(self.modules / args[2], ignore_errors=True)
+            if args[2] == 'g_mass_storage':
+                shutil.rmtree(self.legacy, ignore_errors=True)
+            if args[2] == 'dwc2':
+                shutil.rmtree(self.udc_class / 'fe980000.usb', ignore_errors=True)
+        elif args[0] == 'modprobe':
+            (self.modules / args[1]).mkdir(exist_ok=True)
+            if args[1] == 'dwc2':
+                self.add_udc()
+            if args[1] == 'g_mass_storage':
+                image = next(arg for arg in args if arg.startswith('file='))[5:]
+                self.lun(image, forced_eject=False)
+        return True
+
+    def controller(self, image, mount_point, **kwargs):
+        return GadgetController(image, str(mount_point), configfs=str(self.configfs),
+                                udc_class=str(self.udc_class), modules=str(self.modules),
+                                mountinfo=str(self.mountinfo),
+                                legacy_lun_globs=(str(self.root / 'platform' / '*.usb' / 'gadget*' / 'lun*'),),
+                                run=self.run, **kwargs)
+
+
+def steps(controller, sequence):
+    return [(step['step'], step['ok']) for step in controller.last_run if step['sequence'] == sequence]
+
+
+@pytest.fixture
+def mount_point(tmp_path):
+    folder = tmp_path / 'usb_share'
+    folder.mkdir()
+    return folder
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = str(tmp_path / 'piusb.bin')
+    format_image(path, 40 * 1048576)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def short_timeouts(monkeypatch):
+    monkeypatch.setattr(gadget_controller, 'STEP_TIMEOUT', 0.2)
+    monkeypatch.setattr(gadget_controller, 'CONFIGURE_TIMEOUT', 0.2)
+
+
+def test_forced_eject_reinserts_the_image(tmp_path, mount_point, monkeypatch):
+    kernel = FakeKernel(tmp_path, monkeypatch)
+    lun = kernel.lun('/piusb.bin')
+    chosen = []
+    controller = kernel.controller('/piusb.bin', mount_point, on_sequence=chosen.append)
+
+    assert controller.available()
+    assert controller.reload()
+    assert chosen == ['eject']
+    assert steps(controller, 'eject') == [('sync', True), ('eject', True), ('write', True), ('insert', True)]
+    assert (lun / 'file').read_text().strip() == '/piusb.bin'
+    # The gadget stayed bound and no module was touched
+    assert (kernel.configfs / 'g1' / 'UDC').read_text().strip() == 'fe980000.usb'
+    assert kernel.commands == []
+
+
+def test_lun_file_swap_between_images(tmp_path, mount_point, image, monkeypatch):
+    spare = str(tmp_path / 'piusb.spare.bin')
+    kernel = FakeKernel(tmp_path, monkeypatch)
+    lun = kernel.lun(image)
+    (mount_point / 'cube.goo').write_bytes(b'cube')
+    controller = kernel.controller(image, mount_point, direct=True, spare_image=spare)
+
+    assert controller.reload()
+    assert steps(controller, 'swap') == [('write', True), ('swap', True)]
+    # The spare was created, written and presented; the image the printer read from is untouched
+    assert (lun / 'file').read_text().strip() == spare
+    assert controller.active_image == spare
+    with FatImage(spare, readonly=True) as fat:
+        assert fat.stat('cube.goo').size == 4
+    with FatImage(image, readonly=True) as fat:
+        assert fat.stat('cube.goo') is None
+
+    # The next reload brings the other image up to date and swaps back
+    assert controller.reload()
+    assert (lun / 'file').read_text().strip() == image
+    with FatImage(image, readonly=True) as fat:
+        assert fat.stat('cube.goo').size == 4
+
+
+def test_swap_writes_removals_into_both_images(tmp_path, mount_point, image, monkeypatch):
+    spare = str(tmp_path / 'piusb.spare.bin')
+    kernel = FakeKernel(tmp_path, monkeypatch)
+    kernel.lun(image)
+    (mount_point / 'cube.goo').write_bytes(b'cube')
+    controller = kernel.controller(image, mount_point, direct=True, spare_image=spare)
+    assert controller.reload() and controller.reload()
+
+    (mount_point / 'cube.goo').unlink()
+    controller.remove('cube.goo')
+    assert controller.reload() and controller.reload()
+    for path in (image, spare):
+        with FatImage(path, readonly=True) as fat:
+            assert fat.stat('cube.goo') is None
+
+
+def test_rebind_when_forced_eject_is_refused(tmp_path, mount_point, image, monkeypatch):
+    kernel = FakeKernel(tmp_path, monkeypatch)
+    # The host keeps the medium locked, so forced_eject does not take
+    kernel.eject_ignored = True
+    lun = kernel.lun(image)
+    controller = kernel.controller(image, mount_point, direct=True)
+
+    assert controller.reload()
+    assert steps(controller, 'eject')[-1] == ('eject', False)
+    assert [step for step, ok in steps(controller, 'rebind')] == \
+        ['sync', 'umount', 'unbind', 'write', 'bind', 'insert', 'mount']
+    assert all(ok for step, ok in steps(controller, 'rebind'))
+    assert controller.sequence == 'rebind'
+    assert (kernel.configfs / 'g1' / 'UDC').read_text().strip() == 'fe980000.usb'
+    assert (kernel.udc_class / 'fe980000.usb' / 'state').read_text().strip() == 'configured'
+    assert (lun / 'file').read_text().strip() == image
+    assert kernel.commands == []
+
+
+def test_known_sequence_is_tried_first(tmp_path, mount_point, image, monkeypatch):
+    kernel = FakeKernel(tmp_path, monkeypatch)
+    kernel.lun(image)
+    controller = kernel.controller(image, mount_point, direct=True, sequence='rebind')
+
+    assert controller.reload()
+    assert {step['sequence'] for step in controller.last_run} == {'rebind'}
+
+
+def test_g_mass_storage_reload_as_last_resort(tmp_path, mount_point, image, monkeypatch):
+    # Legacy module without forced_eject, and its UDC only comes back with dwc2
+    kernel = FakeKernel(tmp_path, monkeypatch, configfs_gadget=False, udc=False)
+    (kernel.modules / 'g_mass_storage').mkdir()
+    (kernel.modules / 'dwc2').mkdir()
+    kernel.lun(image, forced_eject=False)
+    chosen = []
+    controller = kernel.controller(image, mount_point, direct=True, on_sequence=chosen.append)
+
+    assert controller.reload()
+    assert chosen == ['modules']
+    assert ('bind', False) in steps(controller, 'rebind')
+    assert all(ok for step, ok in steps(controller, 'modules'))
+    assert kernel.commands == [
+        ['modprobe', '-r', 'g_mass_storage'],
+        ['modprobe', '-r', 'dwc2'],
+        ['modprobe', 'dwc2'],
+        ['modprobe', 'g_mass_storage', f'file={image}'] + MASS_STORAGE_OPTIONS,
+    ]
+    assert (kernel.legacy / 'lun0' / 'file').read_text().strip() == image
+
+
+def test_failed_reload_leaves_the_drive_attached(tmp_path, mount_point, image, monkeypatch):
+    kernel = FakeKernel(tmp_path, monkeypatch, udc=False)
+    kernel.eject_ignored = True
+    lun = kernel.lun(image)
+    kernel.run = lambda args: False
+    controller = kernel.controller(image, mount_point, direct=True)
+
+    assert not controller.reload()
+    assert {step['sequence'] for step in controller.last_run} == {'eject', 'rebind', 'modules'}
+    assert (lun / 'file').read_text().strip() == image
@@ -0,0 +1,104 @@
+from core.gadget_eviction import GadgetEviction
+
+
+MB = 1048576
+
+
+class FakeCatalog:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def least_recently_used(self, folder):
+        assert folder == 'usb'
+        return [entry for entry in self.entries if not entry.get('pinned')]
+
+
+class FakeDrive:
+    """Gadget folder whose free space grows as files are removed"""
+
+    def __init__(self, free, sizes, failing=()):
+        self.free = free
+        self.sizes = dict(sizes)
+        self.failing = set(failing)
+        self.removed = []
+
+    def remove(self, path):
+        if path in self.failing:
+            raise PermissionError(f"Cannot remove {path}")
+        self.removed.append(path)
+        self.free += self.sizes.pop(path)
+
+
+def entry(path, size, pinned=False):
+    return {'path': path, 'size': size, 'printed': None, 'uploaded': 0, 'pinned': pinned}
+
+
+def eviction(free, entries, failing=(), protected=()):
+    drive = FakeDrive(free, {e['path']: e['size'] for e in entries}, failing)
+    evictor = GadgetEviction(FakeCatalog(entries), lambda: drive.free, drive.remove,
+                             protected=lambda: set(protected), margin=MB)
+    return evictor, drive
+
+
+FILES = [entry('old.goo', 10 * MB), entry('pinned.goo', 50 * MB, pinned=True),
+         entry('printing.goo', 20 * MB), entry('newer.goo', 30 * MB), entry('newest.goo', 40 * MB)]
+
+
+def test_upload_that_fits_removes_nothing():
+    evictor, drive = eviction(100 * MB, FILES)
+    plan = evictor.make_room(50 * MB)
+    assert (plan['fits'], plan['shortfall'], plan['evicted']) == (True, 0, [])
+    assert drive.removed == []
+
+
+def test_least_recently_used_go_first_skipping_protected_and_pinned():
+    evictor, drive = eviction(5 * MB, FILES, protected=['printing.goo'])
+    # Needs 30 MB + 1 MB margin - 5 MB free = 26 MB
+    plan = evictor.make_room(30 * MB)
+    assert plan['fits']
+    assert plan['shortfall'] == 26 * MB
+    assert plan['evicted'] == ['old.goo', 'newer.goo']
+    assert drive.removed == ['old.goo', 'newer.goo']
+    assert plan['freed'] == 40 * MB
+
+
+def test_plan_is_a_dry_run():
+    evictor, drive = eviction(5 * MB, FILES)
+    plan = evictor.plan(30 * MB)
+    assert [e['path'] for e in plan['evict']] == ['old.goo', 'printing.goo']
+    assert drive.removed == []
+
+
+def test_upload_too_large_even_after_eviction_removes_nothing():
+    evictor, drive = eviction(5 * MB, FILES, protected=['printing.goo'])
+    # Only 80 MB could be freed: pinned and protected files stay
+    plan = evictor.make_room(90 * MB)
+    assert not plan['fits']
+    assert [e['path'] for e in plan['evict']] == ['old.goo', 'newer.goo', 'newest.goo']
+    assert plan['evicted'] == []
+    assert drive.removed == []
+
+
+def test_check_only_reports_evictable():
+    evictor, drive = eviction(5 * MB, FILES)
+    plan = evictor.make_room(30 * MB, evict=False)
+    assert (plan['fits'], plan['evictable'], plan['evicted']) == (False, True, [])
+    assert drive.removed == []
+
+    plan = evictor.make_room(300 * MB, evict=False)
+    assert (plan['fits'], plan['evictable']) == (False, False)
+
+
+def test_partial_eviction_failure_does_not_fit():
+    evictor, drive = eviction(5 * MB, FILES, failing=['printing.goo'])
+    plan = evictor.make_room(30 * MB)
+    assert not plan['fits']
+    # The files that could be removed are gone; the caller refuses the upload
+    assert plan['evicted'] == ['old.goo']
+    assert drive.removed == ['old.goo']
+
+
+def test_unknown_free_space_is_accepted():
+    evictor, drive = eviction(None, FILES)
+    plan = evictor.make_room(300 * MB)
+    assert (plan['fits'], plan['free'], plan['evicted']) == (True, None, [])
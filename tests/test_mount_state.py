@@ -0,0 +1,58 @@
+import threading
+
+from core.mount_state import MountState, parse_mountinfo
+
+
+MOUNTINFO = """\
+22 1 179:2 / / rw,noatime shared:1 - ext4 /dev/root rw
+25 22 0:21 / /proc rw,nosuid,nodev,noexec,relatime shared:12 - proc proc rw
+80 22 7:0 / /mnt/usb_share rw,relatime shared:40 - vfat /dev/loop0 rw,fmask=0000,dmask=0000,errors=remount-ro
+81 22 7:1 / /mnt/usb\\040share\\0112 ro,relatime - vfat /piusb\\040copy.bin rw
+"""
+
+
+def test_parse_mountinfo():
+    mounts = parse_mountinfo(MOUNTINFO)
+    assert set(mounts) == {'/', '/proc', '/mnt/usb_share', '/mnt/usb share\t2'}
+    usb = mounts['/mnt/usb_share']
+    assert (usb.source, usb.fstype, usb.read_only) == ('/dev/loop0', 'vfat', False)
+    assert {'rw', 'relatime', 'errors=remount-ro'} <= usb.options
+
+
+def test_escaped_fields_and_read_only_mounts():
+    mount = parse_mountinfo(MOUNTINFO)['/mnt/usb share\t2']
+    assert mount.source == '/piusb copy.bin'
+    assert mount.read_only
+
+
+def test_read_only_from_super_options():
+    # vfat switched to read-only after an error: only the super block options say so
+    line = "80 22 7:0 / /mnt/usb_share rw,relatime - vfat /dev/loop0 ro,fmask=0000\n"
+    assert parse_mountinfo(line)['/mnt/usb_share'].read_only
+
+
+def test_stacked_mounts_last_wins():
+    text = MOUNTINFO + "90 80 0:50 / /mnt/usb_share rw - tmpfs tmpfs rw\n"
+    assert parse_mountinfo(text)['/mnt/usb_share'].fstype == 'tmpfs'
+
+
+def test_malformed_lines_are_skipped():
+    text = "\n".join(["", "garbage", "1 2 3:4 / /no-separator rw shared:1 ext4 /dev/x rw",
+                      "1 2 3:4 / /truncated rw - ext4", MOUNTINFO])
+    assert set(parse_mountinfo(text)) == {'/', '/proc', '/mnt/usb_share', '/mnt/usb share\t2'}
+
+
+def test_mount_state_reads_file_and_waits(tmp_path):
+    mountinfo = tmp_path / 'mountinfo'
+    mountinfo.write_text(MOUNTINFO.splitlines()[0] + '\n')
+    share = tmp_path / 'share'
+    share.mkdir()
+    state = MountState(str(mountinfo))
+    assert not state.is_mounted(str(share))
+    assert not state.wait(str(share), mounted=True, timeout=0.05)
+
+    line = f"80 22 7:0 / {share} rw - vfat /dev/loop0 rw\n"
+    threading.Timer(0.05, lambda: mountinfo.write_text(MOUNTINFO + line)).start()
+    assert state.wait(str(share), mounted=True, timeout=2)
+    # Looked up by real path
+    assert state.get(str(share / '.')).source == '/dev/loop0'
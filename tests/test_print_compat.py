@@ -0,0 +1,45 @@
+from core.print_compat import check_machine_name, check_print_file, normalize_machine_name, parse_resolution
+
+
+HEADER = {'format': 'goo', 'machine_name': 'ELEGOO Saturn 4 Ultra', 'resolution_x': 11520, 'resolution_y': 5120}
+ATTRIBUTES = {'MachineName': 'Saturn 4 Ultra', 'Resolution': '11520x5120', 'SupportFileType': ['goo']}
+
+
+def test_parse_resolution():
+    assert parse_resolution('7680x4320') == (7680, 4320)
+    assert parse_resolution(' 7680 X 4320 ') == (7680, 4320)
+    assert parse_resolution('') is None
+
+
+def test_matching_file_fits():
+    assert check_print_file(HEADER, ATTRIBUTES) is None
+    assert check_machine_name(HEADER, ATTRIBUTES) is None
+
+
+def test_resolution_and_file_type_are_refused():
+    assert 'resolution' in check_print_file(dict(HEADER, resolution_x=7680, resolution_y=4320), ATTRIBUTES)
+    assert 'does not accept .ctb' in check_print_file(dict(HEADER, format='ctb'), ATTRIBUTES)
+    # Rotated resolutions are the same panel
+    assert check_print_file(dict(HEADER, resolution_x=5120, resolution_y=11520), ATTRIBUTES) is None
+
+
+def test_machine_name_is_compared_exactly():
+    assert normalize_machine_name('ELEGOO Saturn 4 Ultra') == normalize_machine_name('Saturn 4 Ultra')
+    warning = check_machine_name(HEADER, dict(ATTRIBUTES, MachineName='Saturn 4 Ultra 16K'))
+    assert 'Saturn 4 Ultra 16K' in warning
+    # A name mismatch alone is not a refusal
+    assert check_print_file(HEADER, dict(ATTRIBUTES, MachineName='Saturn 4 Ultra 16K')) is None
+
+
+def test_unknown_printer_name_is_not_checked():
+    assert check_machine_name(HEADER, {}) is None
+    assert check_machine_name(HEADER, {}, model='Unknown') is None
+    assert check_machine_name(HEADER, {}, model='Manual') is None
+    assert check_machine_name(HEADER, {}, model='Mars 5 Ultra') is not None
+
+
+def test_nothing_to_check():
+    assert check_print_file(None, ATTRIBUTES) is None
+    assert check_print_file(dict(HEADER, encrypted=True, resolution_x=1), ATTRIBUTES) is None
+    assert check_machine_name(dict(HEADER, encrypted=True), ATTRIBUTES) is None
+    assert check_print_file(HEADER, {}) is None
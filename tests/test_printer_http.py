@@ -0,0 +1,36 @@
+from core.printer_http import ThrottledBody
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.consumed = []
+
+    def consume(self, nbytes):
+        self.consumed.append(nbytes)
+
+
+def test_throttled_body_paces_each_block():
+    limiter = RecordingLimiter()
+    body = ThrottledBody(b'x' * 10, limiter, block_size=4)
+    blocks = []
+    for block in body:
+        # The cap is checked before a block goes out, not after the request
+        assert len(limiter.consumed) == len(blocks) + 1
+        blocks.append(bytes(block))
+    assert blocks == [b'xxxx', b'xxxx', b'xx']
+    assert limiter.consumed == [4, 4, 2]
+
+
+def test_throttled_body_keeps_length_and_content_of_iterables():
+    class Parts:
+        def __len__(self):
+            return 9
+
+        def __iter__(self):
+            return iter([b'head', memoryview(b'abc'), b'yz'])
+
+    limiter = RecordingLimiter()
+    body = ThrottledBody(Parts(), limiter, block_size=2)
+    assert len(body) == 9
+    assert b''.join(bytes(block) for block in body) == b'headabcyz'
+    assert sum(limiter.consumed) == 9
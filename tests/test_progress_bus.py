@@ -0,0 +1,71 @@
+import threading
+import time
+
+from core.progress_bus import ProgressBus
+
+
+def publish_later(delay, action):
+    timer = threading.Timer(delay, action)
+    timer.start()
+    return timer
+
+
+def test_subscriber_and_emit_see_the_same_events():
+    emitted = []
+    bus = ProgressBus(emit=emitted.append)
+    bus.update('u1', 10)
+    publish_later(0.05, lambda: bus.update('u1', 100))
+    events = list(bus.subscribe('u1', keepalive=1))
+    assert [event['progress'] for event in events] == [10, 100]
+    assert events == emitted
+
+
+def test_subscriber_gets_keepalives_while_idle():
+    bus = ProgressBus()
+    bus.update('u1', 10)
+    subscription = bus.subscribe('u1', keepalive=0.05)
+    assert next(subscription)['progress'] == 10
+    assert next(subscription) is None
+    bus.update('u1', 100)
+    assert next(subscription)['progress'] == 100
+    assert list(subscription) == []
+
+
+def test_subscription_ends_when_upload_is_discarded():
+    bus = ProgressBus()
+    bus.update('u1', 10)
+    publish_later(0.05, lambda: bus.discard('u1'))
+    start = time.monotonic()
+    events = list(bus.subscribe('u1', keepalive=1))
+    assert [event['progress'] for event in events] == [10]
+    assert time.monotonic() - start < 0.5
+
+
+def test_subscription_lifetime_is_capped():
+    bus = ProgressBus()
+    stop = threading.Event()
+
+    def keep_reporting():
+        percent = 0
+        while not stop.wait(0.02):
+            percent = (percent + 1) % 99
+            bus.update('u1', percent)
+
+    reporter = threading.Thread(target=keep_reporting)
+    reporter.start()
+    try:
+        start = time.monotonic()
+        events = list(bus.subscribe('u1', keepalive=1, lifetime=0.3))
+    finally:
+        stop.set()
+        reporter.join()
+    assert events
+    assert time.monotonic() - start < 0.6
+
+
+def test_subscription_ends_when_idle():
+    bus = ProgressBus()
+    start = time.monotonic()
+    events = list(bus.subscribe('never-started', keepalive=0.05, idle_timeout=0.2))
+    assert events and all(event is None for event in events)
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,25 @@
+import base64
+
+import pytest
+
+from core.resumable_upload import parse_upload_metadata
+
+
+def encode(value):
+    return base64.b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def test_parse_upload_metadata():
+    header = f"filename {encode('cube.goo')},printer {encode('p1')},force"
+    assert parse_upload_metadata(header) == {'filename': 'cube.goo', 'printer': 'p1', 'force': ''}
+
+
+def test_parse_upload_metadata_empty():
+    assert parse_upload_metadata(None) == {}
+    assert parse_upload_metadata('') == {}
+
+
+@pytest.mark.parametrize('value', ['not*base64', 'abc', base64.b64encode(b'\xff\xfe').decode('ascii')])
+def test_parse_upload_metadata_invalid(value):
+    with pytest.raises(ValueError):
+        parse_upload_metadata(f"filename {value}")
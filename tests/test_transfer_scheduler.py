@@ -0,0 +1,97 @@
+import threading
+import time
+
+from core.printer_upload import upload_file_to_many
+from core.transfer_scheduler import DEFAULT_QUEUE, TransferScheduler
+from core.upload_jobs import UploadJobs
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_same_queue_is_fifo():
+    scheduler = TransferScheduler()
+    order = []
+    release = threading.Event()
+
+    def transfer(number):
+        with scheduler.slot('printer'):
+            order.append(number)
+            release.wait()
+
+    threads = []
+    for number in range(5):
+        threads.append(threading.Thread(target=transfer, args=(number,)))
+        threads[-1].start()
+        # Queue them one after another, so the arrival order is known
+        wait_for(lambda: scheduler.status().get('printer') == number + 1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2, 3, 4]
+    assert scheduler.status() == {}
+
+
+def test_different_queues_run_side_by_side():
+    scheduler = TransferScheduler()
+    with scheduler.slot('a'):
+        entered = threading.Event()
+
+        def other():
+            with scheduler.slot('b'):
+                entered.set()
+
+        threading.Thread(target=other).start()
+        assert entered.wait(5)
+    # Requests without a destination share the default queue
+    with scheduler.slot(None):
+        assert scheduler.status() == {DEFAULT_QUEUE: 1}
+
+
+def test_slot_is_released_on_error():
+    scheduler = TransferScheduler()
+    try:
+        with scheduler.slot('printer'):
+            raise RuntimeError('transfer failed')
+    except RuntimeError:
+        pass
+    assert scheduler.status() == {}
+
+
+def test_crossed_fan_outs_do_not_deadlock(tmp_path):
+    """Regression: two multi-printer jobs with crossed targets
+
+    A job used to hold its first printer's queue for the whole job while
+    its fan-out waited for the other printer's queue, so jobs to [a, b]
+    and [b, a] waited on each other forever. Multi-printer jobs are now
+    submitted without a job-level queue; each fan-out thread waits for
+    its own printer only.
+    """
+    scheduler = TransferScheduler()
+    jobs = UploadJobs(str(tmp_path / 'jobs.json'))
+    source = tmp_path / 'cube.goo'
+    source.write_bytes(b'x' * 1024)
+    active = {'a': 0, 'b': 0}
+    overlaps = []
+    lock = threading.Lock()
+
+    def send(printer, data):
+        with scheduler.slot(printer):
+            with lock:
+                active[printer] += 1
+                overlaps.append(active[printer] > 1)
+            time.sleep(0.05)
+            with lock:
+                active[printer] -= 1
+        return len(data) == 1024
+
+    for job_id, targets in (('job1', ['a', 'b']), ('job2', ['b', 'a'])):
+        jobs.submit(job_id, lambda targets=targets: (all(upload_file_to_many(str(source), targets, send).values()),
+                                                     {}), queue=None)
+    wait_for(lambda: all(jobs.get(job_id)['state'] == 'succeeded' for job_id in ('job1', 'job2')))
+    # Each printer still received one transfer at a time
+    assert overlaps == [False] * 4
@@ -0,0 +1,115 @@
+import os
+from collections import namedtuple
+
+import pytest
+
+from core import upload_staging
+from core.upload_staging import UploadStaging
+
+
+MB = 1048576
+Usage = namedtuple('Usage', ['total', 'used', 'free'])
+
+
+@pytest.fixture
+def tiers(tmp_path, monkeypatch):
+    """A 100 MB tmpfs tier and an unlimited disk tier; free space per folder set by the test"""
+    ram, disk = tmp_path / 'ram', tmp_path / 'disk'
+    free = {str(ram): 1000 * MB, str(disk): 1000 * MB}
+    monkeypatch.setattr(upload_staging.shutil, 'disk_usage', lambda folder: Usage(0, 0, free[folder]))
+    monkeypatch.setattr(upload_staging, 'available_memory', lambda: 500 * MB)
+    staging = UploadStaging([(str(ram), 100 * MB, True), (str(disk), None, False)], reserve=10 * MB)
+    return staging, str(ram), str(disk), free
+
+
+def test_small_uploads_go_to_ram(tiers):
+    staging, ram, _disk, _free = tiers
+    assert staging.folder_for(50 * MB) == ram
+
+
+def test_unknown_size_is_not_staged(tiers):
+    staging, *_ = tiers
+    assert staging.folder_for(None) is None
+    assert staging.folder_for(0) is None
+
+
+def test_ram_tier_limit_counts_staged_files(tiers):
+    staging, ram, disk, _free = tiers
+    assert staging.folder_for(100 * MB) == ram
+    assert staging.folder_for(101 * MB) == disk
+    with open(os.path.join(ram, 'waiting.goo'), 'wb') as f:
+        f.truncate(60 * MB)
+    assert staging.folder_for(50 * MB) == disk
+
+
+def test_ram_tier_respects_available_memory(tiers, monkeypatch):
+    staging, _ram, disk, _free = tiers
+    monkeypatch.setattr(upload_staging, 'available_memory', lambda: 40 * MB)
+    # 40 MB available minus the 10 MB reserve
+    assert staging.folder_for(35 * MB) == disk
+
+
+def test_ram_tier_skipped_for_files_on_disk(tiers):
+    staging, _ram, disk, _free = tiers
+    assert staging.folder_for(MB, ram=False) == disk
+
+
+def test_no_tier_has_room(tiers):
+    staging, ram, disk, free = tiers
+    free[ram] = free[disk] = 200 * MB
+    assert staging.folder_for(150 * MB) == disk
+    assert staging.folder_for(195 * MB) is None
+
+
+def test_move_replaces_target_and_removes_staged_file(tiers, tmp_path):
+    staging, _ram, disk, _free = tiers
+    gadget = tmp_path / 'gadget'
+    gadget.mkdir()
+    (gadget / 'cube.goo').write_bytes(b'old')
+    staged = os.path.join(staging.folder_for(3, ram=False), 'cube.goo')
+    with open(staged, 'wb') as f:
+        f.write(b'new')
+    assert staging.is_staged(staged)
+
+    assert staging.move(staged, str(gadget)) == str(gadget / 'cube.goo')
+    assert (gadget / 'cube.goo').read_bytes() == b'new'
+    assert not os.path.exists(staged)
+    assert os.listdir(gadget) == ['cube.goo']
+
+
+def test_failed_move_keeps_staged_file(tiers, tmp_path, monkeypatch):
+    staging, _ram, disk, _free = tiers
+    gadget = tmp_path / 'gadget'
+    gadget.mkdir()
+    (gadget / 'cube.goo').write_bytes(b'old')
+    os.makedirs(disk)
+    staged = os.path.join(disk, 'cube.goo')
+    with open(staged, 'wb') as f:
+        f.write(b'new')
+
+    def disk_full(source, destination, length):
+        destination.write(b'ne')
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(upload_staging.shutil, 'copyfileobj', disk_full)
+    with pytest.raises(OSError):
+        staging.move(staged, str(gadget))
+    # Staged file kept for a retry, target untouched, no partial copy left behind
+    assert open(staged, 'rb').read() == b'new'
+    assert os.listdir(gadget) == ['cube.goo']
+    assert (gadget / 'cube.goo').read_bytes() == b'old'
+    assert staging.leftovers() == [staged]
+
+    with pytest.raises(OSError):
+        staging.move(staged, str(tmp_path / 'not-mounted'))
+    assert os.path.exists(staged)
+
+
+def test_leftovers_drop_partial_ingests(tiers):
+    staging, ram, disk, _free = tiers
+    for folder in (ram, disk):
+        os.makedirs(folder)
+    open(os.path.join(ram, 'done.goo'), 'wb').close()
+    open(os.path.join(disk, '.partial.goo'), 'wb').close()
+    assert staging.leftovers() == [os.path.join(ram, 'done.goo')]
+    assert os.listdir(disk) == []
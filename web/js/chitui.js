@@ -230,7 +230,8 @@ socket.on("refresh_page", (data) => {
   console.log("Page refresh requested:", data.reason);
 
   // For virtual USB operations, wait for reload to complete before refreshing
-  if (data.reason === 'virtual_usb_delete' || data.reason === 'virtual_usb_upload') {
+  if (data.reason === 'virtual_usb_delete' || data.reason === 'virtual_usb_upload' ||
+      data.reason === 'virtual_usb_reload') {
     console.log("Virtual USB operation - waiting for gadget reload...");
 
     // Show toast notification with countdown
@@ -383,63 +384,61 @@ function updateStorageDisplay(remainingBytes) {
   }
 }
 
+function renderUsbGadgetStorage(data) {
+  if (data.success && data.available) {
+    // Show the gauge
+    $('#usbGaugeWrapper').show();
+
+    // Format size function
+    function formatSize(bytes) {
+      const mb = bytes / (1024 * 1024);
+      const gb = bytes / (1024 * 1024 * 1024);
+      if (gb >= 1) {
+        return gb.toFixed(2) + ' GB';
+      }
+      return mb.toFixed(0) + ' MB';
+    }
+
+    // Update gauge
+    const usedPercent = data.percent;
+    const $gaugeCircle = $('#usbGaugeCircle');
+    const $gaugePercent = $('#usbGaugePercent');
+    const circumference = 2 * Math.PI * 80; // 2 * PI * radius (80)
+    const offset = circumference - (usedPercent / 100 * circumference);
+
+    $gaugeCircle.css('stroke-dashoffset', offset);
+    $gaugePercent.text(Math.round(usedPercent) + '%');
+
+    // Color code the USB gauge
+    $gaugeCircle.removeClass('warning danger');
+    if (usedPercent < 70) {
+      // Green (default)
+    } else if (usedPercent < 90) {
+      $gaugeCircle.addClass('warning');
+    } else {
+      $gaugeCircle.addClass('danger');
+    }
+
+    // Update details text
+    $('#usbGaugeDetails').text(formatSize(data.used) + ' / ' + formatSize(data.total));
+  } else {
+    // Hide the gauge if USB gadget is not available
+    $('#usbGaugeWrapper').hide();
+  }
+}
+
 function updateUsbGadgetStorage() {
   fetch('/usb-gadget/storage')
     .then(response => response.json())
-    .then(data => {
-      if (data.success && data.available) {
-        // Show the gauge
-        $('#usbGaugeWrapper').show();
-
-        // Format size function
-        function formatSize(bytes) {
-          const mb = bytes / (1024 * 1024);
-          const gb = bytes / (1024 * 1024 * 1024);
-          if (gb >= 1) {
-            return gb.toFixed(2) + ' GB';
-          }
-          return mb.toFixed(0) + ' MB';
-        }
-
-        // Update gauge
-        const usedPercent = data.percent;
-        const $gaugeCircle = $('#usbGaugeCircle');
-        const $gaugePercent = $('#usbGaugePercent');
-        const circumference = 2 * Math.PI * 80; // 2 * PI * radius (80)
-        const offset = circumference - (usedPercent / 100 * circumference);
-
-        $gaugeCircle.css('stroke-dashoffset', offset);
-        $gaugePercent.text(Math.round(usedPercent) + '%');
-
-        // Color code the USB gauge
-        $gaugeCircle.removeClass('warning danger');
-        if (usedPercent < 70) {
-          // Green (default)
-        } else if (usedPercent < 90) {
-          $gaugeCircle.addClass('warning');
-        } else {
-          $gaugeCircle.addClass('danger');
-        }
-
-        // Update details text
-        $('#usbGaugeDetails').text(formatSize(data.used) + ' / ' + formatSize(data.total));
-      } else {
-        // Hide the gauge if USB gadget is not available
-        $('#usbGaugeWrapper').hide();
-      }
-    })
+    .then(renderUsbGadgetStorage)
     .catch(error => {
       console.error('Error fetching USB gadget storage:', error);
       $('#usbGaugeWrapper').hide();
     });
 }
 
-// Update USB gadget storage every 5 seconds
-setInterval(updateUsbGadgetStorage, 5000);
-// Also update immediately on page load
-$(document).ready(function() {
-  updateUsbGadgetStorage();
-});
+// The server pushes storage usage when the drive changes (and to each tab on connect)
+socket.on('usb_gadget_storage', renderUsbGadgetStorage);
 
 
 function handle_task_details(data) {
@@ -1347,8 +1346,32 @@ $('input[name="destination"]').on('change', function() {
   const destination = $(this).val();
   $('#uploadDestPath').val(destination);
   console.log('Upload destination changed to:', destination);
+  updateUploadTargets();
 });
 
+// Other printers that can get the same file (local storage uploads only)
+function updateUploadTargets() {
+  var list = $('#uploadTargetList').empty();
+  var destination = $('input[name="destination"]:checked').val();
+  var others = Object.keys(printers).filter(function (id) {
+    return id !== currentPrinter;
+  });
+
+  if (destination !== 'local' || others.length === 0) {
+    $('#uploadTargets').hide();
+    return;
+  }
+
+  others.forEach(function (id) {
+    var checkboxId = 'uploadTarget-' + id;
+    list.append($('<div class="form-check">').append(
+      $('<input class="form-check-input upload-target" type="checkbox">').attr('id', checkboxId).val(id),
+      $('<label class="form-check-label">').attr('for', checkboxId).text(printers[id].name || id)
+    ));
+  });
+  $('#uploadTargets').show();
+}
+
 function uploadFile() {
   // Generate a unique upload ID for progress tracking
   var uploadId = generateUUID();
@@ -1361,12 +1384,84 @@ function uploadFile() {
   $('.progress-enhanced').show();
   $('#progressUpload').text('0%').css('width', '0%');
 
+  // Printers ticked under "Also send to" get the same file in one upload
+  var targets = $('.upload-target:checked').map(function () { return this.value; }).get();
+  if (targets.length > 0) {
+    formData.append('printers', [formData.get('printer')].concat(targets).join(','));
+  }
+
+  // Uploads to the printer's local storage are relayed: the browser hashes
+  // the file and the server forwards it to the printer without storing it
+  var file = $('#uploadFile')[0].files[0];
+  if (!file) {
+    sendUpload(formData, uploadId);
+    return;
+  }
+  checkPrintFile(file, formData).done(function (proceed) {
+    if (!proceed) {
+      $('#progressUpload').text('0%').css('width', '0%');
+      return;
+    }
+    if (formData.get('destination') === 'local' && window.Worker && targets.length === 0) {
+      relayUpload(file, uploadId, formData);
+    } else {
+      resumableUpload(file, uploadId, formData);
+    }
+  });
+}
+
+// Printers refuse files sliced for another machine or resolution only when
+// the print starts. The file header is checked against the target printers
+// before anything is uploaded; resolves with false if the user cancels
+function checkPrintFile(file, formData) {
+  var deferred = $.Deferred();
+  $('#progressUpload').text('Checking file...');
+
+  $.ajax({
+    url: '/upload/check?' + $.param({
+      printer: formData.get('printer'),
+      printers: formData.get('printers') || '',
+      filename: file.name
+    }),
+    type: 'POST',
+    data: file.slice(0, 256 * 1024),
+    cache: false,
+    contentType: 'application/octet-stream',
+    processData: false
+  }).done(function (res) {
+    if (res.compatible !== false) {
+      deferred.resolve(true);
+    } else if (!res.can_force) {
+      // Wrong file type or resolution: the printer would refuse to print it
+      alert(res.msg);
+      deferred.resolve(false);
+    } else if (confirm(res.msg + '\n\nSend it anyway?')) {
+      // The server checks again unless told that the user insisted
+      formData.append('force', '1');
+      deferred.resolve(true);
+    } else {
+      deferred.resolve(false);
+    }
+  }).fail(function () {
+    // The check is only a safeguard - upload anyway if it is not available
+    deferred.resolve(true);
+  });
+
+  return deferred.promise();
+}
+
+function sendUpload(formData, uploadId) {
   // Start progress tracking BEFORE starting upload to avoid race condition
   var progressEventSource = null;
   var progressStarted = false;
 
   var req = $.ajax({
-    url: '/upload',
+    // Printer and destination in the query string let the server stream the
+    // file straight to its destination folder while it arrives
+    url: '/upload?' + $.param({
+      printer: formData.get('printer'),
+      destination: formData.get('destination')
+    }),
     type: 'POST',
     data: formData,
     cache: false,
@@ -1381,7 +1476,6 @@ function uploadFile() {
             $('#progressUpload').text('Upload to ChitUI: ' + percent + '%').css('width', percent + '%');
 
             // Start server-to-printer progress tracking when client upload reaches 50%
-            // This gives time for EventSource to connect before server upload begins
             if (percent >= 50 && !progressStarted) {
               progressStarted = true;
               progressEventSource = fileTransferProgress(uploadId);
@@ -1391,71 +1485,316 @@ function uploadFile() {
       }
       return myXhr;
     }
-  })
-  req.done(function (data) {
-    $('#uploadFile').val('')
-
-    // Show success toast with appropriate message
-    var toastMsg = '✓ File uploaded successfully!';
-    if (data.usb_gadget) {
-      if (data.refresh_triggered) {
-        toastMsg = '✓ File saved to USB gadget. Checking printer...';
-      } else {
-        toastMsg = '⚠ File saved. You may need to reconnect USB or refresh on printer.';
-      }
-    }
-
-    $("#toastUploadText").text(toastMsg);
-    $("#toastUpload").show()
-    setTimeout(function () {
-      $("#toastUpload").hide()
-    }, 5000)
+  });
 
-    // Handle file list refresh based on upload type
-    if (data.usb_gadget) {
-      // USB gadget upload - use retry logic since printer may need time to detect
-      console.log('USB gadget upload detected, starting retry logic...')
-      refreshFileListWithRetry(data.filename, 0)
-    } else {
-      // Network upload - single refresh is usually sufficient
-      setTimeout(function() {
-        if (currentPrinter) {
-          console.log('Refreshing file list after network upload...')
-          refreshFileList()
-        }
-      }, 1000)
+  req.done(function (data, status, xhr) {
+    if (xhr.status !== 202) {
+      uploadDone(data);
+      return;
     }
-  })
+    // File received - the transfer to the printer runs as a background job
+    followUploadJob(data.job_id)
+      .done(uploadDone)
+      .fail(function (result) {
+        if (progressEventSource) {
+          progressEventSource.close();
+        }
+        uploadFailed({responseJSON: result});
+      });
+  });
   req.fail(function (xhr, status, error) {
     // Close progress EventSource if it was started
     if (progressEventSource) {
       progressEventSource.close();
     }
+    uploadFailed(xhr, status, error);
+  });
+}
+
+// Uploads through ChitUI's server are resumable: the file is sent in parts
+// appended at the offset the server has, so after a dropped connection (or
+// a page reload) the upload continues where it stopped instead of starting over
+var RESUMABLE_PART_SIZE = 16 * 1024 * 1024;
+var RESUMABLE_RETRIES = 5;
+
+function resumableUpload(file, uploadId, formData) {
+  var storageKey = 'resumableUpload:' + [formData.get('printer'), formData.get('destination'),
+    formData.get('printers'), file.name, file.size, file.lastModified].join(':');
+  var stored = JSON.parse(localStorage.getItem(storageKey) || 'null');
+  var progressEventSource = null;
+  var retries = 0;
+
+  if (stored) {
+    // Continuing an earlier upload: the server knows it by its upload ID
+    uploadId = stored.uploadId;
+  }
+
+  var fail = function (xhr, status, error) {
+    if (progressEventSource) {
+      progressEventSource.close();
+    }
+    uploadFailed(xhr, status, error);
+  };
+
+  var showProgress = function (loaded) {
+    var percent = Math.floor(loaded / file.size * 100);
+    $('#progressUpload').text('Upload to ChitUI: ' + percent + '%').css('width', percent + '%');
+  };
+
+  // Network errors, offset conflicts and interrupted parts resume from the
+  // offset the server reports, with a growing delay between attempts
+  var retry = function (location, xhr, status, error) {
+    var resumable = xhr.status === 0 || xhr.status === 409 || xhr.status === 423 ||
+      xhr.getResponseHeader('Upload-Offset') !== null;
+    if (!resumable || retries >= RESUMABLE_RETRIES) {
+      fail(xhr, status, error);
+      return;
+    }
+    retries++;
+    setTimeout(function () { resume(location); }, 1000 * Math.pow(2, retries - 1));
+  };
+
+  var sendPart = function (location, offset) {
+    var end = Math.min(offset + RESUMABLE_PART_SIZE, file.size);
+    if (end === file.size && !progressEventSource) {
+      // The transfer to the printer starts as soon as the last part arrives
+      progressEventSource = fileTransferProgress(uploadId);
+    }
+    $.ajax({
+      url: location,
+      type: 'PATCH',
+      data: file.slice(offset, end),
+      cache: false,
+      contentType: 'application/offset+octet-stream',
+      processData: false,
+      headers: {'Tus-Resumable': '1.0.0', 'Upload-Offset': offset},
+      xhr: function () {
+        var myXhr = $.ajaxSettings.xhr();
+        if (myXhr.upload) {
+          myXhr.upload.addEventListener('progress', function (e) {
+            showProgress(offset + e.loaded);
+          }, false);
+        }
+        return myXhr;
+      }
+    }).done(function (data, status, xhr) {
+      retries = 0;
+      if (xhr.status !== 202) {
+        sendPart(location, parseInt(xhr.getResponseHeader('Upload-Offset'), 10));
+        return;
+      }
+      // File received - the transfer to the printer runs as a background job
+      localStorage.removeItem(storageKey);
+      followUploadJob(data.job_id)
+        .done(uploadDone)
+        .fail(function (result) {
+          fail({responseJSON: result});
+        });
+    }).fail(function (xhr, status, error) {
+      retry(location, xhr, status, error);
+    });
+  };
+
+  var resume = function (location) {
+    $.ajax({url: location, type: 'HEAD', cache: false, headers: {'Tus-Resumable': '1.0.0'}})
+      .done(function (data, status, xhr) {
+        var offset = parseInt(xhr.getResponseHeader('Upload-Offset'), 10);
+        showProgress(offset);
+        sendPart(location, offset);
+      })
+      .fail(function (xhr, status, error) {
+        if (xhr.status === 404) {
+          // Expired or already finished on the server - start over
+          localStorage.removeItem(storageKey);
+          create();
+        } else {
+          retry(location, xhr, status, error);
+        }
+      });
+  };
 
-    // Reset progress bar
-    $('#progressUpload').text('0%').css('width', '0%')
-      .removeClass('progress-bar-striped progress-bar-animated text-bg-warning');
-
-    // Better error handling - check if responseJSON exists
-    var errorMsg = 'Upload failed';
-    if (xhr.responseJSON && xhr.responseJSON.msg) {
-      errorMsg = xhr.responseJSON.msg;
-    } else if (xhr.responseText) {
-      try {
-        var response = JSON.parse(xhr.responseText);
-        errorMsg = response.msg || errorMsg;
-      } catch (e) {
-        errorMsg = xhr.responseText || errorMsg;
+  var create = function () {
+    var metadata = {
+      filename: file.name,
+      printer: formData.get('printer'),
+      destination: formData.get('destination'),
+      printers: formData.get('printers'),
+      upload_id: uploadId,
+      force: formData.get('force')
+    };
+    var encoded = $.map(metadata, function (value, key) {
+      return value ? key + ' ' + btoa(unescape(encodeURIComponent(value))) : null;
+    }).join(',');
+
+    $.ajax({
+      url: '/upload/resumable',
+      type: 'POST',
+      headers: {'Tus-Resumable': '1.0.0', 'Upload-Length': file.size, 'Upload-Metadata': encoded}
+    }).done(function (data, status, xhr) {
+      var location = xhr.getResponseHeader('Location');
+      localStorage.setItem(storageKey, JSON.stringify({location: location, uploadId: uploadId}));
+      sendPart(location, 0);
+    }).fail(function (xhr, status, error) {
+      if (xhr.status === 0 || xhr.status === 404 || xhr.status === 405) {
+        // Server without resumable uploads (or unreachable) - send the file in one request
+        sendUpload(formData, uploadId);
+      } else {
+        uploadFailed(xhr, status, error);
       }
-    } else if (error) {
-      errorMsg = error;
+    });
+  };
+
+  if (stored) {
+    resume(stored.location);
+  } else {
+    create();
+  }
+}
+
+// Wait for a background upload job to finish; resolves with its result
+function followUploadJob(jobId) {
+  var deferred = $.Deferred();
+
+  var jobHandler = function (job) {
+    if (job.id !== jobId || ['succeeded', 'failed', 'interrupted'].indexOf(job.state) === -1) return;
+    socket.off('upload_job', jobHandler);
+    var result = job.result || {msg: 'Upload ' + job.state};
+    if (job.state === 'succeeded') {
+      deferred.resolve(result);
+    } else {
+      deferred.reject(result);
     }
+  };
+  socket.on('upload_job', jobHandler);
 
-    alert(errorMsg);
-  })
-  req.always(function () {
-    // Cleanup if needed
-  })
+  // The job may already have finished before the listener was attached
+  $.getJSON('/upload/jobs/' + encodeURIComponent(jobId)).done(function (data) {
+    if (data.job) jobHandler(data.job);
+  });
+
+  return deferred.promise();
+}
+
+function relayUpload(file, uploadId, formData) {
+  $('#progressUpload').text('Checksum: 0%').css('width', '0%');
+
+  var worker = new Worker('/js/md5-worker.js');
+  worker.onmessage = function (e) {
+    if (e.data.progress !== undefined) {
+      $('#progressUpload').text('Checksum: ' + e.data.progress + '%').css('width', e.data.progress + '%');
+      return;
+    }
+    worker.terminate();
+
+    if (e.data.error) {
+      // Hashing failed (e.g. file unreadable in a worker) - use a regular upload
+      console.warn('MD5 worker failed, falling back to regular upload:', e.data.error);
+      sendUpload(formData, uploadId);
+      return;
+    }
+
+    var md5 = e.data.md5;
+    var sendRelay = function () {
+      var progressTracker = fileTransferProgress(uploadId);
+      var req = $.ajax({
+        url: '/upload/relay?' + $.param({
+          printer: formData.get('printer'),
+          filename: file.name,
+          md5: md5,
+          size: file.size,
+          upload_id: uploadId,
+          force: formData.get('force') || ''
+        }),
+        type: 'POST',
+        data: file,
+        cache: false,
+        contentType: 'application/octet-stream',
+        processData: false
+      });
+
+      req.done(uploadDone);
+      req.fail(function (xhr, status, error) {
+        progressTracker.close();
+        uploadFailed(xhr, status, error);
+      });
+    };
+
+    // Nothing to send if the printer already has this exact file
+    $.getJSON('/upload/lookup', {
+      printer: formData.get('printer'),
+      filename: file.name,
+      md5: md5,
+      size: file.size
+    }).done(function (res) {
+      if (res.present) {
+        uploadDone({upload: 'success', upload_id: uploadId, usb_gadget: false, skipped: true, filename: file.name});
+      } else {
+        sendRelay();
+      }
+    }).fail(sendRelay);
+  };
+  worker.postMessage({file: file});
+}
+
+function uploadDone(data) {
+  $('#uploadFile').val('');
+
+  // Show success toast with appropriate message
+  var toastMsg = '✓ File uploaded successfully!';
+  if (data.usb_gadget) {
+    if (data.refresh_triggered) {
+      toastMsg = '✓ File saved to USB gadget. Checking printer...';
+    } else {
+      toastMsg = '⚠ File saved. You may need to reconnect USB or refresh on printer.';
+    }
+  }
+  if (data.skipped) {
+    toastMsg = '✓ Printer already has this file - transfer skipped';
+  }
+
+  $("#toastUploadText").text(toastMsg);
+  $("#toastUpload").show();
+  setTimeout(function () {
+    $("#toastUpload").hide();
+  }, 5000);
+
+  // Handle file list refresh based on upload type
+  if (data.usb_gadget) {
+    // USB gadget upload - use retry logic since printer may need time to detect
+    console.log('USB gadget upload detected, starting retry logic...');
+    refreshFileListWithRetry(data.filename, 0);
+  } else {
+    // Network upload - single refresh is usually sufficient
+    setTimeout(function() {
+      if (currentPrinter) {
+        console.log('Refreshing file list after network upload...');
+        refreshFileList();
+      }
+    }, 1000);
+  }
+}
+
+function uploadFailed(xhr, status, error) {
+  // Reset progress bar
+  $('#progressUpload').text('0%').css('width', '0%')
+    .removeClass('progress-bar-striped progress-bar-animated text-bg-warning');
+
+  // Better error handling - check if responseJSON exists
+  var errorMsg = 'Upload failed';
+  if (xhr.responseJSON && xhr.responseJSON.msg) {
+    errorMsg = xhr.responseJSON.msg;
+  } else if (xhr.responseText) {
+    try {
+      var response = JSON.parse(xhr.responseText);
+      errorMsg = response.msg || errorMsg;
+    } catch (e) {
+      errorMsg = xhr.responseText || errorMsg;
+    }
+  } else if (error) {
+    errorMsg = error;
+  }
+
+  alert(errorMsg);
 }
 
 // Helper function to generate UUID
@@ -1466,6 +1805,17 @@ function generateUUID() {
   });
 }
 
+// Transfer rate and time left of a progress event, e.g. ' (2.4 MB/s, 1:05 left)'
+function transferStats(data) {
+  if (!data.bytes_per_second) return '';
+  var stats = (data.bytes_per_second / 1048576).toFixed(1) + ' MB/s';
+  if (data.eta) {
+    var seconds = Math.round(data.eta);
+    stats += ', ' + Math.floor(seconds / 60) + ':' + ('0' + seconds % 60).slice(-2) + ' left';
+  }
+  return ' (' + stats + ')';
+}
+
 function fileTransferProgress(uploadId) {
   $('#progressUpload').addClass('progress-bar-striped progress-bar-animated')
 
@@ -1478,7 +1828,8 @@ function fileTransferProgress(uploadId) {
     console.log('Upload progress:', progressValue + '%');
 
     if (progressValue > 0) {
-      $('#progressUpload').text('Upload to printer: ' + progressValue + '%').css('width', progressValue + '%').addClass('text-bg-warning');
+      var label = data.printers ? 'Upload to ' + Object.keys(data.printers).length + ' printers: ' : 'Upload to printer: ';
+      $('#progressUpload').text(label + progressValue + '%' + transferStats(data)).css('width', progressValue + '%').addClass('text-bg-warning');
     }
     if (progressValue >= 100) {
       setTimeout(function () {
@@ -1927,6 +2278,7 @@ function handleFileSelect() {
         })
         .catch(err => console.error('Failed to check USB status:', err));
     }
+    updateUploadTargets();
   }
 }
 
@@ -0,0 +1,157 @@
+/**
+ * ChitUI - MD5 Web Worker
+ *
+ * Computes the MD5 of a File off the main thread so the browser can send the
+ * checksum to the server before the upload starts (relay uploads forward the
+ * bytes to the printer as they arrive and need the MD5 up front).
+ *
+ * Protocol:
+ *   postMessage({file: File})            -> start hashing
+ *   onmessage {progress: 0..100}         -> hashing progress
+ *   onmessage {md5: 'hex'}               -> done
+ *   onmessage {error: 'message'}         -> failed
+ */
+
+'use strict';
+
+var SLICE_SIZE = 4 * 1024 * 1024;
+
+// Per-round shift amounts and sine-derived constants (RFC 1321)
+var S = [
+  7, 12, 17, 22, 7, 12, 17, 22, 7, 12, 17, 22, 7, 12, 17, 22,
+  5, 9, 14, 20, 5, 9, 14, 20, 5, 9, 14, 20, 5, 9, 14, 20,
+  4, 11, 16, 23, 4, 11, 16, 23, 4, 11, 16, 23, 4, 11, 16, 23,
+  6, 10, 15, 21, 6, 10, 15, 21, 6, 10, 15, 21, 6, 10, 15, 21
+];
+var K = new Int32Array(64);
+for (var k = 0; k < 64; k++) {
+  K[k] = Math.floor(Math.abs(Math.sin(k + 1)) * 4294967296) | 0;
+}
+
+/**
+ * Incremental MD5 over Uint8Array chunks
+ */
+function Md5() {
+  this.state = new Int32Array([0x67452301, 0xefcdab89 | 0, 0x98badcfe | 0, 0x10325476]);
+  this.buffer = new Uint8Array(64);
+  this.bufferLength = 0;
+  this.length = 0;
+  this.words = new Int32Array(16);
+}
+
+Md5.prototype.block = function (bytes, offset) {
+  var w = this.words;
+  for (var i = 0; i < 16; i++) {
+    var j = offset + i * 4;
+    w[i] = bytes[j] | (bytes[j + 1] << 8) | (bytes[j + 2] << 16) | (bytes[j + 3] << 24);
+  }
+
+  var a = this.state[0], b = this.state[1], c = this.state[2], d = this.state[3];
+  for (var r = 0; r < 64; r++) {
+    var f, g;
+    if (r < 16) {
+      f = (b & c) | (~b & d);
+      g = r;
+    } else if (r < 32) {
+      f = (d & b) | (~d & c);
+      g = (5 * r + 1) % 16;
+    } else if (r < 48) {
+      f = b ^ c ^ d;
+      g = (3 * r + 5) % 16;
+    } else {
+      f = c ^ (b | ~d);
+      g = (7 * r) % 16;
+    }
+    var tmp = d;
+    d = c;
+    c = b;
+    var x = (a + f + K[r] + w[g]) | 0;
+    b = (b + ((x << S[r]) | (x >>> (32 - S[r])))) | 0;
+    a = tmp;
+  }
+
+  this.state[0] = (this.state[0] + a) | 0;
+  this.state[1] = (this.state[1] + b) | 0;
+  this.state[2] = (this.state[2] + c) | 0;
+  this.state[3] = (this.state[3] + d) | 0;
+};
+
+Md5.prototype.update = function (bytes) {
+  var i = 0;
+  this.length += bytes.length;
+
+  // Complete a partially filled block first
+  if (this.bufferLength > 0) {
+    var take = Math.min(64 - this.bufferLength, bytes.length);
+    this.buffer.set(bytes.subarray(0, take), this.bufferLength);
+    this.bufferLength += take;
+    i = take;
+    if (this.bufferLength < 64) return;
+    this.block(this.buffer, 0);
+    this.bufferLength = 0;
+  }
+
+  for (; i + 64 <= bytes.length; i += 64) {
+    this.block(bytes, i);
+  }
+
+  if (i < bytes.length) {
+    this.buffer.set(bytes.subarray(i), 0);
+    this.bufferLength = bytes.length - i;
+  }
+};
+
+Md5.prototype.hex = function () {
+  // Message length in bits as a 64-bit little-endian integer
+  var bitsLow = (this.length * 8) % 4294967296;
+  var bitsHigh = Math.floor(this.length / 536870912);
+
+  var padLength = (this.bufferLength < 56 ? 56 : 120) - this.bufferLength;
+  var padding = new Uint8Array(padLength + 8);
+  padding[0] = 0x80;
+  for (var i = 0; i < 4; i++) {
+    padding[padLength + i] = (bitsLow >>> (8 * i)) & 0xff;
+    padding[padLength + 4 + i] = (bitsHigh >>> (8 * i)) & 0xff;
+  }
+  var messageLength = this.length;
+  this.update(padding);
+  this.length = messageLength;
+
+  var out = '';
+  for (var w = 0; w < 4; w++) {
+    for (var b = 0; b < 4; b++) {
+      var byte = (this.state[w] >>> (8 * b)) & 0xff;
+      out += (byte < 16 ? '0' : '') + byte.toString(16);
+    }
+  }
+  return out;
+};
+
+self.onmessage = function (e) {
+  var file = e.data.file;
+  try {
+    var reader = new FileReaderSync();
+    var md5 = new Md5();
+    var lastProgress = -1;
+
+    for (var offset = 0; offset < file.size; offset += SLICE_SIZE) {
+      var slice = file.slice(offset, Math.min(offset + SLICE_SIZE, file.size));
+      md5.update(new Uint8Array(reader.readAsArrayBuffer(slice)));
+
+      var progress = Math.floor(Math.min(offset + SLICE_SIZE, file.size) / file.size * 100);
+      if (progress !== lastProgress) {
+        lastProgress = progress;
+        self.postMessage({progress: progress});
+      }
+    }
+
+    self.postMessage({md5: md5.hex()});
+  } catch (err) {
+    self.postMessage({error: err.message || String(err)});
+  }
+};
+
+// Allow the hashing code to be loaded outside a worker (e.g. for testing)
+if (typeof module !== 'undefined') {
+  module.exports = {Md5: Md5};
+}